@@ -0,0 +1,294 @@
+"""
+Execution of tests on an asyncio event loop ('--executor=asyncio').
+
+The tests are driven by a single thread running the event loop. Shell tests
+spawn their processes as usual, but rather than tying up a thread each while
+their outputs are read and their processes exit, they wait on the event loop,
+so that hundreds of tests can be in flight at once. Tests of other formats are
+executed by a pool of threads.
+
+This module requires Python 3.5 or later, and is only imported when asked for.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+
+import lit.Test
+import lit.TestRunner
+import lit.ShUtil as ShUtil
+import lit.formats
+import lit.util
+
+# The event loop can only wait on pipes on Unix, so on Windows every test is
+# executed by the thread pool.
+kUseEventLoopIO = platform.system() != 'Windows'
+
+# The longest to sleep between checks of whether the processes of a pipeline
+# have exited, once their outputs have been closed.
+kMaxExitPollInterval = 0.05
+
+async def drainPipes(loop, pipes,
+                     max_size=lit.TestRunner.kMaxCapturedOutputSize,
+                     unbounded=()):
+    """
+    drainPipes(loop, pipes, [max_size, unbounded]) -> [data]
+
+    Read all the given pipes (file objects) until they are closed, like
+    lit.TestRunner.drainPipes(), but without blocking the event loop.
+    """
+    outputs = [lit.TestRunner.BoundedOutput(None if f in unbounded
+                                            else max_size)
+               for f in pipes]
+    if not pipes:
+        return outputs
+
+    done = loop.create_future()
+    remaining = len(pipes)
+    def readable(fd, output):
+        nonlocal remaining
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            data = bytes()
+        if data:
+            output.append(data)
+            return
+        loop.remove_reader(fd)
+        remaining -= 1
+        if not remaining and not done.done():
+            done.set_result(None)
+
+    for f,output in zip(pipes, outputs):
+        loop.add_reader(f.fileno(), readable, f.fileno(), output)
+    try:
+        await done
+    finally:
+        for f in pipes:
+            loop.remove_reader(f.fileno())
+            f.close()
+    return [output.getvalue() for output in outputs]
+
+async def waitForProcesses(procs):
+    """
+    waitForProcesses(procs)
+
+    Wait for the given processes to exit, without blocking the event loop.
+    """
+    interval = 0.001
+    for p in procs:
+        while lit.util.pollProcess(p) is None:
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, kMaxExitPollInterval)
+
+def _withResourceUsage(usage, fn, *args, **kwargs):
+    # The processes spawned by the event loop thread are accounted to the test
+    # which is current only until the next await.
+    lit.util.setResourceUsage(usage)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        lit.util.setResourceUsage(None)
+
+async def executeShCmd(loop, cmd, shenv, results, usage):
+    """
+    executeShCmd(loop, cmd, shenv, results, usage) -> exitCode
+
+    Execute a command with the internal shell, as lit.TestRunner.executeShCmd()
+    does, accounting its processes to the given ResourceUsage (if not None).
+    """
+    if isinstance(cmd, ShUtil.Seq):
+        if cmd.op == ';':
+            res = await executeShCmd(loop, cmd.lhs, shenv, results, usage)
+            return await executeShCmd(loop, cmd.rhs, shenv, results, usage)
+
+        if cmd.op == '&':
+            raise lit.TestRunner.InternalShellError(
+                cmd, "unsupported shell operator: '&'")
+
+        if cmd.op == '||':
+            res = await executeShCmd(loop, cmd.lhs, shenv, results, usage)
+            if res != 0:
+                res = await executeShCmd(loop, cmd.rhs, shenv, results, usage)
+            return res
+
+        if cmd.op == '&&':
+            res = await executeShCmd(loop, cmd.lhs, shenv, results, usage)
+            if res is None:
+                return res
+
+            if res == 0:
+                res = await executeShCmd(loop, cmd.rhs, shenv, results, usage)
+            return res
+
+        raise ValueError('Unknown shell command: %r' % cmd.op)
+
+    assert isinstance(cmd, ShUtil.Pipeline)
+    pipeline = _withResourceUsage(usage, lit.TestRunner.startPipeline,
+                                  cmd, shenv)
+    outputs = await drainPipes(loop, pipeline.getPipes(),
+                               unbounded=pipeline.getInputPipes())
+    await waitForProcesses(pipeline.getProcesses())
+    return pipeline.finish(outputs, results)
+
+async def executeCommand(loop, command, cwd, env, timeoutHelper, usage):
+    """
+    executeCommand(loop, command, cwd, env, timeoutHelper, usage)
+      -> (out, err, exitCode)
+
+    Execute the given command (an argv list), like lit.util.executeCommand(),
+    with its time limit enforced by the given lit.util.TimeoutHelper.
+    """
+    kwargs = {}
+    if timeoutHelper.active():
+        kwargs = lit.util.kNewProcessGroupArgs
+    p = _withResourceUsage(usage, lit.util.Popen, command,
+                           cwd=cwd, stdin=subprocess.PIPE,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           env=env, close_fds=lit.util.kUseCloseFDs,
+                           **kwargs)
+    timeoutHelper.addProcess(p)
+    p.stdin.close()
+    out,err = await drainPipes(loop, [p.stdout, p.stderr])
+    await waitForProcesses([p])
+    exitCode = p.returncode
+    if usage is not None:
+        usage.addOutput(out, err)
+
+    # Detect Ctrl-C in subprocess.
+    if exitCode == -signal.SIGINT:
+        raise KeyboardInterrupt
+
+    # Ensure the resulting output is always of string type.
+    try:
+        out = str(out.decode('ascii'))
+    except:
+        out = str(out)
+    try:
+        err = str(err.decode('ascii'))
+    except:
+        err = str(err)
+    return out, err, exitCode
+
+async def executeShTest(loop, test, litConfig, useExternalSh, usage):
+    """
+    executeShTest(loop, test, litConfig, useExternalSh, usage) -> Result
+
+    Execute a shell test, like lit.TestRunner.executeShTest().
+    """
+    res = lit.TestRunner.prepareShTest(test, litConfig, useExternalSh)
+    if isinstance(res, lit.Test.Result):
+        return res
+    script, tmpBase, execdir, cacheKey, dependencies = res
+
+    # The time limit is kept by the event loop, rather than by a timer thread
+    # per test.
+    timeout = litConfig.getTestTimeout(test.config)
+    timeoutHelper = lit.util.TimeoutHelper(timeout)
+    timer = None
+    if timeoutHelper.active():
+        timer = loop.call_later(timeout, timeoutHelper.expire)
+    shenv = None
+    try:
+        if useExternalSh:
+            command = lit.TestRunner.writeScript(test, litConfig, tmpBase,
+                                                 script)
+            res = await executeCommand(loop, command, execdir,
+                                       test.config.environment, timeoutHelper,
+                                       usage)
+        else:
+            shenv = lit.TestRunner.ShellEnvironment(
+                execdir, test.config.environment, timeoutHelper,
+                litConfig.fileCheckMode)
+            res = lit.TestRunner.parseScriptInternal(test, litConfig, script)
+            if not isinstance(res, lit.Test.Result):
+                results = []
+                try:
+                    exitCode = await executeShCmd(loop, res, shenv, results,
+                                                  usage)
+                except lit.TestRunner.InternalShellError:
+                    e = sys.exc_info()[1]
+                    exitCode = 127
+                    results.append((e.command, '', e.message, exitCode))
+                res = (lit.TestRunner.formatCommandResults(results), '',
+                       exitCode)
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    return lit.TestRunner.finishShTest(test, litConfig, script, res, cacheKey,
+                                       timeout, timeoutHelper.timeoutReached(),
+                                       shenv, dependencies)
+
+def _runsOnEventLoop(test_format):
+    # Only the shell tests know how to wait on the event loop; a subclass which
+    # executes its tests differently is run by the thread pool.
+    return (kUseEventLoopIO and isinstance(test_format, lit.formats.ShTest) and
+            type(test_format).execute is lit.formats.ShTest.execute)
+
+async def execute_test(loop, run, test, pool):
+    """
+    execute_test(loop, run, test, pool)
+
+    Execute the test and give it its result, like lit.run.Run.execute_test().
+    """
+    test_format = test.config.test_format
+    if not _runsOnEventLoop(test_format):
+        await loop.run_in_executor(pool, run.execute_test, test)
+        return
+
+    usage = None
+    if run.lit_config.trackResourceUsage:
+        usage = lit.util.ResourceUsage()
+    start_time = time.time()
+    try:
+        result = run.check_result(
+            await executeShTest(loop, test, run.lit_config,
+                                test_format.execute_external, usage))
+    except KeyboardInterrupt:
+        raise
+    except:
+        result = run.get_exception_result()
+    run.set_test_result(test, result, start_time, usage)
+
+def execute_tests(run, provider, consumer, jobs):
+    """
+    execute_tests(run, provider, consumer, jobs)
+
+    Execute the tests handed out by the provider (which must never block), up
+    to jobs of them at a time, and report each result to the consumer.
+    """
+    loop = asyncio.new_event_loop()
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(jobs, lit.util.detectCPUs())))
+
+    async def worker():
+        while True:
+            test_index = provider.get()
+            if test_index is None:
+                break
+            test = run.tests[test_index]
+            try:
+                await execute_test(loop, run, test, pool)
+            except KeyboardInterrupt:
+                # Like lit.run.Tester, take down the processes of the tests
+                # still in flight.
+                print('\nCtrl-C detected, goodbye.')
+                os.kill(0,9)
+            provider.release(test_index)
+            consumer.update(test_index, test)
+        consumer.task_finished()
+
+    async def run_workers():
+        await asyncio.gather(*[worker() for i in range(jobs)])
+
+    try:
+        loop.run_until_complete(run_workers())
+    finally:
+        pool.shutdown()
+        loop.close()
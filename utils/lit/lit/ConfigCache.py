@@ -0,0 +1,86 @@
+"""
+Persistent cache of the compiled code of configuration files (lit.cfg,
+lit.site.cfg and lit.local.cfg).
+
+Every run of lit loads the configuration files of the test suites, and of
+each directory with a local configuration, and compiling them is most of the
+cost of loading them. The code objects are therefore kept (marshalled) in the
+lit cache directory, keyed by the path and contents of the file, and by the
+version of Python, whose code objects and marshal format are specific to it.
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import types
+
+import lit.util
+
+class ConfigCache(object):
+    """
+    ConfigCache - An on disk store of compiled configuration files.
+
+    Each entry is a separate file, so concurrent lit processes can safely
+    share a cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def compile(self, data, path):
+        """
+        compile(data, path) -> code
+
+        Return the code compile(data, path, 'exec') returns for the contents
+        (data) of the configuration file at path, reusing the stored code if
+        the file has been compiled with the same contents before. Errors are
+        raised as by compile(), and nothing is stored for them.
+        """
+        if not isinstance(data, bytes):
+            encoded = data.encode('utf-8')
+        else:
+            encoded = data
+        h = hashlib.sha1(('%s\0%s\0' % (sys.version, path)).encode('utf-8'))
+        h.update(encoded)
+        key = h.hexdigest()
+        entry_path = os.path.join(self.path, key[:2], key)
+
+        try:
+            f = open(entry_path, 'rb')
+        except IOError:
+            f = None
+        if f is not None:
+            try:
+                try:
+                    code = marshal.load(f)
+                    if isinstance(code, types.CodeType):
+                        return code
+                except Exception:
+                    pass
+            finally:
+                f.close()
+
+        code = compile(data, path, 'exec', 0, True)
+        self._store(entry_path, code)
+        return code
+
+    def _store(self, entry_path, code):
+        entry_dir = os.path.dirname(entry_path)
+        try:
+            lit.util.mkdir_p(entry_dir)
+            fd,temp_path = tempfile.mkstemp(dir=entry_dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                marshal.dump(code, f)
+            finally:
+                f.close()
+            try:
+                os.rename(temp_path, entry_path)
+            except OSError:
+                # Windows doesn't allow renaming over an existing file.
+                os.remove(entry_path)
+                os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,162 @@
+"""
+Persistent index of the files each test depends on, used to select the tests
+affected by a change ('lit --changed').
+
+The dependencies of an ShTest are its source, the executables its RUN lines
+(after substitution) invoke, and the (existing) input files they name, as
+found by lit.ResultCache.getScriptReferences(). They are recorded as the
+tests are executed, and kept in an index (in the lit cache directory) keyed
+by the execution path of each test, so that the same tests of different build
+trees have separate entries.
+
+Given a list of changed files (or rebuilt executables), the tests selected are
+those depending on any of them, along with the tests whose dependencies are
+unknown: tests which were never executed with the index enabled, tests whose
+dependencies couldn't be determined, and tests of other formats. A change to a
+configuration file can affect any test, so it selects all of them.
+"""
+
+import os
+import pickle
+import tempfile
+import time
+
+import lit.util
+
+# Bump this when the format of the index changes.
+kIndexFormatVersion = 1
+
+# Entries which have not been recorded for this long (in seconds) are dropped
+# from the index.
+kMaxEntryAge = 30 * 24 * 60 * 60
+
+def getDependencies(test, references):
+    """
+    getDependencies(test, references) -> (path) or None
+
+    Return the paths of the files the given ShTest depends on, given the
+    references lit.ResultCache.getScriptReferences() found in its script, or
+    None if they are unknown.
+    """
+    if references is None:
+        return None
+    paths = [test.getSourcePath()]
+    for kind,name in references:
+        if kind != 'builtin':
+            paths.append(name)
+    res = []
+    for path in paths:
+        path = os.path.realpath(path)
+        if path not in res:
+            res.append(path)
+    return tuple(res)
+
+class DependencyIndex(object):
+    """
+    DependencyIndex - The files the tests depend on, backed by an index on
+    disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # The recorded entries, as {test exec path : (recorded time,
+        # dependencies or None)}.
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return {}
+        try:
+            try:
+                version,entries = pickle.load(f)
+            except Exception:
+                return {}
+        finally:
+            f.close()
+        if version != kIndexFormatVersion:
+            return {}
+        return entries
+
+    def save(self):
+        """save() - Write the index back to disk."""
+        now = time.time()
+        entries = dict((key, value) for key,value in self.entries.items()
+                       if now - value[0] < kMaxEntryAge)
+        try:
+            lit.util.mkdir_p(os.path.dirname(self.path))
+            fd,temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump((kIndexFormatVersion, entries), f, 2)
+            finally:
+                f.close()
+            try:
+                os.rename(temp_path, self.path)
+            except OSError:
+                # Windows doesn't allow renaming over an existing file.
+                os.remove(self.path)
+                os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def update(self, tests):
+        """
+        update(tests)
+
+        Record the dependencies of the given (executed) tests, for those whose
+        result carries them (see lit.TestRunner.prepareShTest()).
+        """
+        now = time.time()
+        # Share the strings of the paths many tests depend on (the tools),
+        # which pickle then only stores once.
+        paths = {}
+        for test in tests:
+            result = test.result
+            if result is None or not hasattr(result, 'dependencies'):
+                continue
+            dependencies = result.dependencies
+            if dependencies is not None:
+                dependencies = tuple(paths.setdefault(p, p)
+                                     for p in dependencies)
+            self.entries[test.getExecPath()] = (now, dependencies)
+
+    def selectAffectedTests(self, tests, changed, litConfig):
+        """
+        selectAffectedTests(tests, changed, litConfig) -> [test]
+
+        Select the tests affected by the given changed paths (files, or
+        directories whose contents changed).
+        """
+        configNames = (litConfig.config_name, litConfig.site_config_name,
+                       litConfig.local_config_name)
+        changedFiles = set()
+        changedDirs = []
+        for path in changed:
+            # Match the templates of configuration files (like
+            # lit.site.cfg.in) as well.
+            name = os.path.basename(path)
+            for configName in configNames:
+                if name.startswith(configName):
+                    return list(tests)
+
+            path = os.path.realpath(path)
+            if os.path.isdir(path):
+                changedDirs.append(path.rstrip(os.sep) + os.sep)
+            else:
+                changedFiles.add(path)
+
+        def isAffected(test):
+            entry = self.entries.get(test.getExecPath())
+            if entry is None or entry[1] is None:
+                return True
+            for path in entry[1]:
+                if path in changedFiles:
+                    return True
+                for dir in changedDirs:
+                    if path.startswith(dir):
+                        return True
+            return False
+
+        return [t for t in tests if isAffected(t)]
@@ -0,0 +1,137 @@
+"""
+Persistent cache of the directory listings used by test discovery.
+
+Discovery needs to know which entries of every directory in a test suite are
+files and which are subdirectories, which costs a listdir() plus a stat() per
+entry. This information only changes when the modification time of the
+directory changes, so it is kept in an index (in the lit cache directory) and
+revalidated with a single stat() of each directory on subsequent runs.
+
+Note that the configuration files are still executed on every run, as the
+objects they create (test formats, environments, ...) cannot be persisted.
+Everything derived from the configuration (suffixes, excludes, nested suites
+and local configurations) is recomputed from the cached listings.
+"""
+
+import os
+import pickle
+import tempfile
+import time
+
+import lit.util
+
+# Bump this when the format of the index changes.
+kIndexFormatVersion = 1
+
+# Listings of directories modified more recently than this (in seconds) are not
+# persisted, as any further changes made within the timestamp granularity of
+# the file system would go unnoticed.
+kRacyInterval = 2.0
+
+# Entries which have not been used for this long (in seconds) are dropped from
+# the index.
+kMaxEntryAge = 30 * 24 * 60 * 60
+
+class DiscoveryCache(object):
+    """
+    DiscoveryCache - Directory listings for test discovery, optionally backed
+    by an index on disk.
+
+    Even without an index, listings are reused for the duration of a run.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        # The persisted entries, as {directory : (mtime, filenames, dirnames,
+        # last used time)}.
+        self.entries = {}
+        # The listings already validated in this run.
+        self.listings = {}
+
+        if path is not None:
+            self.entries = self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return {}
+        try:
+            try:
+                version,entries = pickle.load(f)
+            except Exception:
+                return {}
+        finally:
+            f.close()
+        if version != kIndexFormatVersion:
+            return {}
+        return entries
+
+    def save(self):
+        """save() - Write the index back to disk, if there is one."""
+        if self.path is None:
+            return
+
+        now = time.time()
+        entries = dict((key, value) for key,value in self.entries.items()
+                       if now - value[3] < kMaxEntryAge)
+        try:
+            lit.util.mkdir_p(os.path.dirname(self.path))
+            fd,temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump((kIndexFormatVersion, entries), f, 2)
+            finally:
+                f.close()
+            try:
+                os.rename(temp_path, self.path)
+            except OSError:
+                # Windows doesn't allow renaming over an existing file.
+                os.remove(self.path)
+                os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def listdir(self, path):
+        """
+        listdir(path) -> (filenames, dirnames)
+
+        Return the names of the non-directory and directory entries of the
+        given directory, in the order returned by os.listdir(). Raises OSError
+        if the directory cannot be read.
+        """
+        res = self.listings.get(path)
+        if res is not None:
+            return res
+
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        now = time.time()
+        if entry is not None and entry[0] == st.st_mtime:
+            res = entry[1:3]
+        else:
+            filenames = []
+            dirnames = []
+            for name in os.listdir(path):
+                if os.path.isdir(os.path.join(path, name)):
+                    dirnames.append(name)
+                else:
+                    filenames.append(name)
+            res = (filenames, dirnames)
+
+        if now - st.st_mtime > kRacyInterval:
+            self.entries[path] = (st.st_mtime,) + tuple(res) + (now,)
+        else:
+            self.entries.pop(path, None)
+        self.listings[path] = res
+        return res
+
+    def exists(self, path):
+        """exists(path) - Check whether the file (or directory) at the given
+        path exists, using the listing of its parent directory."""
+        parent,name = os.path.split(path)
+        try:
+            filenames,dirnames = self.listdir(parent)
+        except OSError:
+            return False
+        return name in filenames or name in dirnames
@@ -0,0 +1,1108 @@
+"""
+An implementation of FileCheck (utils/FileCheck) which the internal shell
+executes in-process, rather than spawning the tool for every RUN line which
+ends in '| FileCheck %s' (see lit.TestRunner.prepareBuiltinFileCheck()).
+
+It reproduces the checks, exit code and diagnostics of the tool, quirks
+included, for the options and directives it supports: CHECK, CHECK-NEXT,
+CHECK-NOT, CHECK-DAG and CHECK-LABEL, with {{regex}} patterns and [[VAR]] and
+[[VAR:regex]] variables. prepare() declines (by returning None) to emulate
+anything else, leaving it to the tool. That includes regexes using alternation,
+because the tool's POSIX regex library picks the longest alternative where
+Python's picks the first one which matches.
+"""
+
+import os
+import re
+import sys
+
+class Unsupported(Exception):
+    """
+    Unsupported - Raised for a command line or check file which the tool would
+    not be emulated faithfully for.
+    """
+
+def _isAlnum(c):
+    # The tool classifies characters in the C locale.
+    return c.isalnum() and ord(c) < 128
+
+def _isDigit(c):
+    return c.isdigit() and ord(c) < 128
+
+###
+
+class SourceBuffer(object):
+    """
+    SourceBuffer - The contents of the check file or of the input, which
+    diagnostics point into, as llvm::SourceMgr prints them.
+    """
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def getMessage(self, pos, kind, message):
+        text = self.text
+        lineStart = max(text.rfind('\n', 0, pos), text.rfind('\r', 0, pos)) + 1
+        lineEnd = len(text)
+        for c in '\n\r':
+            end = text.find(c, pos)
+            if end != -1:
+                lineEnd = min(lineEnd, end)
+        line = text[lineStart:lineEnd]
+        column = pos - lineStart
+
+        res = '%s:%d:%d: %s: %s\n' % (self.name, text.count('\n', 0, pos) + 1,
+                                      column + 1, kind, message)
+        res += _expandTabs(line, line) + '\n'
+        if [c for c in line if ord(c) >= 128]:
+            return res
+        caret = [' '] * (len(line) + 1)
+        caret[min(column, len(line))] = '^'
+        return res + _expandTabs(''.join(caret).rstrip(' '), line) + '\n'
+
+def _expandTabs(s, line):
+    # Each tab of the line is expanded to the next multiple of 8 columns, and
+    # the same columns of s are padded with the character at the tab.
+    res = []
+    column = 0
+    for i,c in enumerate(s):
+        if i >= len(line) or line[i] != '\t':
+            res.append(c)
+            column += 1
+            continue
+        if c == '\t':
+            c = ' '
+        while True:
+            res.append(c)
+            column += 1
+            if column % 8 == 0:
+                break
+    return ''.join(res)
+
+def _writeEscaped(s):
+    res = []
+    for c in s:
+        if c == '\\':
+            res.append('\\\\')
+        elif c == '\t':
+            res.append('\\t')
+        elif c == '\n':
+            res.append('\\n')
+        elif c == '"':
+            res.append('\\"')
+        elif 32 <= ord(c) < 127:
+            res.append(c)
+        else:
+            res.append('\\%03o' % ord(c))
+    return ''.join(res)
+
+def _editDistance(peq, m, s):
+    """_editDistance(peq, m, s) -> distance
+
+    Compute the edit distance between a string of length m and s, given the
+    bit mask of the positions of each character in the string (peq), using
+    the bit-parallel algorithm of Myers (as extended by Hyyro to the
+    distance between whole strings)."""
+    if not m:
+        return len(s)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    for c in s:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score
+
+###
+
+# The characters of the POSIX character classes, in the C locale, as ranges.
+kCharacterClasses = {
+    'alnum' : [('0', '9'), ('A', 'Z'), ('a', 'z')],
+    'alpha' : [('A', 'Z'), ('a', 'z')],
+    'blank' : [(' ', ' '), ('\t', '\t')],
+    'cntrl' : [('\x00', '\x1f'), ('\x7f', '\x7f')],
+    'digit' : [('0', '9')],
+    'graph' : [('!', '~')],
+    'lower' : [('a', 'z')],
+    'print' : [(' ', '~')],
+    'punct' : [('!', '/'), (':', '@'), ('[', '`'), ('{', '~')],
+    'space' : [('\t', '\r'), (' ', ' ')],
+    'upper' : [('A', 'Z')],
+    'xdigit' : [('0', '9'), ('A', 'F'), ('a', 'f')],
+}
+
+# The largest repetition count the tool's regex library accepts.
+kMaxRepetitions = 255
+
+def escapeForRegex(s):
+    """escapeForRegex(s) -> regex
+
+    Return a Python regex matching s (and only s)."""
+    return ''.join(_escapeChar(c) for c in s)
+
+def _escapeChar(c):
+    if _isAlnum(c):
+        return c
+    return '\\x%02x' % ord(c)
+
+class RegexTranslator(object):
+    """
+    RegexTranslator - Translates a POSIX extended regex, as the regex library
+    of the tool (lib/Support/regcomp.c) parses it, into a Python regex which
+    matches the same strings, with the regex library's REG_NEWLINE semantics.
+    Raises Unsupported for regexes which are invalid, or which the two could
+    match differently.
+    """
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.pos = 0
+        self.out = []
+        # The number of groups.
+        self.numGroups = 0
+        # Whether the regex has a '^' anchor.
+        self.usesBOL = False
+
+    def translate(self):
+        self.parseERE(None)
+        return ''.join(self.out)
+
+    def more(self, n=1):
+        return self.pos + n <= len(self.regex)
+
+    def peek(self, n=0):
+        if self.pos + n < len(self.regex):
+            return self.regex[self.pos + n]
+        return ''
+
+    def eat(self, s):
+        if self.regex.startswith(s, self.pos):
+            self.pos += len(s)
+            return True
+        return False
+
+    def parseERE(self, stop):
+        numAtoms = 0
+        while self.more() and self.peek() not in ('|', stop):
+            self.parseAtom()
+            numAtoms += 1
+        if not numAtoms or self.more() and self.peek() == '|':
+            raise Unsupported()
+
+    def parseAtom(self):
+        c = self.peek()
+        self.pos += 1
+        isCaret = False
+        if c == '(':
+            if not self.more():
+                raise Unsupported()
+            self.numGroups += 1
+            self.out.append('(')
+            if self.peek() != ')':
+                self.parseERE(')')
+            if not self.eat(')'):
+                raise Unsupported()
+            self.out.append(')')
+        elif c == '^':
+            self.out.append('^')
+            self.usesBOL = isCaret = True
+        elif c == '$':
+            self.out.append('$')
+        elif c == '.':
+            self.out.append('.')
+        elif c == '[':
+            self.parseBracket()
+        elif c == '\\':
+            if not self.more():
+                raise Unsupported()
+            c = self.peek()
+            self.pos += 1
+            # Backreferences refer to the groups of the whole pattern, which
+            # the regex library then mishandles in various ways.
+            if '1' <= c <= '9':
+                raise Unsupported()
+            self.out.append(_escapeChar(c))
+        elif c in ')|*+?' or (c == '{' and _isDigit(self.peek())):
+            raise Unsupported()
+        else:
+            self.out.append(_escapeChar(c))
+
+        if not self.isRepetition():
+            return
+        if isCaret:
+            raise Unsupported()
+        c = self.peek()
+        self.pos += 1
+        if c != '{':
+            self.out.append(c)
+        else:
+            low = high = self.parseCount()
+            if self.eat(','):
+                high = None
+                if _isDigit(self.peek()):
+                    high = self.parseCount()
+                    if low > high:
+                        raise Unsupported()
+            if not self.eat('}'):
+                raise Unsupported()
+            if high == low:
+                self.out.append('{%d}' % low)
+            elif high is None:
+                self.out.append('{%d,}' % low)
+            else:
+                self.out.append('{%d,%d}' % (low, high))
+        if self.isRepetition():
+            raise Unsupported()
+
+    def isRepetition(self):
+        c = self.peek()
+        return c in ('*', '+', '?') or (c == '{' and _isDigit(self.peek(1)))
+
+    def parseCount(self):
+        start = self.pos
+        while _isDigit(self.peek()):
+            self.pos += 1
+        if start == self.pos or int(self.regex[start:self.pos]) > kMaxRepetitions:
+            raise Unsupported()
+        return int(self.regex[start:self.pos])
+
+    def parseBracket(self):
+        if (self.regex.startswith('[:<:]]', self.pos) or
+              self.regex.startswith('[:>:]]', self.pos)):
+            raise Unsupported()
+        invert = self.eat('^')
+        ranges = []
+        if self.eat(']'):
+            ranges.append((']', ']'))
+        elif self.eat('-'):
+            ranges.append(('-', '-'))
+        while (self.more() and self.peek() != ']' and
+               not self.regex.startswith('-]', self.pos)):
+            self.parseBracketTerm(ranges)
+        if self.eat('-'):
+            ranges.append(('-', '-'))
+        if not self.eat(']'):
+            raise Unsupported()
+
+        items = []
+        for low,high in ranges:
+            if low == high:
+                items.append('\\x%02x' % ord(low))
+            else:
+                items.append('\\x%02x-\\x%02x' % (ord(low), ord(high)))
+        # With REG_NEWLINE, an inverted bracket never matches a newline.
+        if invert:
+            self.out.append('[^%s\\n]' % ''.join(items))
+        else:
+            self.out.append('[%s]' % ''.join(items))
+
+    def parseBracketTerm(self, ranges):
+        if self.peek() == '-':
+            raise Unsupported()
+        if self.eat('[:'):
+            start = self.pos
+            while self.peek().isalpha():
+                self.pos += 1
+            name = self.regex[start:self.pos]
+            if name not in kCharacterClasses or not self.eat(':]'):
+                raise Unsupported()
+            ranges.extend(kCharacterClasses[name])
+            return
+        if self.regex.startswith('[=', self.pos):
+            raise Unsupported()
+
+        low = high = self.parseBracketSymbol()
+        if self.peek() == '-' and self.more(2) and self.peek(1) != ']':
+            self.pos += 1
+            if self.eat('-'):
+                high = '-'
+            else:
+                high = self.parseBracketSymbol()
+        if low > high:
+            raise Unsupported()
+        ranges.append((low, high))
+
+    def parseBracketSymbol(self):
+        if not self.more() or self.regex.startswith('[.', self.pos):
+            raise Unsupported()
+        c = self.peek()
+        self.pos += 1
+        if ord(c) >= 128:
+            raise Unsupported()
+        return c
+
+def _posixEscape(s):
+    # How the tool escapes a fixed string into a regex.
+    return re.sub(r'([()^$|*+?.\[\\{])', r'\\\1', s)
+
+###
+
+class Pattern(object):
+    """
+    Pattern - A pattern to match the input against, parsed from a check line.
+    """
+
+    def __init__(self, matchEOF=False):
+        # Whether the pattern only matches the end of the input (the pattern of
+        # the trailing CHECK-NOT and CHECK-DAG lines).
+        self.matchEOF = matchEOF
+        self.matchNot = False
+        self.matchDag = False
+        # The position of the pattern in the check file, and its line.
+        self.pos = None
+        self.lineNumber = None
+        # If not empty, the pattern is this fixed string.
+        self.fixedStr = ''
+        # Otherwise, the pattern is this regex, as the tool writes it (only
+        # used to look for a likely intended match), and as a Python regex.
+        self.regExStr = ''
+        self.pyRegExStr = ''
+        self.regex = None
+        self.usesBOL = False
+        # The [[VAR]] uses of variables defined by earlier lines, as (name,
+        # offset in pyRegExStr), and the group of each [[VAR:regex]]
+        # definition.
+        self.variableUses = []
+        self.variableDefs = {}
+        self._examplePeq = None
+
+    def hasVariable(self):
+        return bool(self.variableUses or self.variableDefs)
+
+    def parse(self, fc, start, end, lineNumber):
+        """parse(fc, start, end, lineNumber) -> success
+
+        Parse the pattern at [start, end) of the check file."""
+        text = fc.checkBuffer.text
+        self.lineNumber = lineNumber
+        self.pos = start
+
+        while end > start and text[end - 1] in ' \t':
+            end -= 1
+        if start == end:
+            fc.error(fc.checkBuffer, start,
+                     "found empty check string with prefix '%s:'" % (
+                         fc.prefix,))
+            return False
+
+        s = text[start:end]
+        if len(s) < 2 or ('{{' not in s and '[[' not in s):
+            self.fixedStr = s
+            return True
+
+        # Group 0 is the whole match.
+        curParen = 1
+        i = 0
+        while i < len(s):
+            if s.startswith('{{', i):
+                close = s.find('}}', i)
+                if close == -1:
+                    fc.error(fc.checkBuffer, start + i,
+                             "found start of regex string with no end '}}'")
+                    return False
+                # The regex is grouped, in case it has an alternation.
+                self.regExStr += '('
+                self.pyRegExStr += '('
+                curParen += 1
+                curParen += self.addRegex(s[i+2:close])
+                self.regExStr += ')'
+                self.pyRegExStr += ')'
+                i = close + 2
+                continue
+
+            if s.startswith('[[', i):
+                nameStart = i + 2
+                close = self.findRegexVarEnd(s, nameStart)
+                if close == -1:
+                    fc.error(fc.checkBuffer, start + i,
+                             "invalid named regex reference, no ]] found")
+                    return False
+                matchStr = s[nameStart:close]
+                i = close + 2
+
+                nameEnd = matchStr.find(':')
+                if nameEnd == -1:
+                    name = matchStr
+                else:
+                    name = matchStr[:nameEnd]
+                if not name:
+                    fc.error(fc.checkBuffer, start + nameStart,
+                             "invalid name in named regex: empty name")
+                    return False
+
+                # Besides names, @LINE, @LINE+N and @LINE-N expressions can be
+                # used.
+                isExpression = False
+                for k,c in enumerate(name):
+                    if k == 0 and c == '@':
+                        if nameEnd != -1:
+                            fc.error(fc.checkBuffer, start + nameStart,
+                                     "invalid name in named regex definition")
+                            return False
+                        isExpression = True
+                        continue
+                    if (c != '_' and not _isAlnum(c) and
+                          (not isExpression or c not in '+-')):
+                        fc.error(fc.checkBuffer, start + nameStart + k,
+                                 "invalid name in named regex")
+                        return False
+                if _isDigit(name[0]):
+                    fc.error(fc.checkBuffer, start + nameStart,
+                             "invalid name in named regex")
+                    return False
+
+                if nameEnd == -1:
+                    # The tool matches a variable defined earlier on the same
+                    # line with a backreference, which its regex library
+                    # mishandles in various ways.
+                    group = self.variableDefs.get(name)
+                    if group is None:
+                        self.variableUses.append((name,
+                                                  len(self.pyRegExStr)))
+                    elif group > 9:
+                        fc.error(fc.checkBuffer, start + nameStart,
+                                 "Can't back-reference more than 9 variables")
+                        return False
+                    else:
+                        raise Unsupported()
+                    continue
+
+                self.variableDefs[name] = curParen
+                self.regExStr += '('
+                self.pyRegExStr += '('
+                curParen += 1
+                curParen += self.addRegex(matchStr[nameEnd+1:])
+                self.regExStr += ')'
+                self.pyRegExStr += ')'
+
+            # The fixed string up to the next regex.
+            close = len(s)
+            for delim in ('{{', '[['):
+                pos = s.find(delim, i)
+                if pos != -1:
+                    close = min(close, pos)
+            self.regExStr += _posixEscape(s[i:close])
+            self.pyRegExStr += escapeForRegex(s[i:close])
+            i = close
+
+        try:
+            regex = re.compile(self.pyRegExStr, re.M)
+        except re.error:
+            raise Unsupported()
+        if not self.variableUses:
+            self.regex = regex
+        return True
+
+    def addRegex(self, regex):
+        translator = RegexTranslator(regex)
+        self.pyRegExStr += translator.translate()
+        self.regExStr += regex
+        self.usesBOL = self.usesBOL or translator.usesBOL
+        return translator.numGroups
+
+    def findRegexVarEnd(self, s, i):
+        # Find the ']]' closing the variable starting at i, skipping any
+        # brackets of its regex.
+        depth = 0
+        while i < len(s):
+            if s.startswith(']]', i) and depth == 0:
+                return i
+            if s[i] == '\\':
+                i += 2
+                continue
+            if s[i] == '[':
+                depth += 1
+            elif s[i] == ']':
+                # The tool asserts on this.
+                if not depth:
+                    raise Unsupported()
+                depth -= 1
+            i += 1
+        return -1
+
+    def evaluateExpression(self, expr):
+        if not expr.startswith('@LINE'):
+            return None
+        expr = expr[len('@LINE'):]
+        offset = 0
+        if expr:
+            if expr[0] == '+':
+                expr = expr[1:]
+            elif expr[0] != '-':
+                return None
+            if not re.match('-?[0-9]+$', expr):
+                return None
+            offset = int(expr)
+        return str(self.lineNumber + offset)
+
+    def match(self, text, buf, variables):
+        """match(text, buf, variables) -> (pos, length) or None
+
+        Find the first match of the pattern in the buffer (a (start, end)
+        range of text), relative to its start, defining the variables it
+        captures."""
+        start,end = buf
+        if self.matchEOF:
+            return end - start, 0
+
+        if self.fixedStr:
+            pos = text.find(self.fixedStr, start, end)
+            if pos == -1:
+                return None
+            return pos - start, len(self.fixedStr)
+
+        regex = self.regex
+        if regex is None:
+            parts = []
+            last = 0
+            for name,offset in self.variableUses:
+                if name[0] == '@':
+                    value = self.evaluateExpression(name)
+                else:
+                    value = variables.get(name)
+                    if value is not None:
+                        value = escapeForRegex(value)
+                if value is None:
+                    return None
+                parts.append(self.pyRegExStr[last:offset])
+                parts.append(value)
+                last = offset
+            parts.append(self.pyRegExStr[last:])
+            regex = re.compile(''.join(parts), re.M)
+
+        # The buffer is matched as a string of its own, where '^' matches at
+        # the start even if it is in the middle of a line.
+        if start and self.usesBOL and text[start - 1] != '\n':
+            m = regex.search(text[start:end])
+            offset = 0
+        else:
+            m = regex.search(text, start, end)
+            offset = start
+        if m is None:
+            return None
+
+        for name,group in self.variableDefs.items():
+            variables[name] = m.group(group) or ''
+        return m.start() - offset, m.end() - m.start()
+
+    def computeMatchDistance(self, text, pos, end):
+        # Compare the pattern (or the regex itself) against the same length of
+        # the text, up to the end of its line.
+        example = self.fixedStr or self.regExStr
+        if self._examplePeq is None:
+            peq = {}
+            for i,c in enumerate(example):
+                peq[c] = peq.get(c, 0) | (1 << i)
+            self._examplePeq = peq
+        prefix = text[pos:min(pos + len(example), end)].split('\n', 1)[0]
+        return _editDistance(self._examplePeq, len(example), prefix)
+
+    def printFailureInfo(self, fc, buf, variables):
+        text = fc.inputBuffer.text
+        start,end = buf
+        for name,offset in self.variableUses:
+            if name[0] == '@':
+                value = self.evaluateExpression(name)
+                if value is not None:
+                    message = 'with expression "%s" equal to "%s"' % (
+                        _writeEscaped(name), _writeEscaped(value))
+                else:
+                    message = 'uses incorrect expression "%s"' % (
+                        _writeEscaped(name),)
+            else:
+                value = variables.get(name)
+                if value is None:
+                    message = 'uses undefined variable "%s"' % (
+                        _writeEscaped(name),)
+                else:
+                    message = 'with variable "%s" equal to "%s"' % (
+                        _writeEscaped(name), _writeEscaped(value))
+            fc.note(fc.inputBuffer, start, message)
+
+        # Point out the closest fuzzy match within the next 4K of the input,
+        # favoring the earlier lines.
+        numLinesForward = 0
+        best = None
+        bestQuality = 0
+        for i in range(min(4096, end - start)):
+            c = text[start + i]
+            if c == '\n':
+                numLinesForward += 1
+            if c in ' \t':
+                continue
+            quality = (self.computeMatchDistance(text, start + i, end) +
+                       numLinesForward / 100.)
+            if quality < bestQuality or best is None:
+                best = i
+                bestQuality = quality
+        if best and bestQuality < 50:
+            fc.note(fc.inputBuffer, start + best,
+                    "possible intended match here")
+
+###
+
+def _substr(buf, start, length=None):
+    # A subrange of a (start, end) buffer, as StringRef::substr() clamps it.
+    bufStart,bufEnd = buf
+    start = min(bufStart + start, bufEnd)
+    if length is None:
+        return start, bufEnd
+    return start, min(start + length, bufEnd)
+
+class CheckString(object):
+    """
+    CheckString - A check (other than CHECK-NOT and CHECK-DAG) read from the
+    check file, along with the CHECK-NOT and CHECK-DAG lines preceding it.
+    """
+
+    def __init__(self, pattern, pos, isCheckNext, isCheckLabel):
+        self.pattern = pattern
+        self.pos = pos
+        self.isCheckNext = isCheckNext
+        self.isCheckLabel = isCheckLabel
+        self.dagNotPatterns = []
+
+    def check(self, fc, buf, isLabel, variables):
+        """check(fc, buf, isLabel, variables) -> (pos, length) or None
+
+        Match the check, and the CHECK-NOT and CHECK-DAG lines preceding it
+        (unless only looking for a label), in the buffer."""
+        lastPos = 0
+        notPatterns = []
+        if not isLabel:
+            lastPos = self.checkDag(fc, buf, notPatterns, variables)
+            if lastPos is None:
+                return None
+
+        matchBuf = _substr(buf, lastPos)
+        m = self.pattern.match(fc.inputBuffer.text, matchBuf, variables)
+        if m is None:
+            fc.printCheckFailed(self.pos, self.pattern, matchBuf, variables)
+            return None
+        matchPos,matchLen = m
+        matchPos += lastPos
+
+        if not isLabel:
+            # Note that (like the tool) the skipped region runs past the match
+            # when there were CHECK-DAG matches.
+            skipped = _substr(buf, lastPos, matchPos)
+            if self.checkNext(fc, skipped):
+                return None
+            if self.checkNot(fc, skipped, notPatterns, variables):
+                return None
+        return matchPos, matchLen
+
+    def checkNext(self, fc, buf):
+        if not self.isCheckNext:
+            return False
+
+        start,end = buf
+        text = fc.inputBuffer.text
+        numNewLines = 0
+        i = start
+        while i < end:
+            if text[i] in '\n\r':
+                numNewLines += 1
+                # '\n\r' and '\r\n' are a single newline.
+                if (i + 1 < end and text[i + 1] in '\n\r' and
+                      text[i] != text[i + 1]):
+                    i += 1
+            i += 1
+
+        if numNewLines == 1:
+            return False
+        if numNewLines == 0:
+            message = 'is on the same line as previous match'
+        else:
+            message = 'is not on the line after the previous match'
+        fc.error(fc.checkBuffer, self.pos,
+                 '%s-NEXT: %s' % (fc.prefix, message))
+        fc.note(fc.inputBuffer, end, "'next' match was here")
+        fc.note(fc.inputBuffer, start, "previous match ended here")
+        return True
+
+    def checkNot(self, fc, buf, notPatterns, variables):
+        for pattern in notPatterns:
+            m = pattern.match(fc.inputBuffer.text, buf, variables)
+            if m is None:
+                continue
+            fc.error(fc.inputBuffer, buf[0] + m[0],
+                     '%s-NOT: string occurred!' % (fc.prefix,))
+            fc.note(fc.checkBuffer, pattern.pos,
+                    '%s-NOT: pattern specified here' % (fc.prefix,))
+            return True
+        return False
+
+    def checkDag(self, fc, buf, notPatterns, variables):
+        if not self.dagNotPatterns:
+            return 0
+
+        lastPos = startPos = 0
+        for pattern in self.dagNotPatterns:
+            if pattern.matchNot:
+                notPatterns.append(pattern)
+                continue
+
+            # A group of CHECK-DAG lines is matched from its start, and fails
+            # as soon as one of them doesn't match.
+            matchBuf = _substr(buf, startPos)
+            m = pattern.match(fc.inputBuffer.text, matchBuf, variables)
+            if m is None:
+                fc.printCheckFailed(pattern.pos, pattern, matchBuf, variables)
+                return None
+            matchPos,matchLen = m
+            matchPos += startPos
+
+            if notPatterns:
+                if matchPos < lastPos:
+                    fc.error(fc.inputBuffer, buf[0] + matchPos,
+                             '%s-DAG: found a match of CHECK-DAG reordering '
+                             'across a CHECK-NOT' % (fc.prefix,))
+                    fc.note(fc.inputBuffer, buf[0] + lastPos,
+                            '%s-DAG: the farthest match of CHECK-DAG is found '
+                            'here' % (fc.prefix,))
+                    fc.note(fc.checkBuffer, notPatterns[0].pos,
+                            '%s-NOT: the crossed pattern specified here' % (
+                                fc.prefix,))
+                    fc.note(fc.checkBuffer, pattern.pos,
+                            '%s-DAG: the reordered pattern specified here' % (
+                                fc.prefix,))
+                    return None
+                # The next group of CHECK-DAG lines starts after this one, and
+                # the CHECK-NOT lines between them must not match in between.
+                startPos = lastPos
+                skipped = _substr(buf, lastPos, matchPos)
+                if self.checkNot(fc, skipped, notPatterns, variables):
+                    return None
+                del notPatterns[:]
+
+            lastPos = max(matchPos + matchLen, lastPos)
+        return lastPos
+
+###
+
+def canonicalize(text, strictWhitespace):
+    """canonicalize(text, strictWhitespace) -> text
+
+    Remove the DOS style line endings of the text, and unless asked not to,
+    squash each run of horizontal whitespace into a single space."""
+    text = text.replace('\r\n', '\n')
+    if not strictWhitespace:
+        text = re.sub('[ \t]+', ' ', text)
+    return text
+
+kCheckPrefixRE = re.compile('[a-zA-Z0-9_-]*$')
+
+class FileCheck(object):
+    """
+    FileCheck - The checks of a check file, and the diagnostics produced while
+    reading them and checking an input against them.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.checkBuffer = None
+        self.inputBuffer = None
+        self.checkStrings = []
+        self.diagnostics = []
+
+    def error(self, buffer, pos, message):
+        self.diagnostics.append(buffer.getMessage(pos, 'error', message))
+
+    def note(self, buffer, pos, message):
+        self.diagnostics.append(buffer.getMessage(pos, 'note', message))
+
+    def readCheckFile(self, name, text):
+        """readCheckFile(name, text) -> success
+
+        Read the checks from the (canonicalized) text of the check file."""
+        self.checkBuffer = buffer = SourceBuffer(name, text)
+        prefix = self.prefix
+        n = len(prefix)
+        dagNotPatterns = []
+        lineNumber = 1
+        pos = 0
+        while True:
+            prefixLoc = text.find(prefix, pos)
+            if prefixLoc == -1:
+                break
+            lineNumber += text.count('\n', pos, prefixLoc)
+
+            # Like the tool, look at the character preceding the prefix to
+            # make sure it isn't part of a word, and then find the prefix again
+            # from its start before looking at what follows it.
+            isAtStart = prefixLoc == pos
+            if not isAtStart:
+                pos = prefixLoc - 1
+            checkPrefixStart = pos + (not isAtStart)
+            if not isAtStart and (_isAlnum(text[pos]) or text[pos] in '-_'):
+                pos += n
+                continue
+
+            isCheckNext = isCheckNot = isCheckDag = isCheckLabel = False
+            size = len(text) - pos
+            if text[pos+n:pos+n+1] == ':':
+                pos += n + 1
+            elif size > n + 6 and text.startswith('-NEXT:', pos + n):
+                pos += n + 6
+                isCheckNext = True
+            elif size > n + 5 and text.startswith('-NOT:', pos + n):
+                pos += n + 5
+                isCheckNot = True
+            elif size > n + 5 and text.startswith('-DAG:', pos + n):
+                pos += n + 5
+                isCheckDag = True
+            elif size > n + 7 and text.startswith('-LABEL:', pos + n):
+                pos += n + 7
+                isCheckLabel = True
+            else:
+                pos += 1
+                continue
+
+            # The pattern is the rest of the line, without leading and trailing
+            # whitespace.
+            while pos < len(text) and text[pos] in ' \t':
+                pos += 1
+            eol = len(text)
+            for c in '\n\r':
+                end = text.find(c, pos)
+                if end != -1:
+                    eol = min(eol, end)
+
+            pattern = Pattern()
+            if not pattern.parse(self, pos, eol, lineNumber):
+                return False
+            if isCheckLabel and pattern.hasVariable():
+                self.error(buffer, checkPrefixStart,
+                           "found '%s-LABEL:' with variable definition or "
+                           "use" % (prefix,))
+                return False
+            pattern.matchNot = isCheckNot
+            pattern.matchDag = isCheckDag
+            patternLoc = pos
+            pos = eol
+
+            if isCheckNext and not self.checkStrings:
+                self.error(buffer, checkPrefixStart,
+                           "found '%s-NEXT:' without previous '%s: line" % (
+                               prefix, prefix))
+                return False
+
+            if isCheckDag or isCheckNot:
+                dagNotPatterns.append(pattern)
+                continue
+
+            checkString = CheckString(pattern, patternLoc, isCheckNext,
+                                      isCheckLabel)
+            checkString.dagNotPatterns = dagNotPatterns
+            dagNotPatterns = []
+            self.checkStrings.append(checkString)
+
+        # Any trailing CHECK-DAG and CHECK-NOT lines are checked against the
+        # end of the input.
+        if dagNotPatterns:
+            checkString = CheckString(Pattern(True), pos, False, False)
+            checkString.dagNotPatterns = dagNotPatterns
+            self.checkStrings.append(checkString)
+
+        if not self.checkStrings:
+            self.diagnostics.append(
+                "error: no check strings found with prefix '%s:'\n" % (
+                    prefix,))
+            return False
+        return True
+
+    def printCheckFailed(self, pos, pattern, buf, variables):
+        self.error(self.checkBuffer, pos, "expected string not found in input")
+
+        # Point at the start of the next line, rather than at the end of the
+        # previous match.
+        start,end = buf
+        text = self.inputBuffer.text
+        while start < end and text[start] in ' \t\n\r':
+            start += 1
+        self.note(self.inputBuffer, start, "scanning from here")
+        pattern.printFailureInfo(self, (start, end), variables)
+
+    def checkInput(self, name, text):
+        """checkInput(name, text) -> success
+
+        Check the (canonicalized) input against the checks, in order, each
+        CHECK-LABEL line dividing the input into a region of its own."""
+        self.inputBuffer = SourceBuffer(name, text)
+        checkStrings = self.checkStrings
+        variables = {}
+        buf = (0, len(text))
+        hasError = False
+        i = j = 0
+        e = len(checkStrings)
+        while True:
+            if j == e:
+                checkRegion = buf
+            else:
+                label = checkStrings[j]
+                if not label.isCheckLabel:
+                    j += 1
+                    continue
+                m = label.check(self, buf, True, variables)
+                if m is None:
+                    hasError = True
+                    break
+                checkRegion = _substr(buf, 0, m[0] + m[1])
+                buf = _substr(buf, m[0] + m[1])
+                j += 1
+
+            # Check everything up to the label, including the label itself
+            # again to match the CHECK-NOT and CHECK-DAG lines preceding it.
+            while i != j:
+                m = checkStrings[i].check(self, checkRegion, False, variables)
+                if m is None:
+                    hasError = True
+                    i = j
+                    break
+                checkRegion = _substr(checkRegion, m[0] + m[1])
+                i += 1
+
+            if j == e:
+                break
+        return not hasError
+
+###
+
+kOptionsWithValues = ('input-file', 'check-prefix')
+kFlagOptions = ('strict-whitespace',)
+
+def parseArgs(args):
+    """parseArgs(args) -> (checkFile, inputFile, prefix, strictWhitespace)
+
+    Parse the arguments of the tool (without its name), as its command line
+    library does, or return None if it would fail to, or they include anything
+    which is not emulated."""
+    options = {}
+    positional = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        i += 1
+        if not arg.startswith('-') or arg == '-':
+            positional.append(arg)
+            continue
+        name = arg.lstrip('-')
+        if len(arg) - len(name) > 2:
+            return None
+        value = None
+        if '=' in name:
+            name,value = name.split('=', 1)
+        if name in options:
+            return None
+        if name in kOptionsWithValues:
+            if value is None:
+                if i == len(args):
+                    return None
+                value = args[i]
+                i += 1
+            options[name] = value
+        elif name in kFlagOptions and value is None:
+            options[name] = True
+        else:
+            return None
+
+    # Reading the checks from the standard input isn't emulated.
+    if len(positional) != 1 or positional[0] == '-':
+        return None
+    return (positional[0], options.get('input-file', '-'),
+            options.get('check-prefix', 'CHECK'),
+            bool(options.get('strict-whitespace')))
+
+def _toText(s):
+    # The check file and the input are handled as text with a character per
+    # byte. The arguments are text in Python 3.
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8')
+    return s.decode('ISO-8859-1')
+
+def _encode(text):
+    return text.encode('ISO-8859-1')
+
+def _readFile(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def prepare(args, cwd):
+    """
+    prepare(args, cwd) -> run or None
+
+    Read the check file of the given FileCheck command line (without the name
+    of the tool), returning a function to check an input against it, called as
+    run(readInput) -> (stdout, stderr, exitCode), where readInput() returns
+    the standard input of the command. Returns None if the tool should be
+    executed instead.
+    """
+    options = parseArgs(args)
+    if options is None:
+        return None
+    checkFile,inputFile,prefix,strictWhitespace = options
+
+    def failed(message):
+        return lambda readInput: (bytes(), _encode(message), 2)
+
+    # An empty prefix matches everywhere.
+    if not prefix:
+        return None
+    if not kCheckPrefixRE.match(prefix):
+        return failed('Supplied check-prefix is invalid! Prefixes must start '
+                      'with a letter and contain only alphanumeric '
+                      'characters, hyphens and underscores\n')
+
+    try:
+        data = _readFile(os.path.join(cwd, checkFile))
+    except (IOError, OSError):
+        return failed("Could not open check file '%s': %s\n" % (
+                checkFile, sys.exc_info()[1].strerror))
+
+    fc = FileCheck(_toText(prefix))
+    try:
+        if not fc.readCheckFile(_toText(checkFile),
+                                canonicalize(_toText(data), strictWhitespace)):
+            return failed(''.join(fc.diagnostics))
+    except Unsupported:
+        return None
+
+    def run(readInput):
+        fc.diagnostics = []
+        if inputFile == '-':
+            data = readInput()
+            name = '<stdin>'
+        else:
+            try:
+                data = _readFile(os.path.join(cwd, inputFile))
+            except (IOError, OSError):
+                return (bytes(), _encode(
+                        "Could not open input file '%s': %s\n" % (
+                            inputFile, sys.exc_info()[1].strerror)), 2)
+            name = inputFile
+        if not data:
+            return (bytes(), _encode("FileCheck error: '%s' is empty.\n" % (
+                        inputFile,)), 2)
+
+        success = fc.checkInput(_toText(name),
+                                canonicalize(_toText(data), strictWhitespace))
+        return bytes(), _encode(''.join(fc.diagnostics)), int(not success)
+    return run
@@ -3,6 +3,7 @@ import inspect
 import os
 import sys
 
+import lit.DiscoveryCache
 import lit.Test
 import lit.formats
 import lit.TestingConfig
@@ -21,7 +22,11 @@ class LitConfig:
     def __init__(self, progname, path, quiet,
                  useValgrind, valgrindLeakCheck, valgrindArgs,
                  noExecute, debug, isWindows,
-                 params, config_prefix = None):
+                 params, config_prefix = None, resultCache = None,
+                 discoveryCache = None, scriptCache = None, configCache = None,
+                 trackResourceUsage = False, maxIndividualTestTime = 0,
+                 fileCheckMode = 'builtin', useShellServer = False,
+                 recordDependencies = False):
         # The name of the test runner.
         self.progname = progname
         # The items to add to the PATH environment variable.
@@ -35,6 +40,31 @@ class LitConfig:
         self.isWindows = bool(isWindows)
         self.params = dict(params)
         self.bashPath = None
+        # The lit.ResultCache to reuse unchanged test results from, if any.
+        self.resultCache = resultCache
+        # The directory listings used by test discovery.
+        if discoveryCache is None:
+            discoveryCache = lit.DiscoveryCache.DiscoveryCache()
+        self.discoveryCache = discoveryCache
+        # The lit.ScriptCache of the commands of test scripts, if any.
+        self.scriptCache = scriptCache
+        # The lit.ConfigCache of compiled configuration files, if any.
+        self.configCache = configCache
+        # Whether to attach the resources used by the processes of each test
+        # to its result, as metrics.
+        self.trackResourceUsage = trackResourceUsage
+        # The time limit (in seconds) for each test, overriding the time limit
+        # of the test suites, or 0.
+        self.maxIndividualTestTime = maxIndividualTestTime
+        # How the internal shell executes FileCheck: 'builtin' (in-process,
+        # when it can), 'tool' or 'conformance' (both, comparing the results).
+        self.fileCheckMode = fileCheckMode
+        # Whether to execute the scripts of tests using the external shell on
+        # persistent shells (see lit.ShellServer).
+        self.useShellServer = useShellServer
+        # Whether the results of ShTest tests are to carry the files the tests
+        # depend on, for the lit.DependencyIndex.
+        self.recordDependencies = recordDependencies
 
         # Configuration files to look for when discovering test suites.
         self.config_prefix = config_prefix or 'lit'
@@ -66,6 +96,13 @@ class LitConfig:
         config.load_from_path(path, self)
         return config
 
+    def getTestTimeout(self, config):
+        """getTestTimeout(config) - Get the time limit (in seconds) for each of
+        the tests with the given config, or 0 if there is none."""
+        if self.maxIndividualTestTime:
+            return self.maxIndividualTestTime
+        return config.test_timeout or 0
+
     def getBashPath(self):
         """getBashPath - Get the path to 'bash'"""
         if self.bashPath is not None:
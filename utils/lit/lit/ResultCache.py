@@ -0,0 +1,246 @@
+"""
+Content addressed cache of test results, used by 'lit --incremental'.
+
+A test result is stored under a key derived from everything the test depends
+on: the test source, the RUN lines after substitution, the test environment,
+the contents of the executables the RUN lines invoke and of any (existing)
+input files they name. If none of these have changed since the test last
+passed (or failed as expected), the stored result is reused instead of
+executing the test again.
+"""
+
+import errno
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+import lit
+import lit.ShUtil as ShUtil
+import lit.TestRunner
+import lit.util
+
+# Bump this when the key derivation or the stored format changes.
+kCacheFormatVersion = 2
+
+kSeparator = '\0'.encode('ascii')
+
+# Content digests of files, keyed by (path, size, mtime), shared by all the
+# tests in this process so that each tool binary is only read once per run.
+_fileDigestCache = {}
+
+def getFileDigest(path):
+    """getFileDigest(path) - Return a digest of the contents of the file at the
+    given path, or None if it cannot be read."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (path, st.st_size, st.st_mtime)
+    digest = _fileDigestCache.get(stamp)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha1()
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+    finally:
+        f.close()
+    _fileDigestCache[stamp] = digest = h.hexdigest()
+    return digest
+
+def _getCommands(cmd):
+    if isinstance(cmd, ShUtil.Seq):
+        return _getCommands(cmd.lhs) + _getCommands(cmd.rhs)
+    return list(cmd.commands)
+
+def getScriptReferences(test, litConfig, script, tmpBase):
+    """
+    getScriptReferences(test, litConfig, script, tmpBase) -> [(kind, name)]
+
+    Find the commands the given (substituted) script of an ShTest executes,
+    and the input files they name, in order, as a list of ('builtin', name),
+    ('executable', path) and ('input', path). Return None if they cannot be
+    determined (the script doesn't parse, or names a missing executable).
+    """
+    # Anything written by the test itself lives in the temporary directory,
+    # and is ignored.
+    references = []
+    tmpDir = os.path.dirname(tmpBase)
+    path = test.config.environment.get('PATH')
+    for ln in script:
+        try:
+            cmd = ShUtil.ShParser(ln, litConfig.isWindows,
+                                  test.config.pipefail).parse()
+        except ValueError:
+            return None
+
+        for command in _getCommands(cmd):
+            # Builtin commands (and 'not') are part of lit itself.
+            args,_ = lit.TestRunner.stripNotCommands(command.args)
+            if args[0] in lit.TestRunner.kBuiltinCommands:
+                references.append(('builtin', args[0]))
+            else:
+                executable = lit.util.which(args[0], path)
+                if executable is None:
+                    return None
+                references.append(('executable', executable))
+
+            inputs = command.args[1:] + [arg for op,arg in command.redirects
+                                         if op == ('<',)]
+            for arg in inputs:
+                # Options can name inputs too, as in '--input-file=path'.
+                if arg.startswith('-') and '=' in arg:
+                    arg = arg.split('=', 1)[1]
+                if (os.path.isabs(arg) and
+                      not arg.startswith(tmpDir + os.sep) and
+                      os.path.isfile(arg)):
+                    references.append(('input', arg))
+    return references
+
+def getShTestKey(test, script, references):
+    """
+    getShTestKey(test, script, references) -> key or None
+
+    Compute the cache key for an ShTest with the given (substituted) script,
+    given the references getScriptReferences() found in it, or None if the
+    dependencies of the test cannot be determined.
+    """
+    if references is None:
+        return None
+
+    h = hashlib.sha1()
+    def add(data):
+        # Note that in Python 2 the data is already a byte string.
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8', 'replace')
+        h.update(data)
+        h.update(kSeparator)
+
+    # Results pickled by Python 2 and 3 aren't interchangeable, so keep them
+    # apart.
+    add(str(kCacheFormatVersion))
+    add(str(sys.version_info[0]))
+    add(lit.__version__)
+
+    source_digest = getFileDigest(test.getSourcePath())
+    if source_digest is None:
+        return None
+    add(source_digest)
+
+    for ln in script:
+        add(ln)
+    for name,value in sorted(test.config.environment.items()):
+        add('%s=%s' % (name, value))
+
+    # Add the contents of the executables and input files the script
+    # references. Builtin commands are covered by the version of lit.
+    for kind,name in references:
+        if kind == 'builtin':
+            add(name)
+        elif kind == 'executable':
+            digest = getFileDigest(name)
+            if digest is None:
+                return None
+            add(digest)
+        else:
+            add(name)
+            add(getFileDigest(name) or '')
+
+    return h.hexdigest()
+
+class ResultCache(object):
+    """
+    ResultCache - An on disk store of test results.
+
+    Each entry is a separate file, so concurrent test processes can safely
+    share a cache. Entries are touched when they are used, and the least
+    recently used entries are removed by evict() once the cache grows beyond
+    its maximum size.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def _getEntryPath(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """get(key) - Return the stored (code, output) for the key, or None."""
+        entry_path = self._getEntryPath(key)
+        try:
+            f = open(entry_path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                code,output = pickle.load(f)
+            except Exception:
+                return None
+        finally:
+            f.close()
+
+        # Mark the entry as recently used.
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return code,output
+
+    def put(self, key, code, output):
+        """put(key, code, output) - Store a result for the given key."""
+        entry_path = self._getEntryPath(key)
+        entry_dir = os.path.dirname(entry_path)
+        try:
+            lit.util.mkdir_p(entry_dir)
+            fd,temp_path = tempfile.mkstemp(dir=entry_dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump((code, output), f, 2)
+            finally:
+                f.close()
+            try:
+                os.rename(temp_path, entry_path)
+            except OSError:
+                # Windows doesn't allow renaming over an existing file; some
+                # other process already stored the same result.
+                os.remove(temp_path)
+        except (IOError, OSError):
+            pass
+
+    def evict(self):
+        """evict() - Remove the least recently used entries until the cache
+        fits in its maximum size."""
+        entries = []
+        total_size = 0
+        for dirpath,dirnames,filenames in os.walk(self.path):
+            for filename in filenames:
+                entry_path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry_path))
+                total_size += st.st_size
+
+        entries.sort()
+        for _,size,entry_path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                e = sys.exc_info()[1]
+                if e.errno != errno.ENOENT:
+                    continue
+            total_size -= size
@@ -0,0 +1,140 @@
+"""
+Machine readable reports of test results.
+
+The writers are given each test as soon as it completes, and write what they
+need to disk right away, so that the memory they use does not grow with the
+output of the tests. Only the tail of the output of each test is reported.
+"""
+
+import json
+import os
+import re
+import tempfile
+from xml.sax.saxutils import quoteattr
+
+import lit.util
+
+# The maximum number of characters of the output of a test to report.
+kOutputTailSize = 4096
+
+def getOutputTail(output):
+    output = lit.util.to_text(output or '')
+    if len(output) > kOutputTailSize:
+        output = '...' + output[-kOutputTailSize:]
+    return output
+
+def _replaceFile(temp_path, path):
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # Windows doesn't allow renaming over an existing file.
+        os.remove(path)
+        os.rename(temp_path, path)
+
+class JSONLinesWriter(object):
+    """
+    JSONLinesWriter - Write a JSON object for each completed test, one per
+    line, flushing the file after each one so that it can be followed while
+    the tests are running.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def write(self, test):
+        result = test.result
+        metrics = dict((name, value.todata())
+                       for name,value in result.metrics.items())
+        record = { 'name' : test.getFullName(),
+                   'code' : result.code.name,
+                   'is_failure' : result.code.isFailure,
+                   'elapsed' : result.elapsed,
+                   'metrics' : metrics,
+                   'output' : getOutputTail(result.output) }
+        self.file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+# Characters which may not appear in an XML document.
+kInvalidXMLCharsRE = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def _toXMLText(s):
+    return kInvalidXMLCharsRE.sub('?', lit.util.to_text(s))
+
+class XunitWriter(object):
+    """
+    XunitWriter - Write the results of the tests in the xUnit XML format, with
+    a <testsuite> element for each lit test suite.
+
+    The <testcase> elements are written to a temporary file as the tests
+    complete, and only assembled into the report (in suite order) by finish().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.spool = tempfile.TemporaryFile()
+        # The suite names, in the order they were first seen.
+        self.suites = []
+        # Maps each suite name to its [tests, failures, skipped] counts and
+        # the [(offset, length)] of its test cases in the spool file.
+        self.counts = {}
+        self.cases = {}
+
+    def write(self, test):
+        result = test.result
+        suite = test.suite.config.name
+        if suite not in self.counts:
+            self.suites.append(suite)
+            self.counts[suite] = [0, 0, 0]
+            self.cases[suite] = []
+
+        class_name = '.'.join([suite.replace('.', '_')] +
+                              list(test.path_in_suite[:-1]))
+        elapsed = result.elapsed or 0.0
+        case = '<testcase classname=%s name=%s time="%.4f"' % (
+            quoteattr(_toXMLText(class_name)),
+            quoteattr(_toXMLText(test.path_in_suite[-1])), elapsed)
+        counts = self.counts[suite]
+        counts[0] += 1
+        if result.code.isFailure:
+            counts[1] += 1
+            output = _toXMLText(getOutputTail(result.output))
+            case += '>\n  <failure message=%s><![CDATA[%s]]></failure>\n' \
+                    '</testcase>\n' % (
+                quoteattr(result.code.name),
+                output.replace(']]>', ']]]]><![CDATA[>'))
+        elif result.code.name in ('UNSUPPORTED', 'XFAIL'):
+            counts[2] += 1
+            case += '>\n  <skipped message=%s/>\n</testcase>\n' % (
+                quoteattr(result.code.name),)
+        else:
+            case += '/>\n'
+
+        data = case.encode('utf-8')
+        self.spool.seek(0, 2)
+        self.cases[suite].append((self.spool.tell(), len(data)))
+        self.spool.write(data)
+
+    def finish(self):
+        temp_path = self.path + '.tmp'
+        f = open(temp_path, 'wb')
+        try:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<testsuites>\n'.encode('utf-8'))
+            for suite in self.suites:
+                tests,failures,skipped = self.counts[suite]
+                f.write(('<testsuite name=%s tests="%d" failures="%d" '
+                         'skipped="%d">\n' % (
+                            quoteattr(_toXMLText(suite)), tests, failures,
+                            skipped)).encode('utf-8'))
+                for offset,length in self.cases[suite]:
+                    self.spool.seek(offset)
+                    f.write(self.spool.read(length))
+                f.write('</testsuite>\n'.encode('utf-8'))
+            f.write('</testsuites>\n'.encode('utf-8'))
+        finally:
+            f.close()
+            self.spool.close()
+        _replaceFile(temp_path, self.path)
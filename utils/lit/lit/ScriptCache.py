@@ -0,0 +1,157 @@
+"""
+Persistent cache of the commands (RUN, XFAIL, REQUIRES and END lines) found in
+test scripts, and of the internal shell commands parsed from their RUN lines.
+
+Finding the commands means scanning the test file, and test inputs such as
+assembly listings and IR dumps can be many megabytes in size. The commands of
+large files are therefore kept in the lit cache directory, keyed by the path
+of the file and revalidated with its modification time and size.
+
+The parsed form of the (substituted) RUN lines of each test is kept too,
+keyed by the path of the test and revalidated with the text of the lines, so
+that rerunning a test doesn't parse its script again.
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import lit.util
+
+# Bump this when the format of the entries changes.
+kEntryFormatVersion = 1
+
+# Bump this when the format of the parsed scripts (lit.ShCommands) changes.
+kParsedEntryFormatVersion = 1
+
+# Scripts shorter than this (in characters) are parsed directly, which is no
+# more expensive than reading a cache entry.
+kMinCachedScriptSize = 256
+
+# Files smaller than this (in bytes) are scanned directly, which is no more
+# expensive than reading a cache entry.
+kMinCachedFileSize = 64 * 1024
+
+# Files modified more recently than this (in seconds) are not cached, as any
+# further changes made within the timestamp granularity of the file system
+# would go unnoticed.
+kRacyInterval = 2.0
+
+class ScriptCache(object):
+    """
+    ScriptCache - An on disk store of the commands of test scripts.
+
+    Each entry is a separate file, so concurrent test processes can safely
+    share a cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _getEntryPath(self, source_path, directives_in_header):
+        key = hashlib.sha1(('%s\0%d' % (source_path, directives_in_header))
+                           .encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def _load(self, entry_path):
+        try:
+            f = open(entry_path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                return pickle.load(f)
+            except Exception:
+                return None
+        finally:
+            f.close()
+
+    def getCommands(self, source_path, directives_in_header, parse):
+        """
+        getCommands(source_path, directives_in_header, parse) -> [command]
+
+        Return the list of commands parse(source_path, directives_in_header)
+        returns for the given file, reusing the stored list if the file has
+        not changed since it was parsed.
+        """
+        try:
+            st = os.stat(source_path)
+        except OSError:
+            st = None
+        if st is None or st.st_size < kMinCachedFileSize:
+            return list(parse(source_path, directives_in_header))
+
+        stamp = (st.st_mtime, st.st_size)
+        entry_path = self._getEntryPath(source_path, directives_in_header)
+        entry = self._load(entry_path)
+        if entry is not None:
+            try:
+                version,entry_stamp,commands = entry
+                if version == kEntryFormatVersion and entry_stamp == stamp:
+                    return commands
+            except Exception:
+                pass
+
+        commands = list(parse(source_path, directives_in_header))
+        if time.time() - st.st_mtime > kRacyInterval:
+            self._store(entry_path, (kEntryFormatVersion, stamp, commands))
+        return commands
+
+    def getParsedScript(self, source_path, lines, win32Escapes, pipefail,
+                        parse):
+        """
+        getParsedScript(source_path, lines, win32Escapes, pipefail, parse)
+          -> command
+
+        Return the command parse(lines, win32Escapes, pipefail) returns for
+        the RUN lines of the test at source_path, reusing the stored command
+        if the test had the same lines when it was last parsed. Errors raised
+        by parse() are passed on, and nothing is stored for them.
+        """
+        if sum(len(ln) for ln in lines) < kMinCachedScriptSize:
+            return parse(lines, win32Escapes, pipefail)
+
+        # Python 2 and 3 pickle strings differently, so keep separate entries.
+        key = hashlib.sha1(('%s\0parsed\0%d\0%d\0%d' % (
+                    source_path, win32Escapes, pipefail,
+                    sys.version_info[0])).encode('utf-8')).hexdigest()
+        entry_path = os.path.join(self.path, key[:2], key)
+        entry = self._load(entry_path)
+        if entry is not None:
+            try:
+                version,entry_lines,command = entry
+                if version == kParsedEntryFormatVersion and \
+                        entry_lines == lines:
+                    return command
+            except Exception:
+                pass
+
+        command = parse(lines, win32Escapes, pipefail)
+        self._store(entry_path, (kParsedEntryFormatVersion, list(lines),
+                                 command))
+        return command
+
+    def _store(self, entry_path, entry):
+        entry_dir = os.path.dirname(entry_path)
+        try:
+            lit.util.mkdir_p(entry_dir)
+            fd,temp_path = tempfile.mkstemp(dir=entry_dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(entry, f, 2)
+            finally:
+                f.close()
+            try:
+                os.rename(temp_path, entry_path)
+            except OSError:
+                # Windows doesn't allow renaming over an existing file.
+                os.remove(entry_path)
+                os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            pass
@@ -1,9 +1,20 @@
 from __future__ import absolute_import
-import itertools
+import re
 
 import lit.util
 from lit.ShCommands import Command, Pipeline, Seq
 
+# Matches a token of a line without any quoting or escaping: a redirection
+# with a file descriptor number, an operator, or an argument. Anything but
+# whitespace starts a token. Like ShLexer.lex_one_token(), this reads '<>' as
+# the '<<' operator (and '<<' as two '<' operators).
+kSimpleTokenRE = re.compile(r"""
+    (\d+)(>&|>>|>|<&|<>|<) |
+    (;|\|\||\||&&|&>|&|>&|>>|>|<&|<>|<) |
+    ([^\s|&;<>]+)
+""", re.VERBOSE)
+kSimpleOperators = { '<>' : '<<' }
+
 class ShLexer:
     def __init__(self, data, win32Escapes = False):
         self.data = data
@@ -159,31 +170,59 @@ class ShLexer:
 
         return self.lex_arg(c)
 
-    def lex(self):
+    def is_simple(self):
+        """
+        is_simple() - Check whether the data has no quoting or escaping, so
+        can be lexed by lex_simple(). """
+        return not ("'" in self.data or '"' in self.data or
+                    '\\' in self.data)
+
+    def lex_simple(self):
+        """
+        lex_simple() - Lex data without any quoting or escaping with a single
+        regular expression, producing the same tokens as lex_tokens(). """
+        for m in kSimpleTokenRE.finditer(self.data):
+            num,redirect,op,arg = m.groups()
+            if arg is not None:
+                yield arg
+            elif op is not None:
+                yield (kSimpleOperators.get(op, op),)
+            else:
+                yield (kSimpleOperators.get(redirect, redirect), int(num))
+        self.pos = self.end
+
+    def lex_tokens(self):
         while self.pos != self.end:
             if self.look().isspace():
                 self.eat()
             else:
                 yield self.lex_one_token()
 
+    def lex(self):
+        if self.is_simple():
+            return self.lex_simple()
+        return self.lex_tokens()
+
 ###
  
 class ShParser:
     def __init__(self, data, win32Escapes = False, pipefail = False):
         self.data = data
         self.pipefail = pipefail
-        self.tokens = ShLexer(data, win32Escapes = win32Escapes).lex()
-    
+        self.tokens = list(ShLexer(data, win32Escapes = win32Escapes).lex())
+        self.pos = 0
+
     def lex(self):
-        for item in self.tokens:
-            return item
-        return None
-    
-    def look(self):
-        token = self.lex()
-        if token is not None:
-            self.tokens = itertools.chain([token], self.tokens)
+        if self.pos == len(self.tokens):
+            return None
+        token = self.tokens[self.pos]
+        self.pos += 1
         return token
+
+    def look(self):
+        if self.pos == len(self.tokens):
+            return None
+        return self.tokens[self.pos]
     
     def parse_command(self):
         tok = self.lex()
@@ -264,6 +303,18 @@ class TestShLexer(unittest.TestCase):
         self.assertEqual(self.lex('a 2>c'),
                          ['a', ('>',2), 'c'])
         
+    def test_simple(self):
+        # Lines without quoting or escaping take the regular expression path,
+        # which must produce the same tokens as the general one.
+        for line in ('a|b>c&d<e;f', 'a 2>c', 'a2>c', 'a 2>&1 12<x 3>>y',
+                     'a&&b||c&>d', 'a >& b << c <& d <> e 2<>f', '2|x 2&>y',
+                     '  FileCheck %s -check-prefix=X  <  %t.in ',
+                     'a;;b', 'x\tY\x0bz', ''):
+            lexer = ShLexer(line)
+            self.assertTrue(lexer.is_simple())
+            self.assertEqual(list(lexer.lex_simple()),
+                             list(ShLexer(line).lex_tokens()))
+
     def test_quoting(self):
         self.assertEqual(self.lex(""" 'a' """),
                          ['a'])
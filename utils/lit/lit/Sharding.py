@@ -0,0 +1,127 @@
+"""
+Support for splitting a test run across several machines.
+
+The selected tests are partitioned deterministically into a number of shards,
+each of which is run by a separate lit invocation ('--num-shards' and
+'--run-shard'). Each invocation can write its results to a file, and the result
+files of all the shards can then be merged into a single summary. The result
+file of a previous (merged) run also serves to balance the shards by the time
+their tests take.
+"""
+
+import heapq
+import json
+import os
+
+import lit
+import lit.Test
+import lit.util
+
+# Bump this when the format of the result files changes incompatibly.
+kResultsFormatVersion = 1
+
+def get_shard(tests, num_shards, run_shard, times=None):
+    """
+    get_shard(tests, num_shards, run_shard, times=None) -> [test]
+
+    Return the tests in shard 'run_shard' (counting from 1) of 'num_shards'.
+    Every invocation must pass the same tests in the same order, so that the
+    shards partition them.
+
+    Without times the tests are dealt out to the shards in turn. Otherwise
+    'times' maps full test names to their (previously measured) elapsed time,
+    and each test is assigned to the shard with the least total time so far,
+    longest test first. Tests with no known time are estimated with the
+    average of the known times. The tests of the shard retain their order.
+    """
+    known_times = [times[t.getFullName()] for t in tests
+                   if times and t.getFullName() in times]
+    if not known_times:
+        return tests[run_shard - 1::num_shards]
+
+    average = sum(known_times) / len(known_times)
+    def estimate(t):
+        return times.get(t.getFullName(), average)
+    estimates = [estimate(t) for t in tests]
+    order = sorted(range(len(tests)), key=lambda i: (-estimates[i], i))
+
+    # Each shard is (total time, number of tests, shard index); ties go to the
+    # shard with the fewest tests, then to the lowest numbered one.
+    shards = [(0.0, 0, index) for index in range(num_shards)]
+    selected = []
+    for i in order:
+        elapsed,count,index = heapq.heappop(shards)
+        if index == run_shard - 1:
+            selected.append(i)
+        heapq.heappush(shards, (elapsed + estimates[i], count + 1, index))
+    selected.sort()
+    return [tests[i] for i in selected]
+
+def write_results(path, results, elapsed):
+    """
+    write_results(path, results, elapsed)
+
+    Write the given [(full test name, result)] to a result file, along with
+    the total testing time. The output of passing tests is not kept.
+    """
+    tests = []
+    for name,result in results:
+        output = ''
+        if result.code.isFailure:
+            output = lit.util.to_text(result.output)
+        tests.append({ 'name' : name,
+                       'code' : result.code.name,
+                       'is_failure' : result.code.isFailure,
+                       'elapsed' : result.elapsed,
+                       'output' : output })
+    data = { 'format_version' : kResultsFormatVersion,
+             'lit_version' : lit.__version__,
+             'elapsed' : elapsed,
+             'tests' : tests }
+
+    temp_path = path + '.tmp'
+    f = open(temp_path, 'w')
+    try:
+        json.dump(data, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # Windows doesn't allow renaming over an existing file.
+        os.remove(path)
+        os.rename(temp_path, path)
+
+def read_results(path):
+    """
+    read_results(path) -> ([(full test name, result)], elapsed)
+
+    Read a result file written by write_results(). Raises ValueError if the
+    file is not a result file.
+    """
+    f = open(path)
+    try:
+        data = json.load(f)
+    finally:
+        f.close()
+    if (not isinstance(data, dict) or
+          data.get('format_version') != kResultsFormatVersion):
+        raise ValueError('not a lit result file')
+
+    results = []
+    for entry in data['tests']:
+        code = lit.Test.ResultCode(str(entry['code']), entry['is_failure'])
+        results.append((entry['name'],
+                        lit.Test.Result(code, entry['output'],
+                                        entry['elapsed'])))
+    return results,data['elapsed']
+
+def read_test_times(path):
+    """
+    read_test_times(path) -> {full test name : elapsed}
+
+    Read the elapsed times of the tests in a result file.
+    """
+    results,_ = read_results(path)
+    return dict((name, result.elapsed) for name,result in results
+                if result.elapsed is not None)
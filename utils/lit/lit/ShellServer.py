@@ -0,0 +1,309 @@
+"""
+Persistent bash processes executing the scripts of ShTest tests using the
+external shell ('execute_external'), saving the startup of a shell and the
+writing of a script file per test.
+
+Each server is a bash process running a loop which reads requests from its
+stdin: a line with the size of the request, then the request itself, which
+the loop evaluates. A request executes the script of a test in a subshell,
+with the working directory and environment of the test, so that nothing the
+script does outlives it, and then writes a line with a token (unique to the
+request) and the exit code of the script to stdout, and the token to stderr,
+marking the end of the output of the script on each.
+
+The servers are pooled per process, and each is used by one test at a time,
+so there are at most as many servers as tests executing at once.
+"""
+
+import atexit
+import binascii
+import os
+import platform
+import re
+import select
+import signal
+import subprocess
+import sys
+import threading
+
+import lit.util
+
+# The loop of each server. The request is read with the C locale, so that its
+# size is counted in bytes.
+kServerLoop = """\
+while IFS= read -r __lit_size &&
+      LC_ALL=C IFS= read -r -N "$__lit_size" __lit_request; do
+  eval "$__lit_request"
+done
+"""
+
+# The variables the loop (and the requests) use, which the scripts must not
+# see.
+kServerVariables = ('__lit_size', '__lit_request')
+
+# Environment variables which bash treats specially on startup; a test whose
+# environment sets them is executed by a new shell.
+kStartupVariables = frozenset(['BASH_ENV', 'BASHOPTS', 'ENV', 'EUID', 'IFS',
+                               'POSIXLY_CORRECT', 'PPID', 'SHELLOPTS', 'UID'])
+
+# The oldest version of bash whose 'read' builtin supports -N.
+kMinBashVersion = (4, 1)
+
+kVariableNameRE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def quote(s):
+    """quote(s) - Quote a string as a single word for the shell."""
+    return "'" + s.replace("'", "'\\''") + "'"
+
+class ShellServer(object):
+    """
+    ShellServer - A bash process executing scripts on request.
+    """
+
+    def __init__(self, bashPath, newProcessGroup):
+        self.key = (bashPath, newProcessGroup)
+        kwargs = {}
+        if newProcessGroup:
+            kwargs = lit.util.kNewProcessGroupArgs
+        # The server has no environment of its own, every script is given the
+        # environment of its test.
+        self.proc = subprocess.Popen([bashPath, '-c', kServerLoop],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     env={}, close_fds=True, **kwargs)
+
+    def isAlive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        """close() - Ask the server to exit, once idle."""
+        try:
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        for f in (self.proc.stdout, self.proc.stderr):
+            f.close()
+        self.proc.wait()
+
+    def execute(self, script, cwd, env):
+        """
+        execute(script, cwd, env) -> (out, err, exitCode, finished)
+
+        Execute the given script (text). If the server dies before the script
+        finishes (for example, because it was killed on a time limit), return
+        what the script output until then, the exit code of the server and
+        finished as False.
+        """
+        token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        request = ['( unset %s' % (' '.join(kServerVariables),)]
+        for name,value in sorted(env.items()):
+            request.append('export %s=%s' % (name, quote(value)))
+        request.append('cd %s || exit' % (quote(cwd),))
+        request.append('eval %s ) </dev/null' % (quote(script),))
+        request = '\n'.join(request)
+        request += '\necho "%s $?"; echo %s >&2\n' % (token, token)
+        if sys.version_info[0] >= 3:
+            request = request.encode('utf-8')
+        header = ('%d\n' % (len(request),)).encode('ascii')
+        try:
+            self.proc.stdin.write(header + request)
+            self.proc.stdin.flush()
+        except (IOError, OSError):
+            # The server died, its exit code is read below.
+            pass
+
+        outMarker = re.compile(('%s ([0-9]+)\n$' % (token,)).encode('ascii'))
+        errMarker = re.compile(('%s\n$' % (token,)).encode('ascii'))
+        readers = [_MarkedOutput(self.proc.stdout, outMarker),
+                   _MarkedOutput(self.proc.stderr, errMarker)]
+        remaining = dict((r.fd, r) for r in readers)
+        poller = select.poll()
+        for fd in remaining:
+            poller.register(fd, select.POLLIN)
+        while remaining:
+            for fd,event in poller.poll():
+                if not remaining[fd].read():
+                    poller.unregister(fd)
+                    del remaining[fd]
+
+        out,err = [r.getvalue() for r in readers]
+        status = readers[0].match
+        if status is None or readers[1].match is None:
+            self.proc.wait()
+            return out, err, self.proc.returncode, False
+        return out, err, int(status.group(1)), True
+
+class _MarkedOutput(object):
+    """
+    _MarkedOutput - Reads the output of a script from a pipe of a server, up
+    to the marker the server writes once the script has finished.
+    """
+
+    def __init__(self, f, marker):
+        self.fd = f.fileno()
+        self.marker = marker
+        self.chunks = []
+        self.tail = bytes()
+        self.match = None
+        self.newline = '\n'.encode('ascii')
+
+    def read(self):
+        """read() -> bool
+
+        Read what is available, returning whether there is more to read."""
+        data = os.read(self.fd, 65536)
+        if not data:
+            return False
+        self.chunks.append(data)
+        # The marker is a line of its own, unless the output of the script
+        # doesn't end with a newline.
+        self.tail = (self.tail + data)[-128:]
+        if self.tail.endswith(self.newline):
+            self.match = self.marker.search(self.tail)
+        return self.match is None
+
+    def getvalue(self):
+        data = bytes().join(self.chunks)
+        if self.match is not None:
+            data = data[:-len(self.match.group(0))]
+        return data
+
+# The idle servers of this process, by (bash path, whether they are in a
+# process group of their own).
+_idleServers = {}
+_idleServersLock = threading.Lock()
+_idleServersPid = None
+
+def _acquireServer(bashPath, newProcessGroup):
+    global _idleServersPid
+    _idleServersLock.acquire()
+    try:
+        # The servers of a parent process (after a fork) are not ours to use.
+        if _idleServersPid != os.getpid():
+            _idleServers.clear()
+            _idleServersPid = os.getpid()
+        servers = _idleServers.get((bashPath, newProcessGroup))
+        if servers:
+            return servers.pop()
+    finally:
+        _idleServersLock.release()
+    return ShellServer(bashPath, newProcessGroup)
+
+def _releaseServer(server):
+    _idleServersLock.acquire()
+    try:
+        if _idleServersPid == os.getpid():
+            _idleServers.setdefault(server.key, []).append(server)
+            return
+    finally:
+        _idleServersLock.release()
+    server.close()
+
+def shutdown():
+    """shutdown() - Stop the idle servers of this process."""
+    _idleServersLock.acquire()
+    try:
+        servers = []
+        if _idleServersPid == os.getpid():
+            for s in _idleServers.values():
+                servers.extend(s)
+        _idleServers.clear()
+    finally:
+        _idleServersLock.release()
+    for server in servers:
+        server.close()
+
+atexit.register(shutdown)
+
+# Whether the bash at each path is recent enough to run a server.
+_bashSupported = {}
+
+def _isBashSupported(bashPath):
+    _idleServersLock.acquire()
+    try:
+        supported = _bashSupported.get(bashPath)
+    finally:
+        _idleServersLock.release()
+    if supported is None:
+        try:
+            version = lit.util.capture(
+                [bashPath, '-c',
+                 'echo "${BASH_VERSINFO[0]} ${BASH_VERSINFO[1]}"'], env={})
+            version = tuple(int(v) for v in version.split())
+            supported = version >= kMinBashVersion
+        except Exception:
+            supported = False
+        _idleServersLock.acquire()
+        try:
+            _bashSupported[bashPath] = supported
+        finally:
+            _idleServersLock.release()
+    return supported
+
+def canExecute(litConfig, env):
+    """
+    canExecute(litConfig, env) -> bool
+
+    Check whether scripts run with the given environment can be executed by a
+    server, rather than by a new shell.
+    """
+    if (platform.system() == 'Windows' or not litConfig.getBashPath() or
+            litConfig.useValgrind):
+        return False
+    if not _isBashSupported(litConfig.getBashPath()):
+        return False
+    # The resources used by the processes of a script are only accounted to
+    # the process which waits for them.
+    if lit.util.getResourceUsage() is not None:
+        return False
+    for name,value in env.items():
+        if (name in kStartupVariables or name in kServerVariables or
+                not kVariableNameRE.match(name) or '\0' in value):
+            return False
+    return True
+
+def executeScript(script, litConfig, cwd, env, timeout=0):
+    """
+    executeScript(script, litConfig, cwd, env, [timeout])
+      -> (out, err, exitCode)
+
+    Execute the given bash script (text) on a server, like
+    lit.util.executeCommand() executes a command, which canExecute() must
+    allow.
+    """
+    timeoutHelper = lit.util.TimeoutHelper(timeout)
+    server = _acquireServer(litConfig.getBashPath(), timeoutHelper.active())
+    # A time limit kills the server, along with the processes of the script.
+    timeoutHelper.addProcess(server.proc)
+    timeoutHelper.start()
+    try:
+        out,err,exitCode,finished = server.execute(script, cwd, env)
+    finally:
+        timeoutHelper.cancel()
+    if finished and not timeoutHelper.timeoutReached():
+        _releaseServer(server)
+    else:
+        if server.isAlive():
+            server.proc.kill()
+        server.close()
+
+    # Detect Ctrl-C in the server.
+    if exitCode == -signal.SIGINT:
+        raise KeyboardInterrupt
+
+    # Ensure the resulting output is always of string type.
+    try:
+        out = str(out.decode('ascii'))
+    except:
+        out = str(out)
+    try:
+        err = str(err.decode('ascii'))
+    except:
+        err = str(err)
+
+    if timeoutHelper.timeoutReached():
+        raise lit.util.ExecuteCommandTimeoutException(
+            'Reached timeout of %s seconds' % (timeout,), out, err, exitCode)
+
+    return out, err, exitCode
@@ -1,4 +1,15 @@
 import os
+import tempfile
+import threading
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from sys import intern
+except ImportError:
+    pass
 
 # Test result codes.
 
@@ -30,6 +41,8 @@ FAIL        = ResultCode('FAIL', True)
 XPASS       = ResultCode('XPASS', True)
 UNRESOLVED  = ResultCode('UNRESOLVED', True)
 UNSUPPORTED = ResultCode('UNSUPPORTED', False)
+TIMEOUT     = ResultCode('TIMEOUT', True)
+SKIPPED     = ResultCode('SKIPPED', False)
 
 # Test metric values.
 
@@ -37,6 +50,10 @@ class MetricValue(object):
     def format(self):
         raise RuntimeError("abstract method")
 
+    def todata(self):
+        """todata() - Return the value as plain data, for serialization."""
+        raise RuntimeError("abstract method")
+
 class IntMetricValue(MetricValue):
     def __init__(self, value):
         self.value = value
@@ -44,6 +61,9 @@ class IntMetricValue(MetricValue):
     def format(self):
         return str(self.value)
 
+    def todata(self):
+        return self.value
+
 class RealMetricValue(MetricValue):
     def __init__(self, value):
         self.value = value
@@ -51,20 +71,117 @@ class RealMetricValue(MetricValue):
     def format(self):
         return '%.4f' % self.value
 
+    def todata(self):
+        return self.value
+
+# Test output retention.
+
+class OutputSpool(object):
+    """
+    OutputSpool - A compressed temporary file holding the output of test
+    results which is unlikely to be looked at again, so that it doesn't need
+    to be kept in memory (see Result.spillOutput()).
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.lock = threading.Lock()
+
+    def write(self, output):
+        """write(output) -> SpilledOutput"""
+        data = zlib.compress(pickle.dumps(output, 2))
+        self.lock.acquire()
+        try:
+            self.file.seek(0, 2)
+            offset = self.file.tell()
+            self.file.write(data)
+        finally:
+            self.lock.release()
+        return SpilledOutput(self, offset, len(data))
+
+    def read(self, offset, length):
+        self.lock.acquire()
+        try:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        finally:
+            self.lock.release()
+        return pickle.loads(zlib.decompress(data))
+
+def _unspillOutput(output):
+    return output
+
+class SpilledOutput(object):
+    """SpilledOutput - The location of an output in an OutputSpool."""
+
+    __slots__ = ('spool', 'offset', 'length')
+
+    def __init__(self, spool, offset, length):
+        self.spool = spool
+        self.offset = offset
+        self.length = length
+
+    def read(self):
+        return self.spool.read(self.offset, self.length)
+
+    def __reduce__(self):
+        # The spool is private to this process, so pickle the output itself.
+        return (_unspillOutput, (self.read(),))
+
 # Test results.
 
 class Result(object):
     """Wrapper for the results of executing an individual test."""
 
+    # Runs can have hundreds of thousands of results, so avoid the overhead of
+    # a dictionary per result. Test formats may still set other attributes.
+    __slots__ = ('code', '_output', 'elapsed', 'metrics', 'cached',
+                 'spawnsAvoided', '__dict__')
+
     def __init__(self, code, output='', elapsed=None):
         # The result code.
         self.code = code
-        # The test output.
-        self.output = output
+        # The test output (see the output property).
+        self._output = output
         # The wall timing to execute the test, if timing.
         self.elapsed = elapsed
         # The metrics reported by this test.
         self.metrics = {}
+        # Whether this result was reused from a previous run (see
+        # lit.ResultCache), rather than computed by executing the test.
+        self.cached = False
+        # The number of commands the internal shell executed in-process for
+        # this test, rather than by spawning a process.
+        self.spawnsAvoided = 0
+
+    def _getOutput(self):
+        output = self._output
+        if isinstance(output, SpilledOutput):
+            return output.read()
+        return output
+
+    def _setOutput(self, output):
+        self._output = output
+
+    output = property(_getOutput, _setOutput, doc="""The test output.""")
+
+    def dropOutput(self):
+        """
+        dropOutput()
+
+        Discard the output of the result, once it has been reported.
+        """
+        self._output = ''
+
+    def spillOutput(self, spool):
+        """
+        spillOutput(spool)
+
+        Move the output of the result to the given OutputSpool, from which it
+        is read back whenever the output is accessed.
+        """
+        if self._output and not isinstance(self._output, SpilledOutput):
+            self._output = spool.write(self._output)
 
     def addMetric(self, name, value):
         """
@@ -85,12 +202,14 @@ class Result(object):
 
 # Test classes.
 
-class TestSuite:
+class TestSuite(object):
     """TestSuite - Information on a group of tests.
 
     A test suite groups together a set of logically related tests.
     """
 
+    __slots__ = ('name', 'source_root', 'exec_root', 'config', '__dict__')
+
     def __init__(self, name, source_root, exec_root, config):
         self.name = name
         self.source_root = source_root
@@ -104,20 +223,44 @@ class TestSuite:
     def getExecPath(self, components):
         return os.path.join(self.exec_root, *components)
 
-class Test:
+def _internPath(path_in_suite):
+    # The components of the paths of tests are mostly the names of the same few
+    # directories, so share the strings between tests.
+    return tuple([intern(c) if type(c) is str else c for c in path_in_suite])
+
+class Test(object):
     """Test - Information on a single test instance."""
 
+    # Runs can have hundreds of thousands of tests, so avoid the overhead of a
+    # dictionary per test. Test formats may still set other attributes.
+    __slots__ = ('suite', 'path_in_suite', 'config', '_xfails', 'result',
+                 '__dict__')
+
     def __init__(self, suite, path_in_suite, config):
         self.suite = suite
-        self.path_in_suite = path_in_suite
+        self.path_in_suite = _internPath(path_in_suite)
         self.config = config
-        # A list of conditions under which this test is expected to fail. These
-        # can optionally be provided by test format handlers, and will be
-        # honored when the test result is supplied.
-        self.xfails = []
+        # A list of conditions under which this test is expected to fail (see
+        # the xfails property).
+        self._xfails = None
         # The test result, once complete.
         self.result = None
 
+    def _getXFails(self):
+        # Most tests are never expected to fail, so only create the list when
+        # it is asked for.
+        if self._xfails is None:
+            self._xfails = []
+        return self._xfails
+
+    def _setXFails(self, xfails):
+        self._xfails = xfails
+
+    xfails = property(_getXFails, _setXFails, doc="""
+        A list of conditions under which this test is expected to fail. These
+        can optionally be provided by test format handlers, and will be honored
+        when the test result is supplied.""")
+
     def setResult(self, result):
         if self.result is not None:
             raise ArgumentError("test result already set")
@@ -153,7 +296,7 @@ class Test:
         """
 
         # Check if any of the xfails match an available feature or the target.
-        for item in self.xfails:
+        for item in self._xfails or ():
             # If this is the wildcard, it always fails.
             if item == '*':
                 return True
@@ -1,10 +1,22 @@
 from __future__ import absolute_import
 import os, signal, subprocess, sys
+import calendar
+import difflib
+import errno
+import mmap
 import re
 import platform
+import select
+import shutil
 import tempfile
+import threading
+import time
 
+import lit.DependencyIndex
+import lit.FileCheck
+import lit.ResultCache
 import lit.ShUtil as ShUtil
+import lit.ShellServer
 import lit.Test as Test
 import lit.util
 
@@ -21,41 +33,687 @@ kUseCloseFDs = not kIsWindows
 # Use temporary files to replace /dev/null on Windows.
 kAvoidDevNull = kIsWindows
 
-def executeShCmd(cmd, cfg, cwd, results):
+# The maximum amount of each output stream of a command to keep for the test
+# report. Only the tail of longer outputs is kept.
+kMaxCapturedOutputSize = 1 << 20
+
+class BoundedOutput(object):
+    """
+    BoundedOutput - Accumulates the data read from an output stream, keeping
+    only the last max_size bytes (or all of it, if max_size is None).
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.chunks = []
+        self.size = 0
+        self.discarded = 0
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.max_size is None:
+            return
+
+        # Drop whole chunks which have fallen out of the window; the remaining
+        # excess is trimmed when the output is retrieved.
+        while self.size - len(self.chunks[0]) >= self.max_size:
+            chunk = self.chunks.pop(0)
+            self.size -= len(chunk)
+            self.discarded += len(chunk)
+
+    def getvalue(self):
+        data = bytes().join(self.chunks)
+        discarded = self.discarded
+        if self.max_size is not None and len(data) > self.max_size:
+            discarded += len(data) - self.max_size
+            data = data[-self.max_size:]
+        if discarded:
+            data = ('[... %d bytes of output discarded ...]\n' % (
+                    discarded,)).encode('ascii') + data
+        return data
+
+def drainPipes(pipes, max_size=kMaxCapturedOutputSize, unbounded=()):
+    """
+    drainPipes(pipes, [max_size], [unbounded]) -> [data]
+
+    Read all the given pipes (file objects) concurrently until they are
+    closed, returning the data read from each, bounded to max_size unless the
+    pipe is among the unbounded ones. Reading everything at once means no
+    process in a pipeline can block on a full pipe that is only read later.
+    """
+    outputs = [BoundedOutput(None if f in unbounded else max_size)
+               for f in pipes]
+
+    if not hasattr(select, 'poll'):
+        # Pipes can't be polled on Windows, use a thread per pipe instead.
+        def drain(f, output):
+            while True:
+                data = os.read(f.fileno(), 65536)
+                if not data:
+                    break
+                output.append(data)
+        threads = [threading.Thread(target=drain, args=(f, output))
+                   for f,output in zip(pipes, outputs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        poller = select.poll()
+        active = {}
+        for f,output in zip(pipes, outputs):
+            poller.register(f.fileno(), select.POLLIN)
+            active[f.fileno()] = output
+        while active:
+            try:
+                events = poller.poll()
+            except (select.error, OSError):
+                if sys.exc_info()[1].args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd,event in events:
+                data = os.read(fd, 65536)
+                if data:
+                    active[fd].append(data)
+                else:
+                    poller.unregister(fd)
+                    del active[fd]
+
+    for f in pipes:
+        f.close()
+    return [output.getvalue() for output in outputs]
+
+class ShellEnvironment(object):
+    """
+    ShellEnvironment - The state of the internal shell which persists between
+    the commands of a script.
+    """
+
+    def __init__(self, cwd, env, timeoutHelper=None, fileCheckMode='builtin'):
+        # The current working directory, as changed by 'cd'.
+        self.cwd = cwd
+        # The environment to execute commands in.
+        self.env = env
+        # The lit.util.TimeoutHelper enforcing the time limit of the test.
+        if timeoutHelper is None:
+            timeoutHelper = lit.util.TimeoutHelper(0)
+        self.timeoutHelper = timeoutHelper
+        # How to execute FileCheck: 'builtin', 'tool' or 'conformance' (see
+        # prepareBuiltinFileCheck()).
+        self.fileCheckMode = fileCheckMode
+        # The number of commands which were executed in-process, rather than
+        # by spawning a process.
+        self.spawnsAvoided = 0
+
+# Builtin commands.
+#
+# Each builtin is called as builtin(args, readStdin, shenv), where readStdin()
+# returns the data on the standard input of the command, and returns a tuple
+# (stdout, stderr, exitCode). A builtin returns None if it cannot emulate the
+# given arguments, in which case the real command is executed instead.
+#
+# The output of a builtin is held in memory, so builtins which copy files
+# leave files larger than kMaxCapturedOutputSize to the real command.
+
+def _toBytes(s):
+    # Note that in Python 2 the arguments are already byte strings.
+    if isinstance(s, bytes):
+        return s
+    return s.encode('utf-8')
+
+def _readFile(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _isLargeFile(path):
+    try:
+        return os.path.getsize(path) > kMaxCapturedOutputSize
+    except OSError:
+        return False
+
+def _splitOptions(args):
+    """_splitOptions(args) -> (options, operands)
+
+    Split the arguments of a command into the letters of its (single letter)
+    options and its operands."""
+    options = ''
+    operands = []
+    for i,arg in enumerate(args):
+        if arg == '--':
+            operands.extend(args[i+1:])
+            break
+        if arg.startswith('-') and arg != '-':
+            options += arg[1:]
+        else:
+            operands.append(arg)
+    return options,operands
+
+def executeBuiltinTrue(args, readStdin, shenv):
+    return (bytes(), bytes(), 0)
+
+def executeBuiltinFalse(args, readStdin, shenv):
+    return (bytes(), bytes(), 1)
+
+def executeBuiltinEcho(args, readStdin, shenv):
+    args = args[1:]
+    newline = True
+    if args and args[0] == '-n':
+        newline = False
+        args = args[1:]
+    # Leave any other options (which enable escapes, whose handling varies
+    # between echo implementations) to the real echo.
+    if args and re.match('-[neE]+$', args[0]):
+        return None
+    out = ' '.join(args)
+    if newline:
+        out += '\n'
+    return (_toBytes(out), bytes(), 0)
+
+def executeBuiltinCd(args, readStdin, shenv):
+    if len(args) != 2:
+        return None
+    path = os.path.join(shenv.cwd, args[1])
+    if not os.path.isdir(path):
+        return (bytes(), _toBytes('cd: %s: No such file or directory\n' % (
+                    args[1],)), 1)
+    shenv.cwd = os.path.normpath(path)
+    return (bytes(), bytes(), 0)
+
+def executeBuiltinRm(args, readStdin, shenv):
+    options,operands = _splitOptions(args[1:])
+    if options.strip('frR'):
+        return None
+    force = 'f' in options
+    recursive = 'r' in options or 'R' in options
+
+    err = ''
+    exitCode = 0
+    if not operands and not force:
+        err += 'rm: missing operand\n'
+        exitCode = 1
+    for name in operands:
+        path = os.path.join(shenv.cwd, name)
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                if not recursive:
+                    err += "rm: cannot remove '%s': Is a directory\n" % (name,)
+                    exitCode = 1
+                    continue
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            e = sys.exc_info()[1]
+            if force and e.errno == errno.ENOENT:
+                continue
+            err += "rm: cannot remove '%s': %s\n" % (name, e.strerror)
+            exitCode = 1
+    return (bytes(), _toBytes(err), exitCode)
+
+def executeBuiltinMkdir(args, readStdin, shenv):
+    options,operands = _splitOptions(args[1:])
+    if options.strip('p'):
+        return None
+    parents = 'p' in options
+
+    err = ''
+    exitCode = 0
+    if not operands:
+        err += 'mkdir: missing operand\n'
+        exitCode = 1
+    for name in operands:
+        path = os.path.join(shenv.cwd, name)
+        try:
+            if parents:
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            else:
+                os.mkdir(path)
+        except OSError:
+            e = sys.exc_info()[1]
+            err += "mkdir: cannot create directory '%s': %s\n" % (
+                name, e.strerror)
+            exitCode = 1
+    return (bytes(), _toBytes(err), exitCode)
+
+def executeBuiltinCat(args, readStdin, shenv):
+    options,operands = _splitOptions(args[1:])
+    if options:
+        return None
+    if not operands:
+        operands = ['-']
+    paths = [os.path.join(shenv.cwd, name) for name in operands
+             if name != '-']
+    if [path for path in paths if _isLargeFile(path)]:
+        return None
+
+    out = []
+    err = ''
+    exitCode = 0
+    for name in operands:
+        if name == '-':
+            out.append(readStdin())
+            continue
+        try:
+            out.append(_readFile(os.path.join(shenv.cwd, name)))
+        except IOError:
+            e = sys.exc_info()[1]
+            err += 'cat: %s: %s\n' % (name, e.strerror)
+            exitCode = 1
+    return (bytes().join(out), _toBytes(err), exitCode)
+
+def _diffFileDate(path):
+    # The modification time of a file, as 'diff -u' shows it.
+    st = os.stat(path)
+    ns = getattr(st, 'st_mtime_ns', None)
+    if ns is None:
+        ns = int(round(st.st_mtime * 1e9))
+    seconds = ns // 1000000000
+    local = time.localtime(seconds)
+    offset = (calendar.timegm(local) - seconds) // 60
+    sign = '+'
+    if offset < 0:
+        sign = '-'
+        offset = -offset
+    return '%s.%09d %s%02d%02d' % (time.strftime('%Y-%m-%d %H:%M:%S', local),
+                                   ns % 1000000000, sign, offset // 60,
+                                   offset % 60)
+
+def executeBuiltinDiff(args, readStdin, shenv):
+    options,operands = _splitOptions(args[1:])
+    if options.strip('u') or len(operands) != 2 or '-' in operands:
+        return None
+    paths = [os.path.join(shenv.cwd, name) for name in operands]
+    if [path for path in paths if os.path.isdir(path) or _isLargeFile(path)]:
+        return None
+
+    data = []
+    for name,path in zip(operands, paths):
+        try:
+            data.append(_readFile(path))
+        except IOError:
+            e = sys.exc_info()[1]
+            return (bytes(), _toBytes('diff: %s: %s\n' % (name, e.strerror)),
+                    2)
+    if data[0] == data[1]:
+        return (bytes(), bytes(), 0)
+
+    # Only the unified format is emulated, the differences between other
+    # files are left to the real diff.
+    if 'u' not in options:
+        return None
+    lines = [d.decode('ISO-8859-1').splitlines(True) for d in data]
+    out = []
+    for ln in difflib.unified_diff(lines[0], lines[1],
+                                   operands[0], operands[1],
+                                   _diffFileDate(paths[0]),
+                                   _diffFileDate(paths[1])):
+        out.append(ln)
+        if not ln.endswith('\n'):
+            out.append('\n\\ No newline at end of file\n')
+    return (''.join(out).encode('ISO-8859-1'), bytes(), 1)
+
+kBuiltinCommands = {
+    'cat' : executeBuiltinCat,
+    'cd' : executeBuiltinCd,
+    'diff' : executeBuiltinDiff,
+    'echo' : executeBuiltinEcho,
+    'false' : executeBuiltinFalse,
+    'mkdir' : executeBuiltinMkdir,
+    'rm' : executeBuiltinRm,
+    'true' : executeBuiltinTrue,
+}
+
+# Builtin tools.
+#
+# The tools of the test suites which are emulated in-process. Unlike builtin
+# commands, they are usually named by their path (which the test suites
+# substitute), and can read the output of a running process: as the last
+# command of a pipeline, they are executed once that output has been read in
+# full. Each is called as prepare(args, shenv), and returns None if it cannot
+# emulate the given arguments, or a function to call as run(readStdin), which
+# returns a tuple (stdout, stderr, exitCode).
+
+def _executeTool(args, input, shenv):
+    executable = lit.util.which(args[0], shenv.env['PATH'])
+    if not executable:
+        raise InternalShellError(ShUtil.Command(args, []),
+                                 '%r: command not found' % args[0])
+    timeoutHelper = shenv.timeoutHelper
+    kwargs = {}
+    if timeoutHelper.active():
+        kwargs = lit.util.kNewProcessGroupArgs
+    p = lit.util.Popen(args, cwd=shenv.cwd, executable=executable,
+                       stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, env=shenv.env,
+                       close_fds=kUseCloseFDs, **kwargs)
+    timeoutHelper.addProcess(p)
+    out,err = p.communicate(input)
+    return (out, err, p.returncode)
+
+def prepareBuiltinFileCheck(args, shenv):
+    """
+    prepareBuiltinFileCheck(args, shenv) -> run or None
+
+    In the 'builtin' mode, FileCheck is executed in-process (see lit.FileCheck)
+    whenever it can be. In the 'tool' mode, the tool is always executed. In the
+    'conformance' mode, both are, and the command fails if their results
+    differ in any way.
+    """
+    if shenv.fileCheckMode == 'tool':
+        return None
+    run = lit.FileCheck.prepare(args[1:], shenv.cwd)
+    if run is None or shenv.fileCheckMode != 'conformance':
+        return run
+
+    def runBoth(readStdin):
+        input = readStdin()
+        res = run(lambda: input)
+        expected = _executeTool(args, input, shenv)
+        if res != expected:
+            raise InternalShellError(
+                ShUtil.Command(args, []),
+                'the builtin FileCheck disagrees with the tool\n'
+                'builtin exit code: %r\nbuiltin stderr:\n%s\n'
+                'tool exit code: %r\ntool stderr:\n%s' % (
+                    res[2], lit.util.to_text(res[1]),
+                    expected[2], lit.util.to_text(expected[1])))
+        return res
+    return runBoth
+
+kBuiltinTools = {
+    'FileCheck' : prepareBuiltinFileCheck,
+}
+
+def getBuiltinTool(path):
+    """getBuiltinTool(path) -> prepare or None
+
+    Return the builtin emulating the tool at the given path, if any."""
+    name = os.path.basename(path)
+    if kIsWindows and name.lower().endswith('.exe'):
+        name = name[:-4]
+    return kBuiltinTools.get(name)
+
+def stripNotCommands(args):
+    """
+    stripNotCommands(args) -> (args, [expectCrash])
+
+    Remove any leading 'not' (or 'not --crash') commands from the given
+    command line, which the internal shell emulates by adjusting the exit code
+    of the command they run (see applyNotCommands()).
+    """
+    nots = []
+    while len(args) > 1 and args[0] == 'not':
+        if args[1] == '--crash':
+            if len(args) == 2:
+                break
+            nots.append(True)
+            args = args[2:]
+        else:
+            nots.append(False)
+            args = args[1:]
+    return args,nots
+
+def applyNotCommands(res, nots):
+    # This mirrors utils/not/not.cpp: 'not' succeeds if the command it runs
+    # fails (but does not crash), 'not --crash' succeeds if it crashes.
+    for expectCrash in reversed(nots):
+        if res < 0:
+            res = int(not expectCrash)
+        elif expectCrash:
+            res = 1
+        else:
+            res = int(res == 0)
+    return res
+
+class BuiltinProcess(object):
+    """
+    BuiltinProcess - Stands in for the subprocess.Popen object of a command
+    which was executed in-process.
+    """
+
+    def __init__(self, out, err, exitCode):
+        self.stdin = self.stdout = self.stderr = None
+        self.out = out
+        self.err = err
+        self.returncode = exitCode
+
+    def wait(self):
+        return self.returncode
+
+class DeferredBuiltinProcess(BuiltinProcess):
+    """
+    DeferredBuiltinProcess - Stands in for a builtin tool which reads the
+    output of the previous (running) process of a pipeline, and is executed by
+    RunningPipeline.finish() once that output has been read.
+    """
+
+    def __init__(self, run, input, stderrIsStdout):
+        BuiltinProcess.__init__(self, bytes(), bytes(), None)
+        self.run = run
+        # The pipe the input is read from.
+        self.input = input
+        self.stderrIsStdout = stderrIsStdout
+
+    def execute(self, data):
+        out,err,self.returncode = self.run(lambda: data)
+        if self.stderrIsStdout:
+            out,err = out + err, bytes()
+        self.out = out
+        self.err = err
+
+class PipedData(object):
+    """
+    PipedData - The output of a builtin command which is piped into the next
+    command of a pipeline.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+def writeToFile(f, data):
+    while data:
+        data = data[os.write(f.fileno(), data):]
+
+def writeToPipe(f, data):
+    try:
+        try:
+            f.write(data)
+        except (IOError, OSError):
+            # The process doesn't read all of its input.
+            pass
+    finally:
+        try:
+            f.close()
+        except (IOError, OSError):
+            pass
+
+def readStdinFrom(stdin):
+    if isinstance(stdin, PipedData):
+        return stdin.data
+    if stdin == subprocess.PIPE:
+        return bytes()
+    data = []
+    while True:
+        chunk = os.read(stdin.fileno(), 65536)
+        if not chunk:
+            break
+        data.append(chunk)
+    return bytes().join(data)
+
+def executeShCmd(cmd, shenv, results):
     if isinstance(cmd, ShUtil.Seq):
         if cmd.op == ';':
-            res = executeShCmd(cmd.lhs, cfg, cwd, results)
-            return executeShCmd(cmd.rhs, cfg, cwd, results)
+            res = executeShCmd(cmd.lhs, shenv, results)
+            return executeShCmd(cmd.rhs, shenv, results)
 
         if cmd.op == '&':
             raise InternalShellError(cmd,"unsupported shell operator: '&'")
 
         if cmd.op == '||':
-            res = executeShCmd(cmd.lhs, cfg, cwd, results)
+            res = executeShCmd(cmd.lhs, shenv, results)
             if res != 0:
-                res = executeShCmd(cmd.rhs, cfg, cwd, results)
+                res = executeShCmd(cmd.rhs, shenv, results)
             return res
 
         if cmd.op == '&&':
-            res = executeShCmd(cmd.lhs, cfg, cwd, results)
+            res = executeShCmd(cmd.lhs, shenv, results)
             if res is None:
                 return res
 
             if res == 0:
-                res = executeShCmd(cmd.rhs, cfg, cwd, results)
+                res = executeShCmd(cmd.rhs, shenv, results)
             return res
 
         raise ValueError('Unknown shell command: %r' % cmd.op)
 
     assert isinstance(cmd, ShUtil.Pipeline)
-    procs = []
+    pipeline = startPipeline(cmd, shenv)
+    return pipeline.finish(drainPipes(pipeline.getPipes(),
+                                      unbounded=pipeline.getInputPipes()),
+                           results)
+
+class RunningPipeline(object):
+    """
+    RunningPipeline - The processes of a pipeline started by startPipeline(),
+    whose outputs remain to be read.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        # The processes spawned by the pipeline are accounted to the
+        # ResourceUsage of the thread which started it.
+        self.usage = lit.util.getResourceUsage()
+        self.procs = []
+        self.procNots = []
+        self.writers = []
+        self.named_temp_files = []
+
+    def getPipes(self):
+        """getPipes() -> [file]
+
+        Return the pipes to read the remaining outputs from: the output of the
+        last process, and the stderr of every process."""
+        pipes = []
+        for p in self.procs:
+            for f in (p.stdout, p.stderr):
+                if f is not None:
+                    pipes.append(f)
+        return pipes
+
+    def getInputPipes(self):
+        """getInputPipes() -> [file]
+
+        Return the pipes among getPipes() which are the input of a builtin
+        tool, and so must be read in full."""
+        return [p.input for p in self.procs
+                if isinstance(p, DeferredBuiltinProcess)]
+
+    def getProcesses(self):
+        """getProcesses() -> [process]
+
+        Return the processes which were spawned, rather than executed
+        in-process."""
+        return [p for p in self.procs if not isinstance(p, BuiltinProcess)]
+
+    def finish(self, outputs, results):
+        """finish(outputs, results) -> exitCode
+
+        Given the data read from each of getPipes() until they were closed,
+        wait for the processes to exit and append the (command, stdout, stderr,
+        exit code) of each command to results."""
+        data = dict(zip(self.getPipes(), outputs))
+        for t in self.writers:
+            t.join()
+        procs = self.procs
+
+        # Execute the builtin tools, now that their inputs have been read. The
+        # outputs they read are not the outputs of the processes writing them.
+        error = None
+        for p in procs:
+            if isinstance(p, DeferredBuiltinProcess):
+                try:
+                    p.execute(data.pop(p.input, bytes()))
+                except InternalShellError:
+                    error = sys.exc_info()[1]
+                    p.returncode = 127
+
+        procData = []
+        for p in procs:
+            if isinstance(p, BuiltinProcess):
+                procData.append((p.out, p.err))
+            else:
+                procData.append((data.get(p.stdout, bytes()),
+                                 data.get(p.stderr, bytes())))
+
+        cmd = self.cmd
+        exitCode = None
+        for i,(out,err) in enumerate(procData):
+            res = procs[i].wait()
+            if (self.usage is not None and
+                    not isinstance(procs[i], BuiltinProcess)):
+                self.usage.addOutput(out, err)
+            # Detect Ctrl-C in subprocess.
+            if res == -signal.SIGINT:
+                raise KeyboardInterrupt
+            res = applyNotCommands(res, self.procNots[i])
+
+            # Ensure the resulting output is always of string type.
+            try:
+                out = str(out.decode('ascii'))
+            except:
+                out = str(out)
+            try:
+                err = str(err.decode('ascii'))
+            except:
+                err = str(err)
+
+            results.append((cmd.commands[i], out, err, res))
+            if cmd.pipe_err:
+                # Python treats the exit code as a signed char.
+                if exitCode is None:
+                    exitCode = res
+                elif res < 0:
+                    exitCode = min(exitCode, res)
+                else:
+                    exitCode = max(exitCode, res)
+            else:
+                exitCode = res
+
+        # Remove any named temporary files we created.
+        for f in self.named_temp_files:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+        if error is not None:
+            raise error
+
+        if cmd.negate:
+            exitCode = not exitCode
+
+        return exitCode
+
+def startPipeline(cmd, shenv):
+    """
+    startPipeline(cmd, shenv) -> RunningPipeline
+
+    Start the commands of the given pipeline, executing the builtin commands
+    in-process. The outputs of the pipeline must then be read, and the
+    pipeline finished, as executeShCmd() does.
+    """
+    pipeline = RunningPipeline(cmd)
+    procs = pipeline.procs
+    procNots = pipeline.procNots
+    writers = pipeline.writers
     input = subprocess.PIPE
-    stderrTempFiles = []
     opened_files = []
-    named_temp_files = []
-    # To avoid deadlock, we use a single stderr stream for piped
-    # output. This is null until we have seen some output using
-    # stderr.
+    named_temp_files = pipeline.named_temp_files
     for i,j in enumerate(cmd.commands):
         # Apply the redirections, we use (N,) as a sentinel to indicate stdin,
         # stdout, stderr for N equal to 0, 1, or 2 respectively. Redirects to or
@@ -101,7 +759,7 @@ def executeShCmd(cmd, cfg, cwd, results):
                     if kAvoidDevNull and r[0] == '/dev/null':
                         r[2] = tempfile.TemporaryFile(mode=r[1])
                     else:
-                        r[2] = open(r[0], r[1])
+                        r[2] = open(os.path.join(shenv.cwd, r[0]), r[1])
                     # Workaround a Win32 and/or subprocess bug when appending.
                     #
                     # FIXME: Actually, this is probably an instance of PR6753.
@@ -121,42 +779,149 @@ def executeShCmd(cmd, cfg, cwd, results):
         else:
             stderrIsStdout = False
 
-            # Don't allow stderr on a PIPE except for the last
-            # process, this could deadlock.
-            #
-            # FIXME: This is slow, but so is deadlock.
-            if stderr == subprocess.PIPE and j != cmd.commands[-1]:
-                stderr = tempfile.TemporaryFile(mode='w+b')
-                stderrTempFiles.append((i, stderr))
-
-        # Resolve the executable path ourselves.
-        args = list(j.args)
-        executable = lit.util.which(args[0], cfg.environment['PATH'])
-        if not executable:
-            raise InternalShellError(j, '%r: command not found' % j.args[0])
+        # Emulate any 'not' commands by adjusting the exit code of the command
+        # they run.
+        args,nots = stripNotCommands(list(j.args))
+        shenv.spawnsAvoided += len(nots)
 
         # Replace uses of /dev/null with temporary files.
         if kAvoidDevNull:
-            for i,arg in enumerate(args):
+            for index,arg in enumerate(args):
                 if arg == "/dev/null":
                     f = tempfile.NamedTemporaryFile(delete=False)
                     f.close()
                     named_temp_files.append(f.name)
-                    args[i] = f.name
-
-        procs.append(subprocess.Popen(args, cwd=cwd,
-                                      executable = executable,
-                                      stdin = stdin,
-                                      stdout = stdout,
-                                      stderr = stderr,
-                                      env = cfg.environment,
-                                      close_fds = kUseCloseFDs))
-
-        # Immediately close stdin for any process taking stdin from us.
-        if stdin == subprocess.PIPE:
+                    args[index] = f.name
+
+        # Execute builtin commands in-process, unless they would have to read
+        # from a running process. Builtin tools can do so as the last command
+        # of the pipeline, once the output of the process has been read.
+        isLast = i == len(cmd.commands) - 1
+        builtin = kBuiltinCommands.get(args[0])
+        prepareTool = None
+        if builtin is None:
+            prepareTool = getBuiltinTool(args[0])
+        builtinResult = None
+        if builtin is not None or prepareTool is not None:
+            # Like a real shell, commands in a pipeline can't change the state
+            # of the shell.
+            if len(cmd.commands) == 1:
+                builtinEnv = shenv
+            else:
+                builtinEnv = ShellEnvironment(shenv.cwd, shenv.env,
+                                              shenv.timeoutHelper,
+                                              shenv.fileCheckMode)
+            if prepareTool is not None:
+                builtin = None
+                run = prepareTool(args, builtinEnv)
+                if run is not None:
+                    builtin = lambda args, readStdin, shenv: run(readStdin)
+            readsRunningProcess = not (stdin == subprocess.PIPE or
+                                       isinstance(stdin, PipedData) or
+                                       stdin in opened_files)
+            if builtin is not None and not readsRunningProcess:
+                builtinResult = builtin(args, lambda: readStdinFrom(stdin),
+                                        builtinEnv)
+            elif (builtin is not None and prepareTool is not None and
+                  isLast and stdout == subprocess.PIPE and
+                  stderr in (subprocess.PIPE, subprocess.STDOUT)):
+                shenv.spawnsAvoided += 1
+                procs.append(DeferredBuiltinProcess(
+                        run, stdin, stderr == subprocess.STDOUT))
+                procNots.append(nots)
+                continue
+
+        if builtinResult is not None:
+            shenv.spawnsAvoided += 1
+            out,err,res = builtinResult
+            if stderr == subprocess.STDOUT:
+                out,err = out + err, bytes()
+            for f,data in ((stdout, out), (stderr, err)):
+                if f != subprocess.PIPE and f != subprocess.STDOUT:
+                    writeToFile(f, data)
+
+            if stdout != subprocess.PIPE or not isLast:
+                out = bytes()
+            if stderr != subprocess.PIPE or (stderrIsStdout and not isLast):
+                err = bytes()
+            procs.append(BuiltinProcess(out, err, res))
+            procNots.append(nots)
+
+            # Update the current stdin source.
+            if stdout == subprocess.PIPE:
+                input = PipedData(builtinResult[0])
+            elif stderrIsStdout:
+                input = PipedData(builtinResult[1])
+            else:
+                input = subprocess.PIPE
+            continue
+
+        # Resolve the executable path ourselves. Absolute paths (usually tools
+        # substituted into the script) are left to the OS to check, saving a
+        # stat() per command; on Windows, they may still need an extension.
+        if os.path.isabs(args[0]) and not kIsWindows:
+            executable = args[0]
+        else:
+            executable = lit.util.which(args[0], shenv.env['PATH'])
+        if not executable:
+            raise InternalShellError(j, '%r: command not found' % args[0])
+
+        if isinstance(stdin, PipedData):
+            pipedData = stdin.data
+            stdin = subprocess.PIPE
+        else:
+            pipedData = None
+
+        # Put each process in its own process group when there is a time
+        # limit, so that it can be killed along with its descendants.
+        timeoutHelper = shenv.timeoutHelper
+        if timeoutHelper.timeoutReached():
+            raise InternalShellError(j, 'reached timeout of %s seconds' % (
+                    timeoutHelper.timeout,))
+        kwargs = {}
+        if timeoutHelper.active():
+            kwargs = lit.util.kNewProcessGroupArgs
+        try:
+            procs.append(lit.util.Popen(args, cwd=shenv.cwd,
+                                        executable = executable,
+                                        stdin = stdin,
+                                        stdout = stdout,
+                                        stderr = stderr,
+                                        env = shenv.env,
+                                        close_fds = kUseCloseFDs,
+                                        **kwargs))
+        except OSError:
+            e = sys.exc_info()[1]
+            if e.errno != errno.ENOENT or os.path.exists(executable):
+                raise
+            raise InternalShellError(j, '%r: command not found' % args[0])
+        timeoutHelper.addProcess(procs[-1])
+        procNots.append(nots)
+
+        if pipedData is not None:
+            # Feed the output of the previous (builtin) command to the process
+            # while its outputs are read.
+            t = threading.Thread(target=writeToPipe,
+                                 args=(procs[-1].stdin, pipedData))
+            t.start()
+            writers.append(t)
+            procs[-1].stdin = None
+        elif stdin == subprocess.PIPE:
+            # Immediately close stdin for any process taking stdin from us.
             procs[-1].stdin.close()
             procs[-1].stdin = None
 
+        # The previous process's output now belongs to this one, so close our
+        # end of it.
+        if len(procs) > 1:
+            prev = procs[-2]
+            if prev.stdout is not None and prev.stdout is stdin:
+                prev.stdout.close()
+                prev.stdout = None
+            if prev.stderr is not None and prev.stderr is stdin:
+                prev.stderr.close()
+                prev.stderr = None
+
         # Update the current stdin source.
         if stdout == subprocess.PIPE:
             input = procs[-1].stdout
@@ -172,98 +937,92 @@ def executeShCmd(cmd, cfg, cwd, results):
     for f in opened_files:
         f.close()
 
-    # FIXME: There is probably still deadlock potential here. Yawn.
-    procData = [None] * len(procs)
-    procData[-1] = procs[-1].communicate()
-
-    for i in range(len(procs) - 1):
-        if procs[i].stdout is not None:
-            out = procs[i].stdout.read()
-        else:
-            out = ''
-        if procs[i].stderr is not None:
-            err = procs[i].stderr.read()
-        else:
-            err = ''
-        procData[i] = (out,err)
-
-    # Read stderr out of the temp files.
-    for i,f in stderrTempFiles:
-        f.seek(0, 0)
-        procData[i] = (procData[i][0], f.read())
-
-    exitCode = None
-    for i,(out,err) in enumerate(procData):
-        res = procs[i].wait()
-        # Detect Ctrl-C in subprocess.
-        if res == -signal.SIGINT:
-            raise KeyboardInterrupt
-
-        # Ensure the resulting output is always of string type.
-        try:
-            out = str(out.decode('ascii'))
-        except:
-            out = str(out)
-        try:
-            err = str(err.decode('ascii'))
-        except:
-            err = str(err)
-
-        results.append((cmd.commands[i], out, err, res))
-        if cmd.pipe_err:
-            # Python treats the exit code as a signed char.
-            if exitCode is None:
-                exitCode = res
-            elif res < 0:
-                exitCode = min(exitCode, res)
-            else:
-                exitCode = max(exitCode, res)
-        else:
-            exitCode = res
-
-    # Remove any named temporary files we created.
-    for f in named_temp_files:
-        try:
-            os.remove(f)
-        except OSError:
-            pass
-
-    if cmd.negate:
-        exitCode = not exitCode
-
-    return exitCode
+    return pipeline
 
-def executeScriptInternal(test, litConfig, tmpBase, commands, cwd):
+def _parseScript(commands, win32Escapes, pipefail):
     cmds = []
     for ln in commands:
         try:
-            cmds.append(ShUtil.ShParser(ln, litConfig.isWindows,
-                                        test.config.pipefail).parse())
+            cmds.append(ShUtil.ShParser(ln, win32Escapes, pipefail).parse())
         except:
-            return lit.Test.Result(Test.FAIL, "shell parser error on: %r" % ln)
+            raise ValueError("shell parser error on: %r" % ln)
 
     cmd = cmds[0]
     for c in cmds[1:]:
         cmd = ShUtil.Seq(cmd, '&&', c)
+    return cmd
 
-    results = []
+def parseScriptInternal(test, litConfig, commands):
+    """
+    parseScriptInternal(test, litConfig, commands) -> command or Result
+
+    Parse the commands of a script into a single command for the internal
+    shell, or return a failing result if one of them can't be parsed. The
+    parsed command is kept in the script cache, if there is one.
+    """
     try:
-        exitCode = executeShCmd(cmd, test.config, cwd, results)
-    except InternalShellError:
-        e = sys.exc_info()[1]
-        exitCode = 127
-        results.append((e.command, '', e.message, exitCode))
+        if litConfig.scriptCache is not None:
+            return litConfig.scriptCache.getParsedScript(
+                test.getSourcePath(), commands, litConfig.isWindows,
+                test.config.pipefail, _parseScript)
+        return _parseScript(commands, litConfig.isWindows,
+                            test.config.pipefail)
+    except ValueError:
+        return lit.Test.Result(Test.FAIL, str(sys.exc_info()[1]))
+
+def formatCommandResults(results):
+    """
+    formatCommandResults(results) -> output
 
-    out = err = ''
+    Format the (command, stdout, stderr, exit code) of each command executed by
+    the internal shell into the output of the script.
+    """
+    out = ''
     for i,(cmd, cmd_out,cmd_err,res) in enumerate(results):
         out += 'Command %d: %s\n' % (i, ' '.join('"%s"' % s for s in cmd.args))
         out += 'Command %d Result: %r\n' % (i, res)
         out += 'Command %d Output:\n%s\n\n' % (i, cmd_out)
         out += 'Command %d Stderr:\n%s\n\n' % (i, cmd_err)
+    return out
+
+def executeScriptInternal(test, litConfig, tmpBase, commands, cwd,
+                          shenv=None):
+    cmd = parseScriptInternal(test, litConfig, commands)
+    if isinstance(cmd, lit.Test.Result):
+        return cmd
+
+    if shenv is None:
+        shenv = ShellEnvironment(cwd, test.config.environment,
+                                 fileCheckMode=litConfig.fileCheckMode)
+    results = []
+    try:
+        exitCode = executeShCmd(cmd, shenv, results)
+    except InternalShellError:
+        e = sys.exc_info()[1]
+        exitCode = 127
+        results.append((e.command, '', e.message, exitCode))
 
-    return out, err, exitCode
+    return formatCommandResults(results), '', exitCode
 
-def executeScript(test, litConfig, tmpBase, commands, cwd):
+def formatBashScript(test, commands):
+    """
+    formatBashScript(test, commands) -> script
+
+    Return the text of the script executing the given commands with bash (or
+    sh), stopping at the first failure.
+    """
+    script = ''
+    if test.config.pipefail:
+        script += 'set -o pipefail;'
+    return script + '{ ' + '; } &&\n{ '.join(commands) + '; }\n'
+
+def writeScript(test, litConfig, tmpBase, commands):
+    """
+    writeScript(test, litConfig, tmpBase, commands) -> command
+
+    Write the commands of a script to a file for the external shell, and
+    return the command (an argv list) executing it.
+    """
     bashPath = litConfig.getBashPath();
     isWin32CMDEXE = (litConfig.isWindows and not bashPath)
     script = tmpBase + '.script'
@@ -277,11 +1036,9 @@ def executeScript(test, litConfig, tmpBase, commands, cwd):
     f = open(script, mode)
     if isWin32CMDEXE:
         f.write('\nif %ERRORLEVEL% NEQ 0 EXIT\n'.join(commands))
+        f.write('\n')
     else:
-        if test.config.pipefail:
-            f.write('set -o pipefail;')
-        f.write('{ ' + '; } &&\n{ '.join(commands) + '; }')
-    f.write('\n')
+        f.write(formatBashScript(test, commands))
     f.close()
 
     if isWin32CMDEXE:
@@ -295,21 +1052,38 @@ def executeScript(test, litConfig, tmpBase, commands, cwd):
             # FIXME: Running valgrind on sh is overkill. We probably could just
             # run on clang with no real loss.
             command = litConfig.valgrindArgs + command
+    return command
+
+def executeScript(test, litConfig, tmpBase, commands, cwd, timeout=0):
+    # Use a persistent shell, rather than starting one, when possible.
+    env = test.config.environment
+    if (litConfig.useShellServer and
+            lit.ShellServer.canExecute(litConfig, env)):
+        return lit.ShellServer.executeScript(formatBashScript(test, commands),
+                                             litConfig, cwd, env, timeout)
 
+    command = writeScript(test, litConfig, tmpBase, commands)
     return lit.util.executeCommand(command, cwd=cwd,
-                                   env=test.config.environment)
+                                   env=test.config.environment,
+                                   timeout=timeout)
 
-def parseIntegratedTestScriptCommands(source_path):
+def parseIntegratedTestScriptCommands(source_path,
+                                      directives_in_header=False):
     """
-    parseIntegratedTestScriptCommands(source_path) -> commands
+    parseIntegratedTestScriptCommands(source_path, [directives_in_header])
+      -> commands
 
     Parse the commands in an integrated test script file into a list of
     (line_number, command_type, line).
+
+    Scanning stops at an 'END.' command (which is returned), or if
+    directives_in_header is true, at the first line without a command after
+    the first command.
     """
 
     # This code is carefully written to be dual compatible with Python 2.5+ and
     # Python 3 without requiring input files to always have valid codings. The
-    # trick we use is to open the file in binary mode and use the regular
+    # trick we use is to map the file in binary mode and use the regular
     # expression library to find the commands, with it scanning strings in
     # Python2 and bytes in Python3.
     #
@@ -317,45 +1091,132 @@ def parseIntegratedTestScriptCommands(source_path):
     # ascii, so we convert the outputs to ascii before returning. This way the
     # remaining code can work with "strings" agnostic of the executing Python
     # version.
-    
+    #
+    # The file is mapped rather than read, so only the parts of it which are
+    # scanned are actually read in.
+
     def to_bytes(str):
         # Encode to Latin1 to get binary data.
         return str.encode('ISO-8859-1')
     keywords = ('RUN:', 'XFAIL:', 'REQUIRES:', 'END.')
     keywords_re = re.compile(
         to_bytes("(%s)(.*)\n" % ("|".join(k for k in keywords),)))
+    newline = to_bytes('\n')
 
     f = open(source_path, 'rb')
     try:
-        # Read the entire file contents.
-        data = f.read()
-
-        # Iterate over the matches.
-        line_number = 1
-        last_match_position = 0
-        for match in keywords_re.finditer(data):
-            # Compute the updated line number by counting the intervening
-            # newlines.
-            match_position = match.start()
-            line_number += data.count(to_bytes('\n'), last_match_position,
-                                      match_position)
-            last_match_position = match_position
-
-            # Convert the keyword and line to ascii strings and yield the
-            # command. Note that we take care to return regular strings in
-            # Python 2, to avoid other code having to differentiate between the
-            # str and unicode types.
-            keyword,ln = match.groups()
-            yield (line_number, str(keyword[:-1].decode('ascii')),
-                   str(ln.decode('ascii')))
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Empty files can't be mapped (and some files can't be mapped at
+            # all), read those instead.
+            data = f.read()
+        try:
+            # Iterate over the matches.
+            line_number = 1
+            last_match_position = 0
+            match = keywords_re.search(data)
+            while match:
+                # Compute the updated line number by counting the intervening
+                # newlines.
+                match_position = match.start()
+                line_number += data[last_match_position:match_position].count(
+                    newline)
+                last_match_position = match_position
+
+                # Convert the keyword and line to ascii strings and yield the
+                # command. Note that we take care to return regular strings in
+                # Python 2, to avoid other code having to differentiate between
+                # the str and unicode types.
+                keyword,ln = match.groups()
+                keyword = str(keyword[:-1].decode('ascii'))
+                ln = str(ln.decode('ascii'))
+                yield (line_number, keyword, ln)
+
+                # END commands are only honored if the rest of the line is
+                # empty.
+                if keyword == 'END' and not ln.strip():
+                    break
+
+                if directives_in_header:
+                    # Only look for a command on the next line.
+                    end = data.find(newline, match.end())
+                    if end == -1:
+                        break
+                    match = keywords_re.search(data, match.end(), end + 1)
+                else:
+                    match = keywords_re.search(data, match.end())
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
     finally:
         f.close()
 
+kLineNumberRE = re.compile('%\(line\)')
+kLineNumberOffsetRE = re.compile('%\(line *([\+-]) *(\d+)\)')
+
+# The compiled substitution patterns, shared by all the tests (and
+# configurations) in this process. Each entry is (regex, literal), where
+# literal is a string which any match must contain ('' if unknown).
+_substitutionPatterns = {}
+
+def _getRequiredLiteral(pattern):
+    # Only handle the common forms: a literal string, optionally preceded by a
+    # '\b' or '^' anchor and followed by arbitrary regular expression syntax.
+    if not isinstance(pattern, str) or '|' in pattern or '(?' in pattern:
+        return ''
+    if pattern.startswith('\\b'):
+        pattern = pattern[2:]
+    elif pattern.startswith('^'):
+        pattern = pattern[1:]
+    literal = ''
+    for i,c in enumerate(pattern):
+        if c in '.^$*+?[]\\()':
+            break
+        if c == '{' and re.match(r'{\d*,?\d*}', pattern[i:]):
+            break
+        literal += c
+    # The last character may be optional.
+    if pattern[len(literal):len(literal)+1] in ('*', '?', '{'):
+        literal = literal[:-1]
+    return literal
+
+def getSubstitutionPattern(pattern):
+    """getSubstitutionPattern(pattern) -> (regex, literal)
+
+    Return the compiled regular expression for a substitution pattern, along
+    with a string any match must contain."""
+    res = _substitutionPatterns.get(pattern)
+    if res is None:
+        res = (re.compile(pattern), _getRequiredLiteral(pattern))
+        _substitutionPatterns[pattern] = res
+    return res
+
+def applySubstitutions(ln, substitutions):
+    """applySubstitutions(ln, substitutions) -> ln
+
+    Apply the given (pattern, replacement) substitutions to a script line, in
+    order. Allow full regular expression syntax: each substitution is applied
+    to the result of the previous ones, so a replacement may itself contain
+    patterns which are substituted later.
+    """
+    for a,b in substitutions:
+        regex,literal = getSubstitutionPattern(a)
+        # Most patterns don't occur in most lines, skip those without running
+        # the regular expression.
+        if literal not in ln:
+            continue
+        if kIsWindows:
+            b = b.replace("\\","\\\\")
+        ln = regex.sub(b, ln)
+    return ln
+
 def parseIntegratedTestScript(test, normalize_slashes=False,
-                              extra_substitutions=[]):
+                              extra_substitutions=[], litConfig=None):
     """parseIntegratedTestScript - Scan an LLVM/Clang style integrated test
     script and extract the lines to 'RUN' as well as 'XFAIL' and 'REQUIRES'
     information. The RUN lines also will have variable substitution performed.
+    If a litConfig is given, its script cache is used.
     """
 
     # Get the temporary location, this is always relative to the test suite
@@ -398,22 +1259,29 @@ def parseIntegratedTestScript(test, normalize_slashes=False,
             ])
 
     # Collect the test lines from the script.
+    directives_in_header = test.config.directives_in_header
+    if litConfig is not None and litConfig.scriptCache is not None:
+        commands = litConfig.scriptCache.getCommands(
+            sourcepath, directives_in_header, parseIntegratedTestScriptCommands)
+    else:
+        commands = parseIntegratedTestScriptCommands(sourcepath,
+                                                     directives_in_header)
     script = []
     requires = []
-    for line_number, command_type, ln in \
-            parseIntegratedTestScriptCommands(sourcepath):
+    for line_number, command_type, ln in commands:
         if command_type == 'RUN':
             # Trim trailing whitespace.
             ln = ln.rstrip()
 
             # Substitute line number expressions
-            ln = re.sub('%\(line\)', str(line_number), ln)
-            def replace_line_number(match):
-                if match.group(1) == '+':
-                    return str(line_number + int(match.group(2)))
-                if match.group(1) == '-':
-                    return str(line_number - int(match.group(2)))
-            ln = re.sub('%\(line *([\+-]) *(\d+)\)', replace_line_number, ln)
+            if '%(line' in ln:
+                ln = kLineNumberRE.sub(str(line_number), ln)
+                def replace_line_number(match):
+                    if match.group(1) == '+':
+                        return str(line_number + int(match.group(2)))
+                    if match.group(1) == '-':
+                        return str(line_number - int(match.group(2)))
+                ln = kLineNumberOffsetRE.sub(replace_line_number, ln)
 
             # Collapse lines with trailing '\\'.
             if script and script[-1][-1] == '\\':
@@ -432,19 +1300,9 @@ def parseIntegratedTestScript(test, normalize_slashes=False,
             raise ValueError("unknown script command type: %r" % (
                     command_type,))
 
-    # Apply substitutions to the script.  Allow full regular
-    # expression syntax.  Replace each matching occurrence of regular
-    # expression pattern a with substitution b in line ln.
-    def processLine(ln):
-        # Apply substitutions
-        for a,b in substitutions:
-            if kIsWindows:
-                b = b.replace("\\","\\\\")
-            ln = re.sub(a, b, ln)
-
-        # Strip the trailing newline and any extra whitespace.
-        return ln.strip()
-    script = [processLine(ln)
+    # Apply substitutions to the script, and strip the trailing newline and any
+    # extra whitespace.
+    script = [applySubstitutions(ln, substitutions).strip()
               for ln in script]
 
     # Verify the script contains a run line.
@@ -466,12 +1324,28 @@ def parseIntegratedTestScript(test, normalize_slashes=False,
 
     return script,tmpBase,execdir
 
-def executeShTest(test, litConfig, useExternalSh,
-                  extra_substitutions=[]):
+def _isCacheable(test, status):
+    # Only results which will be reported as a PASS or an XFAIL are cached;
+    # anything else needs to be looked at, so will be run again.
+    if test.isExpectedToFail():
+        return status == Test.FAIL
+    return status == Test.PASS
+
+def prepareShTest(test, litConfig, useExternalSh, extra_substitutions=[]):
+    """
+    prepareShTest(test, litConfig, useExternalSh, [extra_substitutions])
+      -> (script, tmpBase, execdir, cacheKey, dependencies) or Result
+
+    Parse the script of a test and create its output directory, or return the
+    result of the test if it doesn't need to be executed (for example, if its
+    result is cached). If litConfig.recordDependencies is set, the result of
+    the test is to carry the files it depends on (see lit.DependencyIndex).
+    """
     if test.config.unsupported:
-        return (Test.UNSUPPORTED, 'Test is unsupported')
+        return lit.Test.Result(Test.UNSUPPORTED, 'Test is unsupported')
 
-    res = parseIntegratedTestScript(test, useExternalSh, extra_substitutions)
+    res = parseIntegratedTestScript(test, useExternalSh, extra_substitutions,
+                                    litConfig)
     if isinstance(res, lit.Test.Result):
         return res
     if litConfig.noExecute:
@@ -479,18 +1353,53 @@ def executeShTest(test, litConfig, useExternalSh,
 
     script, tmpBase, execdir = res
 
+    # Find what the script executes and reads, if anything needs to know.
+    references = None
+    if litConfig.resultCache is not None or litConfig.recordDependencies:
+        references = lit.ResultCache.getScriptReferences(test, litConfig,
+                                                         script, tmpBase)
+    dependencies = None
+    if litConfig.recordDependencies:
+        dependencies = lit.DependencyIndex.getDependencies(test, references)
+
+    # If the result cache is enabled, reuse the previous result of the test if
+    # none of its inputs have changed.
+    cacheKey = None
+    if litConfig.resultCache is not None:
+        cacheKey = lit.ResultCache.getShTestKey(test, script, references)
+        if cacheKey is not None:
+            cached = litConfig.resultCache.get(cacheKey)
+            # Whether the test is expected to fail can change without its
+            # script changing (with the available features).
+            if cached is not None and _isCacheable(test, cached[0]):
+                result = lit.Test.Result(*cached)
+                result.cached = True
+                if litConfig.recordDependencies:
+                    result.dependencies = dependencies
+                return result
+
     # Create the output directory if it does not already exist.
     lit.util.mkdir_p(os.path.dirname(tmpBase))
 
-    if useExternalSh:
-        res = executeScript(test, litConfig, tmpBase, script, execdir)
-    else:
-        res = executeScriptInternal(test, litConfig, tmpBase, script, execdir)
+    return script, tmpBase, execdir, cacheKey, dependencies
+
+def finishShTest(test, litConfig, script, res, cacheKey, timeout,
+                 timeoutReached, shenv=None, dependencies=None):
+    """
+    finishShTest(test, litConfig, script, res, cacheKey, timeout,
+                 timeoutReached, [shenv], [dependencies]) -> Result
+
+    Form the result of a test from the (out, err, exitCode) its script
+    produced (or the result it failed with), given the values returned by
+    prepareShTest().
+    """
     if isinstance(res, lit.Test.Result):
         return res
 
     out,err,exitCode = res
-    if exitCode == 0:
+    if timeoutReached:
+        status = Test.TIMEOUT
+    elif exitCode == 0:
         status = Test.PASS
     else:
         status = Test.FAIL
@@ -498,6 +1407,8 @@ def executeShTest(test, litConfig, useExternalSh,
     # Form the output log.
     output = """Script:\n--\n%s\n--\nExit Code: %d\n\n""" % (
         '\n'.join(script), exitCode)
+    if timeoutReached:
+        output += 'Reached timeout of %s seconds\n\n' % (timeout,)
 
     # Append the outputs, if present.
     if out:
@@ -505,4 +1416,45 @@ def executeShTest(test, litConfig, useExternalSh,
     if err:
         output += """Command Output (stderr):\n--\n%s\n--\n""" % (err,)
 
-    return lit.Test.Result(status, output)
+    if cacheKey is not None and _isCacheable(test, status):
+        litConfig.resultCache.put(cacheKey, status, output)
+
+    result = lit.Test.Result(status, output)
+    if shenv is not None:
+        result.spawnsAvoided = shenv.spawnsAvoided
+    if litConfig.recordDependencies:
+        result.dependencies = dependencies
+    return result
+
+def executeShTest(test, litConfig, useExternalSh,
+                  extra_substitutions=[]):
+    res = prepareShTest(test, litConfig, useExternalSh, extra_substitutions)
+    if isinstance(res, lit.Test.Result):
+        return res
+    script, tmpBase, execdir, cacheKey, dependencies = res
+
+    shenv = None
+    timeout = litConfig.getTestTimeout(test.config)
+    timeoutReached = False
+    if useExternalSh:
+        try:
+            res = executeScript(test, litConfig, tmpBase, script, execdir,
+                                timeout)
+        except lit.util.ExecuteCommandTimeoutException:
+            e = sys.exc_info()[1]
+            res = (e.out, e.err, e.exitCode)
+            timeoutReached = True
+    else:
+        timeoutHelper = lit.util.TimeoutHelper(timeout)
+        shenv = ShellEnvironment(execdir, test.config.environment,
+                                 timeoutHelper, litConfig.fileCheckMode)
+        timeoutHelper.start()
+        try:
+            res = executeScriptInternal(test, litConfig, tmpBase, script,
+                                        execdir, shenv)
+        finally:
+            timeoutHelper.cancel()
+        timeoutReached = timeoutHelper.timeoutReached()
+
+    return finishShTest(test, litConfig, script, res, cacheKey, timeout,
+                        timeoutReached, shenv, dependencies)
@@ -0,0 +1,130 @@
+"""
+Historical test timing support.
+
+Each test suite keeps a small database of how long its tests took to execute
+in previous runs, in a file in the suite's exec root. The database is keyed by
+the full test name, and is used to dispatch the slowest tests first so that
+long running tests do not end up executing alone at the tail of a parallel
+run.
+"""
+
+import os
+import sys
+
+kTestTimesFileName = '.lit_test_times.txt'
+
+def getTestTimesPath(suite):
+    return os.path.join(suite.exec_root, kTestTimesFileName)
+
+def read_test_times(suite):
+    """
+    read_test_times(suite) -> {test name : elapsed}
+
+    Load the recorded test times for the given suite, returning an empty
+    dictionary if no (readable) database exists.
+    """
+    times = {}
+    try:
+        f = open(getTestTimesPath(suite))
+    except IOError:
+        return times
+    try:
+        for ln in f:
+            # Each line is '<elapsed> <full test name>'; silently drop anything
+            # we don't understand, the database is only a hint.
+            elapsed,_,name = ln.rstrip('\n').partition(' ')
+            try:
+                times[name] = float(elapsed)
+            except ValueError:
+                continue
+    finally:
+        f.close()
+    return times
+
+def record_test_times(tests, lit_config):
+    """
+    record_test_times(tests, lit_config)
+
+    Merge the elapsed times of the given (completed) tests into the timing
+    database of their suites.
+    """
+    times_by_suite = {}
+    for t in tests:
+        # Tests which were never run are given a zero elapsed time, don't let
+        # those clobber real measurements.
+        if t.result is None or not t.result.elapsed:
+            continue
+        times_by_suite.setdefault(t.suite, {})[t.getFullName()] = \
+            t.result.elapsed
+
+    for suite,new_times in times_by_suite.items():
+        times = read_test_times(suite)
+        times.update(new_times)
+
+        path = getTestTimesPath(suite)
+        temp_path = path + '.tmp'
+        try:
+            f = open(temp_path, 'w')
+            try:
+                for name,elapsed in sorted(times.items()):
+                    f.write('%f %s\n' % (elapsed, name))
+            finally:
+                f.close()
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows doesn't allow renaming over an existing file.
+                os.remove(path)
+                os.rename(temp_path, path)
+        except (IOError, OSError):
+            e = sys.exc_info()[1]
+            if lit_config.debug:
+                lit_config.note('unable to write test times %r: %s' % (path,
+                                                                       e))
+
+def get_dispatch_order(tests):
+    """
+    get_dispatch_order(tests) -> [test index]
+
+    Compute the order in which the given tests should be handed out to the
+    workers: longest known processing time first. Tests with no recorded time
+    are estimated with the average time of their suite (or of all known tests
+    if their suite has none), and batches of GoogleTest tests (see
+    GoogleTest.batchTests()) with the sum of the estimates of their tests.
+    Ties retain the original test order.
+    """
+    times_by_suite = {}
+    for t in tests:
+        if t.suite not in times_by_suite:
+            times_by_suite[t.suite] = read_test_times(t.suite)
+
+    def average(values):
+        values = list(values)
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    all_times = []
+    suite_averages = {}
+    for suite,times in times_by_suite.items():
+        all_times.extend(times.values())
+        suite_averages[suite] = average(times.values())
+    global_average = average(all_times) or 0.0
+
+    def estimate_test(t):
+        elapsed = times_by_suite[t.suite].get(t.getFullName())
+        if elapsed is None:
+            elapsed = suite_averages[t.suite]
+            if elapsed is None:
+                elapsed = global_average
+        return elapsed
+
+    def estimate(index):
+        t = tests[index]
+        # The times of batches are never recorded, those of their tests are.
+        batch = getattr(t, 'gtest_tests', None)
+        if batch is not None:
+            return -sum(estimate_test(bt) for bt,testName in batch)
+        return -estimate_test(t)
+
+    return sorted(range(len(tests)), key=estimate)
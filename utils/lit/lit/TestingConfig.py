@@ -1,13 +1,51 @@
+import copy
 import os
 import sys
 
 PY2 = sys.version_info[0] < 3
 
-class TestingConfig:
+# The attributes of a config holding containers, with the type each is
+# normalized to once the config is loaded (except for available_features).
+kContainerAttributes = (('suffixes', set),
+                        ('environment', dict),
+                        ('substitutions', list),
+                        ('excludes', set),
+                        ('available_features', set),
+                        ('test_resources', dict))
+
+def _containerProperty(name):
+    # The container is shared with the config this one was derived from until
+    # it is assigned, or used while this config is being loaded (which may
+    # change it in place), at which point this config gets its own copy.
+    def get(self):
+        value = self._containers[name]
+        if self._loading and name in self._shared:
+            value = copy.copy(value)
+            self._containers[name] = value
+            self._shared.discard(name)
+        return value
+    def set(self, value):
+        self._containers[name] = value
+        self._shared.discard(name)
+    return property(get, set)
+
+class TestingConfig(object):
     """"
     TestingConfig - Information on the tests inside a suite.
+
+    The configs of the directories of a suite with a local configuration file
+    are derived from the config of the parent directory, sharing its
+    containers (environment, substitutions, ...) until the local configuration
+    changes them. A config must therefore not be changed once it is loaded.
     """
 
+    suffixes = _containerProperty('suffixes')
+    environment = _containerProperty('environment')
+    substitutions = _containerProperty('substitutions')
+    excludes = _containerProperty('excludes')
+    available_features = _containerProperty('available_features')
+    test_resources = _containerProperty('test_resources')
+
     @staticmethod
     def fromdefaults(litConfig):
         """
@@ -53,7 +91,10 @@ class TestingConfig:
                              test_source_root = None,
                              excludes = [],
                              available_features = available_features,
-                             pipefail = True)
+                             pipefail = True,
+                             directives_in_header = False,
+                             test_resources = {},
+                             test_timeout = 0)
 
     def load_from_path(self, path, litConfig):
         """
@@ -71,16 +112,24 @@ class TestingConfig:
             litConfig.fatal('unable to load config file: %r' % (path,))
         f.close()
 
-        # Execute the config script to initialize the object.
+        # Execute the config script to initialize the object, compiling it (or
+        # reusing the code it was compiled to) first.
         cfg_globals = dict(globals())
         cfg_globals['config'] = self
         cfg_globals['lit_config'] = litConfig
         cfg_globals['__file__'] = path
+        # Configuration files can load others (see LitConfig.load_config()).
+        wasLoading = self._loading
+        self._loading = True
         try:
+            if litConfig.configCache is not None:
+                code = litConfig.configCache.compile(data, path)
+            else:
+                code = compile(data, path, 'exec', 0, True)
             if PY2:
-                exec("exec data in cfg_globals")
+                exec("exec code in cfg_globals")
             else:
-                exec(data, cfg_globals)
+                exec(code, cfg_globals)
             if litConfig.debug:
                 litConfig.note('... loaded config %r' % path)
         except SystemExit:
@@ -94,13 +143,19 @@ class TestingConfig:
             litConfig.fatal(
                 'unable to parse config file %r, traceback: %s' % (
                     path, traceback.format_exc()))
+        finally:
+            self._loading = wasLoading
 
         self.finish(litConfig)
 
     def __init__(self, parent, name, suffixes, test_format,
                  environment, substitutions, unsupported,
                  test_exec_root, test_source_root, excludes,
-                 available_features, pipefail):
+                 available_features, pipefail, directives_in_header,
+                 test_resources, test_timeout):
+        self._containers = {}
+        self._shared = set()
+        self._loading = False
         self.parent = parent
         self.name = str(name)
         self.suffixes = set(suffixes)
@@ -113,14 +168,19 @@ class TestingConfig:
         self.excludes = set(excludes)
         self.available_features = set(available_features)
         self.pipefail = pipefail
+        self.directives_in_header = directives_in_header
+        self.test_resources = dict(test_resources)
+        self.test_timeout = test_timeout
 
     def finish(self, litConfig):
         """finish() - Finish this config object, after loading is complete."""
 
         self.name = str(self.name)
-        self.suffixes = set(self.suffixes)
-        self.environment = dict(self.environment)
-        self.substitutions = list(self.substitutions)
+        # Normalize the containers this config doesn't share (the shared ones
+        # already are).
+        for name,normalize in kContainerAttributes:
+            if name not in self._shared and name != 'available_features':
+                self._containers[name] = normalize(self._containers[name])
         if self.test_exec_root is not None:
             # FIXME: This should really only be suite in test suite config
             # files. Should we distinguish them?
@@ -129,7 +189,20 @@ class TestingConfig:
             # FIXME: This should really only be suite in test suite config
             # files. Should we distinguish them?
             self.test_source_root = str(self.test_source_root)
-        self.excludes = set(self.excludes)
+
+    def derive(self):
+        """
+        derive() -> TestingConfig
+
+        Create a config to load a local configuration file into, starting out
+        as a copy of this (loaded) one.
+        """
+        config = object.__new__(self.__class__)
+        config.__dict__.update(self.__dict__)
+        config._containers = dict(self._containers)
+        config._shared = set(self._containers)
+        config._loading = False
+        return config
 
     @property
     def root(self):
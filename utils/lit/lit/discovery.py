@@ -2,20 +2,24 @@
 Test discovery functions.
 """
 
-import copy
 import os
 import sys
 
+try:
+    from multiprocessing.pool import ThreadPool
+except ImportError:
+    ThreadPool = None
+
 import lit.run
 from lit.TestingConfig import TestingConfig
 from lit import LitConfig, Test
 
 def dirContainsTestSuite(path, lit_config):
     cfgpath = os.path.join(path, lit_config.site_config_name)
-    if os.path.exists(cfgpath):
+    if lit_config.discoveryCache.exists(cfgpath):
         return cfgpath
     cfgpath = os.path.join(path, lit_config.config_name)
-    if os.path.exists(cfgpath):
+    if lit_config.discoveryCache.exists(cfgpath):
         return cfgpath
 
 def getTestSuite(item, litConfig, cache):
@@ -86,12 +90,12 @@ def getLocalConfig(ts, path_in_suite, litConfig, cache):
         cfgpath = os.path.join(source_path, litConfig.local_config_name)
 
         # If not, just reuse the parent config.
-        if not os.path.exists(cfgpath):
+        if not litConfig.discoveryCache.exists(cfgpath):
             return parent
 
-        # Otherwise, copy the current config and load the local configuration
-        # file into it.
-        config = copy.copy(parent)
+        # Otherwise, derive a config from the current one and load the local
+        # configuration file into it.
+        config = parent.derive()
         if litConfig.debug:
             litConfig.note('loading local config %r' % cfgpath)
         config.load_from_path(cfgpath, litConfig)
@@ -106,7 +110,7 @@ def getLocalConfig(ts, path_in_suite, litConfig, cache):
 
     return search(path_in_suite)
 
-def getTests(path, litConfig, testSuiteCache, localConfigCache):
+def getTests(path, litConfig, testSuiteCache, localConfigCache, pool=None):
     # Find the test suite for this input and its relative path.
     ts,path_in_suite = getTestSuite(path, litConfig, testSuiteCache)
     if ts is None:
@@ -118,10 +122,84 @@ def getTests(path, litConfig, testSuiteCache, localConfigCache):
                                                         path_in_suite))
 
     return ts, getTestsInSuite(ts, path_in_suite, litConfig,
-                               testSuiteCache, localConfigCache)
+                               testSuiteCache, localConfigCache, pool)
+
+class PendingTests(object):
+    """
+    PendingTests - The tests found by a test format in a single directory,
+    which may still be being searched for on a discovery thread.
+    """
+
+    def __init__(self, pool, test_format, args):
+        if pool is None:
+            self.result = searchDirectory(test_format, args)
+            self.async_result = None
+        else:
+            self.result = None
+            self.async_result = pool.apply_async(searchDirectory,
+                                                 (test_format, args))
+
+    def get(self):
+        if self.async_result is not None:
+            self.result = self.async_result.get()
+            self.async_result = None
+        ok,value = self.result
+        if not ok:
+            raise value
+        return value
+
+def searchDirectory(test_format, args):
+    # Thread pools don't propagate exceptions which are not derived from
+    # Exception (and leave the result unset), so hand the exit requests from
+    # LitConfig.fatal() back explicitly.
+    try:
+        return True, list(test_format.getTestsInDirectory(*args))
+    except (SystemExit, KeyboardInterrupt):
+        return False, sys.exc_info()[1]
+
+class SubSuiteTests(object):
+    """
+    SubSuiteTests - The (pending) tests found in a nested test suite.
+    """
+
+    def __init__(self, suite, items):
+        self.suite = suite
+        self.items = items
 
 def getTestsInSuite(ts, path_in_suite, litConfig,
-                    testSuiteCache, localConfigCache):
+                    testSuiteCache, localConfigCache, pool=None):
+    """
+    getTestsInSuite(ts, path_in_suite, litConfig, testSuiteCache,
+                    localConfigCache, [pool]) -> [Test] iterator
+
+    Find the tests in the given suite path. The suites and local configs are
+    always loaded on the calling thread, but if a thread pool is given the
+    test formats search the individual directories on it, concurrently with
+    walking the rest of the tree (and with each other). The tests are produced
+    in the same order either way.
+    """
+    items = list(walkSuite(ts, path_in_suite, litConfig, testSuiteCache,
+                           localConfigCache, pool))
+    return resolveTests(items, litConfig)
+
+def resolveTests(items, litConfig):
+    for item in items:
+        if isinstance(item, Test.Test):
+            yield item
+        elif isinstance(item, SubSuiteTests):
+            N = 0
+            for res in resolveTests(item.items, litConfig):
+                N += 1
+                yield res
+            if not N:
+                litConfig.warning('test suite %r contained no tests' % (
+                        item.suite.name,))
+        else:
+            for res in item.get():
+                yield res
+
+def walkSuite(ts, path_in_suite, litConfig, testSuiteCache, localConfigCache,
+              pool):
     # Check that the source path exists (errors here are reported by the
     # caller).
     source_path = ts.getSourcePath(path_in_suite)
@@ -140,20 +218,17 @@ def getTestsInSuite(ts, path_in_suite, litConfig,
 
     # Search for tests.
     if lc.test_format is not None:
-        for res in lc.test_format.getTestsInDirectory(ts, path_in_suite,
-                                                      litConfig, lc):
-            yield res
+        yield PendingTests(pool, lc.test_format,
+                           (ts, path_in_suite, litConfig, lc))
 
     # Search subdirectories.
-    for filename in os.listdir(source_path):
+    _,dirnames = litConfig.discoveryCache.listdir(source_path)
+    for filename in dirnames:
         # FIXME: This doesn't belong here?
         if filename in ('Output', '.svn', '.git') or filename in lc.excludes:
             continue
 
-        # Ignore non-directories.
         file_sourcepath = os.path.join(source_path, filename)
-        if not os.path.isdir(file_sourcepath):
-            continue
 
         # Check for nested test suites, first in the execpath in case there is a
         # site configuration and then in the source path.
@@ -176,25 +251,20 @@ def getTestsInSuite(ts, path_in_suite, litConfig,
 
         # Otherwise, load from the nested test suite, if present.
         if sub_ts is not None:
-            subiter = getTestsInSuite(sub_ts, subpath_in_suite, litConfig,
-                                      testSuiteCache, localConfigCache)
+            yield SubSuiteTests(sub_ts, list(walkSuite(
+                        sub_ts, subpath_in_suite, litConfig, testSuiteCache,
+                        localConfigCache, pool)))
         else:
-            subiter = getTestsInSuite(ts, subpath, litConfig, testSuiteCache,
-                                      localConfigCache)
-
-        N = 0
-        for res in subiter:
-            N += 1
-            yield res
-        if sub_ts and not N:
-            litConfig.warning('test suite %r contained no tests' % sub_ts.name)
+            for res in walkSuite(ts, subpath, litConfig, testSuiteCache,
+                                 localConfigCache, pool):
+                yield res
 
-def find_tests_for_inputs(lit_config, inputs):
+def find_tests_for_inputs(lit_config, inputs, jobs=1):
     """
-    find_tests_for_inputs(lit_config, inputs) -> [Test]
+    find_tests_for_inputs(lit_config, inputs, [jobs]) -> [Test]
 
     Given a configuration object and a list of input specifiers, find all the
-    tests to execute.
+    tests to execute, searching up to jobs directories in parallel.
     """
 
     # Expand '@...' form in inputs.
@@ -213,15 +283,27 @@ def find_tests_for_inputs(lit_config, inputs):
                 f.close()
                     
     # Load the tests from the inputs.
+    pool = None
+    if jobs > 1 and ThreadPool is not None:
+        pool = ThreadPool(jobs)
     tests = []
     test_suite_cache = {}
     local_config_cache = {}
-    for input in actual_inputs:
-        prev = len(tests)
-        tests.extend(getTests(input, lit_config,
-                              test_suite_cache, local_config_cache)[1])
-        if prev == len(tests):
-            lit_config.warning('input %r contained no tests' % input)
+    try:
+        for input in actual_inputs:
+            prev = len(tests)
+            tests.extend(getTests(input, lit_config,
+                                  test_suite_cache, local_config_cache,
+                                  pool)[1])
+            if prev == len(tests):
+                lit_config.warning('input %r contained no tests' % input)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Persist the directory listings for the next run.
+    lit_config.discoveryCache.save()
 
     # If there were any errors during test discovery, exit now.
     if lit_config.numErrors:
@@ -14,18 +14,17 @@ class FileBasedTest(TestFormat):
     def getTestsInDirectory(self, testSuite, path_in_suite,
                             litConfig, localConfig):
         source_path = testSuite.getSourcePath(path_in_suite)
-        for filename in os.listdir(source_path):
+        filenames,_ = litConfig.discoveryCache.listdir(source_path)
+        for filename in filenames:
             # Ignore dot files and excluded tests.
             if (filename.startswith('.') or
                 filename in localConfig.excludes):
                 continue
 
-            filepath = os.path.join(source_path, filename)
-            if not os.path.isdir(filepath):
-                base,ext = os.path.splitext(filename)
-                if ext in localConfig.suffixes:
-                    yield lit.Test.Test(testSuite, path_in_suite + (filename,),
-                                        localConfig)
+            base,ext = os.path.splitext(filename)
+            if ext in localConfig.suffixes:
+                yield lit.Test.Test(testSuite, path_in_suite + (filename,),
+                                    localConfig)
 
 ###
 
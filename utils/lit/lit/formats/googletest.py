@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 import os
 import sys
+import tempfile
+import time
+import xml.etree.ElementTree
 
 import lit.Test
 import lit.TestRunner
@@ -10,9 +13,19 @@ from .base import TestFormat
 kIsWindows = sys.platform in ['win32', 'cygwin']
 
 class GoogleTest(TestFormat):
-    def __init__(self, test_sub_dir, test_suffix):
+    """
+    GoogleTest - Test format for GoogleTest executables, where each test case
+    in an executable is a test.
+
+    If batch_size is given, the selected tests of each executable are executed
+    in batches of up to that many tests per process (see batchTests()), rather
+    than in a process each.
+    """
+
+    def __init__(self, test_sub_dir, test_suffix, batch_size=None):
         self.test_sub_dir = os.path.normcase(str(test_sub_dir)).split(';')
         self.test_suffix = str(test_suffix)
+        self.batch_size = batch_size
 
         # On Windows, assume tests will also end in '.exe'.
         if kIsWindows:
@@ -90,7 +103,232 @@ class GoogleTest(TestFormat):
                         litConfig, localConfig):
                     yield test
 
+    def batchTests(self, tests, litConfig):
+        """
+        batchTests(tests, litConfig) -> tests
+
+        Replace the tests of each executable among the given (selected) tests
+        with batches of tests, each executed by a single process. A batch is
+        itself a test, named after the executable and its position among the
+        batches of the executable. unbatchTests() replaces the batches with
+        the tests they contain again, once they have been executed.
+        """
+        if not self.batch_size or self.batch_size < 2:
+            return tests
+
+        # Group the tests by executable, placing each group where the first of
+        # its tests was.
+        res = []
+        groups = {}
+        for test in tests:
+            split = None
+            if test.config.test_format is self:
+                split = self._splitTestPath(test)
+            if split is None:
+                res.append(test)
+                continue
+            exe_path_in_suite,testName = split
+            key = (test.suite, exe_path_in_suite)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = group = []
+                res.append(group)
+            group.append((test, testName))
+
+        tests = []
+        for item in res:
+            if not isinstance(item, list):
+                tests.append(item)
+                continue
+            if len(item) == 1:
+                tests.append(item[0][0])
+                continue
+            first = item[0][0]
+            exe_path_in_suite,_ = self._splitTestPath(first)
+            num_batches = (len(item) + self.batch_size - 1) // self.batch_size
+            for i in range(num_batches):
+                batch = lit.Test.Test(
+                    first.suite, exe_path_in_suite + (
+                        'batch-%d-of-%d' % (i + 1, num_batches),),
+                    first.config)
+                batch.gtest_tests = item[i*self.batch_size:
+                                         (i+1)*self.batch_size]
+                tests.append(batch)
+        return tests
+
+    def unbatchTests(self, tests):
+        """
+        unbatchTests(tests) -> tests
+
+        Replace the (executed) batches created by batchTests() with the tests
+        they contain, along with their individual results. A test which was
+        already given its result (by an earlier call) keeps it.
+        """
+        res = []
+        for test in tests:
+            batch = None
+            if test.config.test_format is self:
+                batch = getattr(test, 'gtest_tests', None)
+            if batch is None:
+                res.append(test)
+                continue
+
+            results = getattr(test.result, 'gtest_results', None)
+            for i,(t,testName) in enumerate(batch):
+                if results is not None:
+                    result = results[i]
+                else:
+                    # The batch was never executed (or failed to execute).
+                    result = lit.Test.Result(test.result.code,
+                                             test.result.output, 0.0)
+                if t.result is None:
+                    t.setResult(result)
+                res.append(t)
+        return res
+
+    def _splitTestPath(self, test):
+        """_splitTestPath(test) -> (executable path_in_suite, test name)
+
+        Split the path of a test into the executable and the name of the test
+        case within it, or return None if the executable can't be found."""
+        path_in_suite = test.path_in_suite
+        # GTest parametrized and typed tests have some '/'s in their name.
+        for i in range(len(path_in_suite) - 1, 0, -1):
+            if os.path.isfile(test.suite.getSourcePath(path_in_suite[:i])):
+                return path_in_suite[:i], '/'.join(path_in_suite[i:])
+        return None
+
+    def executeBatch(self, test, litConfig):
+        testNames = [testName for t,testName in test.gtest_tests]
+        if litConfig.noExecute:
+            result = lit.Test.Result(lit.Test.PASS)
+            result.gtest_results = [lit.Test.Result(lit.Test.PASS, '', 0.0)
+                                    for testName in testNames]
+            return result
+
+        # Run all the tests at once, collecting their results from the XML
+        # report.
+        testPath = test.suite.getSourcePath(test.path_in_suite[:-1])
+        fd,xml_path = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        try:
+            cmd = [testPath, '--gtest_filter=' + ':'.join(testNames),
+                   '--gtest_output=xml:' + xml_path]
+            if litConfig.useValgrind:
+                cmd = litConfig.valgrindArgs + cmd
+            # Each test gets the time limit of a test, but if the batch runs
+            # out of time, its tests are run again one by one to find the
+            # ones which hang.
+            timeout = litConfig.getTestTimeout(test.config) * len(testNames)
+            try:
+                out, err, exitCode = lit.util.executeCommand(
+                    cmd, env=test.config.environment, timeout=timeout)
+                testcases = self._readXMLReport(xml_path)
+            except lit.util.ExecuteCommandTimeoutException:
+                out, err, exitCode = '', '', None
+                testcases = None
+        finally:
+            os.remove(xml_path)
+
+        # If the process failed without any test failing (it crashed, or
+        # failed some check of its own), the report can't be trusted.
+        if exitCode and testcases is not None:
+            if not [t for t in testcases.values() if t[0]]:
+                testcases = None
+
+        results = []
+        for testName in testNames:
+            testcase = None
+            if testcases is not None:
+                testcase = testcases.get(testName)
+            if testcase is None:
+                # The test didn't get to report its result, run it on its own.
+                start_time = time.time()
+                code, output = self.executeOne(testPath, testName, test.config,
+                                               litConfig)
+                result = lit.Test.Result(code, output,
+                                         time.time() - start_time)
+            else:
+                failures,elapsed = testcase
+                if failures:
+                    output = self._getTestOutput(out, testName)
+                    if output is None:
+                        output = '\n'.join(failures)
+                    result = lit.Test.Result(lit.Test.FAIL, output, elapsed)
+                else:
+                    result = lit.Test.Result(lit.Test.PASS, '', elapsed)
+            results.append(result)
+
+        code = lit.Test.PASS
+        output = ''
+        for testName,result in zip(testNames, results):
+            if result.code.isFailure:
+                code = lit.Test.FAIL
+                output += '%s %s:\n%s\n' % (result.code.name, testName,
+                                            result.output)
+        result = lit.Test.Result(code, output)
+        result.gtest_results = results
+        return result
+
+    def _readXMLReport(self, path):
+        """_readXMLReport(path) -> {test name : ([failure], elapsed)} or None
+
+        Read the test results from a GoogleTest XML report, if there is one."""
+        try:
+            root = xml.etree.ElementTree.parse(path).getroot()
+        except Exception:
+            return None
+
+        testcases = {}
+        for testcase in root.findall('.//testcase'):
+            name = '%s.%s' % (testcase.get('classname'), testcase.get('name'))
+            failures = [f.get('message') or f.text or ''
+                        for f in testcase.findall('failure')]
+            try:
+                elapsed = float(testcase.get('time'))
+            except (TypeError, ValueError):
+                elapsed = None
+            testcases[name] = (failures, elapsed)
+        return testcases
+
+    def _getTestOutput(self, out, testName):
+        # Extract the output of a single test from the output of the batch,
+        # which brackets it with '[ RUN      ]' and '[  FAILED  ]' lines.
+        start = out.find('[ RUN      ] %s\n' % (testName,))
+        if start == -1:
+            return None
+        end = out.find('[  FAILED  ] %s' % (testName,), start)
+        if end == -1:
+            return None
+        end = out.find('\n', end)
+        if end == -1:
+            end = len(out)
+        return out[start:end + 1]
+
+    def executeOne(self, testPath, testName, config, litConfig):
+        cmd = [testPath, '--gtest_filter=' + testName]
+        if litConfig.useValgrind:
+            cmd = litConfig.valgrindArgs + cmd
+
+        timeout = litConfig.getTestTimeout(config)
+        try:
+            out, err, exitCode = lit.util.executeCommand(
+                cmd, env=config.environment, timeout=timeout)
+        except lit.util.ExecuteCommandTimeoutException:
+            e = sys.exc_info()[1]
+            return (lit.Test.TIMEOUT,
+                    '%s\n\nReached timeout of %s seconds' % (e.out + e.err,
+                                                            timeout))
+
+        if not exitCode:
+            return lit.Test.PASS,''
+
+        return lit.Test.FAIL, out + err
+
     def execute(self, test, litConfig):
+        if getattr(test, 'gtest_tests', None) is not None:
+            return self.executeBatch(test, litConfig)
+
         testPath,testName = os.path.split(test.getSourcePath())
         while not os.path.exists(testPath):
             # Handle GTest parametrized and typed tests, whose name includes
@@ -98,17 +336,7 @@ class GoogleTest(TestFormat):
             testPath, namePrefix = os.path.split(testPath)
             testName = os.path.join(namePrefix, testName)
 
-        cmd = [testPath, '--gtest_filter=' + testName]
-        if litConfig.useValgrind:
-            cmd = litConfig.valgrindArgs + cmd
-
         if litConfig.noExecute:
             return lit.Test.PASS, ''
 
-        out, err, exitCode = lit.util.executeCommand(
-            cmd, env=test.config.environment)
-
-        if not exitCode:
-            return lit.Test.PASS,''
-
-        return lit.Test.FAIL, out + err
+        return self.executeOne(testPath, testName, test.config, litConfig)
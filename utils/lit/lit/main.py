@@ -9,20 +9,51 @@ See lit.pod for more information.
 from __future__ import absolute_import
 import math, os, platform, random, re, sys, time
 
+import lit.DiscoveryCache
 import lit.ProgressBar
 import lit.LitConfig
+import lit.ResultCache
+import lit.ResultWriters
+import lit.ScriptCache
+import lit.ConfigCache
+import lit.DependencyIndex
+import lit.Sharding
 import lit.Test
 import lit.run
+import lit.TestTimes
 import lit.util
 import lit.discovery
 
 class TestingProgressDisplay(object):
-    def __init__(self, opts, numTests, progressBar=None):
+    """
+    Reports the result of each test as it completes.
+
+    Redrawing the progress bar and flushing stdout are limited to once every
+    kRefreshInterval seconds, so that the cost of the display (which is updated
+    under the lock of the results consumer) doesn't grow with the rate at which
+    tests complete. The lines reporting failures are always shown right away.
+
+    Once reported, the output of the tests which didn't fail is dropped, or
+    spilled to a temporary file, unless all the output is to be kept in memory
+    (see --output-retention).
+    """
+
+    kRefreshInterval = 0.1
+
+    def __init__(self, opts, numTests, progressBar=None, run=None,
+                 resultWriters=[]):
         self.opts = opts
         self.numTests = numTests
         self.current = None
         self.progressBar = progressBar
         self.completed = 0
+        self.run = run
+        self.resultWriters = resultWriters
+        self.nextRefresh = 0.0
+        self.unflushed = False
+        self.outputSpool = None
+        if opts.outputRetention == 'spill':
+            self.outputSpool = lit.Test.OutputSpool()
 
     def finish(self):
         if self.progressBar:
@@ -31,15 +62,57 @@ class TestingProgressDisplay(object):
             pass
         elif self.opts.succinct:
             sys.stdout.write('\n')
+        if self.unflushed:
+            sys.stdout.flush()
+            self.unflushed = False
+        for writer in self.resultWriters:
+            writer.finish()
+
+    def _shouldRefresh(self):
+        # The final update is always shown, so the bar ends at 100%.
+        now = time.time()
+        if now < self.nextRefresh and self.completed != self.numTests:
+            return False
+        self.nextRefresh = now + self.kRefreshInterval
+        return True
+
+    def _retainOutput(self, tests):
+        if self.opts.outputRetention == 'all':
+            return
+        for t in tests:
+            if t.result.code.isFailure:
+                continue
+            if self.outputSpool is not None:
+                t.result.spillOutput(self.outputSpool)
+            else:
+                t.result.dropOutput()
 
     def update(self, test):
         self.completed += 1
-        if self.progressBar:
+        # The tests of a batch are only needed to write their results, and to
+        # drop their output.
+        tests = [test]
+        if self.run is not None and (self.resultWriters or
+                                     self.opts.outputRetention != 'all'):
+            tests = self.run.get_unbatched_tests(test)
+        for t in tests:
+            for writer in self.resultWriters:
+                writer.write(t)
+        self._report(test)
+
+        # A batch keeps the results of its tests, and its own output.
+        if test not in tests:
+            tests.append(test)
+        self._retainOutput(tests)
+
+    def _report(self, test):
+
+        isFailure = test.result.code.isFailure
+        if self.progressBar and (isFailure or self._shouldRefresh()):
             self.progressBar.update(float(self.completed)/self.numTests,
                                     test.getFullName())
 
-        if not test.result.code.isFailure and \
-                (self.opts.quiet or self.opts.succinct):
+        if not isFailure and (self.opts.quiet or self.opts.succinct):
             return
 
         if self.progressBar:
@@ -51,7 +124,7 @@ class TestingProgressDisplay(object):
                                      self.completed, self.numTests))
 
         # Show the test failure output, if requested.
-        if test.result.code.isFailure and self.opts.showOutput:
+        if isFailure and self.opts.showOutput:
             print("%s TEST '%s' FAILED %s" % ('*'*20, test.getFullName(),
                                               '*'*20))
             print(test.result.output)
@@ -66,16 +139,164 @@ class TestingProgressDisplay(object):
                 print('%s: %s ' % (metric_name, value.format()))
             print("*" * 10)
 
-        # Ensure the output is flushed.
-        sys.stdout.flush()
+        # Ensure the output is flushed, right away for failures and otherwise
+        # once per refresh interval.
+        if isFailure or self._shouldRefresh():
+            sys.stdout.flush()
+            self.unflushed = False
+        else:
+            self.unflushed = True
+
+def print_summary(results, opts):
+    """
+    print_summary(results, opts) -> hasFailures
 
-def main(builtinParameters = {}):
-    # Bump the GIL check interval, its more important to get any one thread to a
-    # blocking operation (hopefully exec) than to try and unblock other threads.
-    #
-    # FIXME: This is a hack.
-    sys.setcheckinterval(1000)
+    Print the summary of the given [(full test name, result)], and return
+    whether any of the tests failed.
+    """
+    # List test results organized by kind.
+    hasFailures = False
+    byCode = {}
+    for name,result in results:
+        if result.code not in byCode:
+            byCode[result.code] = []
+        byCode[result.code].append(name)
+        if result.code.isFailure:
+            hasFailures = True
+
+    # Print each test in any of the failing groups.
+    for title,code in (('Unexpected Passing Tests', lit.Test.XPASS),
+                       ('Failing Tests', lit.Test.FAIL),
+                       ('Unresolved Tests', lit.Test.UNRESOLVED),
+                       ('Timed Out Tests', lit.Test.TIMEOUT)):
+        elts = byCode.get(code)
+        if not elts:
+            continue
+        print('*'*20)
+        print('%s (%d):' % (title, len(elts)))
+        for name in elts:
+            print('    %s' % name)
+        sys.stdout.write('\n')
+
+    if opts.timeTests and results:
+        # Order by time.
+        test_times = [(name, result.elapsed) for name,result in results
+                      if result.elapsed is not None]
+        lit.util.printHistogram(test_times, title='Tests')
+
+    if opts.resourceUsage:
+        print_resource_usage(results)
+
+    for name,code in (('Expected Passes    ', lit.Test.PASS),
+                      ('Expected Failures  ', lit.Test.XFAIL),
+                      ('Unsupported Tests  ', lit.Test.UNSUPPORTED),
+                      ('Skipped Tests      ', lit.Test.SKIPPED),
+                      ('Unresolved Tests   ', lit.Test.UNRESOLVED),
+                      ('Unexpected Passes  ', lit.Test.XPASS),
+                      ('Unexpected Failures', lit.Test.FAIL),
+                      ('Individual Timeouts', lit.Test.TIMEOUT),):
+        if opts.quiet and not code.isFailure:
+            continue
+        N = len(byCode.get(code,[]))
+        if N:
+            print('  %s: %d' % (name,N))
+
+    return hasFailures
+
+def print_resource_usage(results):
+    """
+    print_resource_usage(results)
+
+    Print the tests among the given [(full test name, result)] which used the
+    most CPU time and memory, according to their resource usage metrics.
+    """
+    cpu_times = []
+    max_rss = []
+    for name,result in results:
+        metrics = result.metrics
+        # Only rank the tests which spawned processes.
+        processes = metrics.get('num_processes')
+        if processes is None or not processes.value:
+            continue
+        if 'cpu_user_time' in metrics and 'cpu_system_time' in metrics:
+            cpu_times.append((metrics['cpu_user_time'].value +
+                              metrics['cpu_system_time'].value, name))
+        if 'max_rss_kb' in metrics:
+            max_rss.append((metrics['max_rss_kb'].value, name))
+    cpu_times.sort()
+    max_rss.sort()
+
+    hr = '-' * 74
+    if cpu_times:
+        print('\nMost CPU Intensive Tests:')
+        print(hr)
+        for value,name in cpu_times[-20:]:
+            print('%.2fs: %s' % (value, name))
+    if max_rss:
+        print('\nLargest Memory Users (Maximum Resident Set Size):')
+        print(hr)
+        for value,name in max_rss[-20:]:
+            print('%dK: %s' % (value, name))
+    if cpu_times or max_rss:
+        sys.stdout.write('\n')
+
+def parse_env_int(parser, name):
+    try:
+        return int(os.environ[name])
+    except ValueError:
+        parser.error('invalid value for $%s: %r' % (name, os.environ[name]))
+
+def read_results_file(parser, path, read):
+    try:
+        return read(path)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        e = sys.exc_info()[1]
+        parser.error('unable to read results file %r: %s' % (path, e))
+
+def write_results_file(parser, path, results, elapsed):
+    try:
+        lit.Sharding.write_results(path, results, elapsed)
+    except (IOError, OSError):
+        e = sys.exc_info()[1]
+        parser.error('unable to write results file %r: %s' % (path, e))
+
+def merge_results(paths, opts, parser):
+    """
+    merge_results(paths, opts, parser)
+
+    Print the combined summary of the given result files (as written by the
+    shards of a run), and exit.
+    """
+    resultsByName = {}
+    elapsed = 0.0
+    for path in paths:
+        results,fileElapsed = read_results_file(parser, path,
+                                                lit.Sharding.read_results)
+        resultsByName.update(results)
+        elapsed = max(elapsed, fileElapsed)
+    results = sorted(resultsByName.items())
+
+    if not opts.quiet:
+        print('-- Merged: %d tests from %d results files --' % (len(results),
+                                                                len(paths)))
+    if opts.showOutput:
+        for name,result in results:
+            if not result.code.isFailure:
+                continue
+            print("%s TEST '%s' FAILED %s" % ('*'*20, name, '*'*20))
+            print(result.output)
+            print("*" * 20)
+    if not opts.quiet:
+        # The shards run concurrently, so the slowest one determines the time.
+        print('Testing Time: %.2fs' % (elapsed,))
 
+    if opts.resultsFile:
+        write_results_file(parser, opts.resultsFile, results, elapsed)
+    if print_summary(results, opts):
+        sys.exit(1)
+    sys.exit(0)
+
+def main(builtinParameters = {}):
     global options
     from optparse import OptionParser, OptionGroup
     parser = OptionParser("usage: %prog [options] {file-or-path}")
@@ -106,6 +327,25 @@ def main(builtinParameters = {}):
     group.add_option("", "--no-progress-bar", dest="useProgressBar",
                      help="Do not use curses based progress bar",
                      action="store_false", default=True)
+    group.add_option("", "--results-file", dest="resultsFile", metavar="PATH",
+                     help="Write the test results to PATH",
+                     action="store", default=None)
+    group.add_option("", "--jsonl-output", dest="jsonlOutput", metavar="PATH",
+                     help=("Write a JSON record of each test result to PATH "
+                           "as soon as the test completes"),
+                     action="store", default=None)
+    group.add_option("", "--xunit-xml-output", dest="xunitOutput",
+                     metavar="PATH",
+                     help="Write the test results to PATH in xUnit XML format",
+                     action="store", default=None)
+    group.add_option("", "--output-retention", dest="outputRetention",
+                     metavar="MODE",
+                     help=("What to do with the output of tests which don't "
+                           "fail once they are reported: 'drop' it, 'spill' it "
+                           "to a compressed temporary file, or keep 'all' of "
+                           "it in memory [default: drop]"),
+                     type="choice", choices=['drop', 'spill', 'all'],
+                     action="store", default='drop')
     parser.add_option_group(group)
 
     group = OptionGroup(parser, "Test Execution")
@@ -124,25 +364,98 @@ def main(builtinParameters = {}):
     group.add_option("", "--time-tests", dest="timeTests",
                      help="Track elapsed wall time for each test",
                      action="store_true", default=False)
+    group.add_option("", "--resource-usage", dest="resourceUsage",
+                     help=("Track the CPU time, memory and processes used by "
+                           "each test"),
+                     action="store_true", default=False)
+    group.add_option("", "--timeout", dest="maxIndividualTestTime",
+                     metavar="N", type=int, action="store", default=0,
+                     help=("Maximum time to spend running a single test (in "
+                           "seconds), overriding the limit of the test "
+                           "suites. 0 means no limit"))
+    group.add_option("", "--max-memory", dest="maxMemory", metavar="MB",
+                     help=("Memory budget for tests declaring their memory "
+                           "use (default: physical memory)"),
+                     action="store", type=int, default=None)
+    group.add_option("", "--filecheck", dest="fileCheckMode", metavar="MODE",
+                     help=("How the internal shell executes FileCheck: "
+                           "'builtin' (in-process, when it can), 'tool', or "
+                           "'conformance' (both, failing the commands whose "
+                           "results differ) [default: builtin]"),
+                     type="choice", choices=['builtin', 'tool', 'conformance'],
+                     action="store", default='builtin')
+    group.add_option("", "--no-shell-server", dest="useShellServer",
+                     help=("Start a new shell for each test using the "
+                           "external shell, rather than reusing persistent "
+                           "shells"),
+                     action="store_false", default=True)
     group.add_option("", "--no-execute", dest="noExecute",
                      help="Don't execute any tests (assume PASS)",
                      action="store_true", default=False)
+    group.add_option("", "--incremental", dest="incremental",
+                     help=("Reuse the cached results of tests which passed "
+                           "(or failed as expected) if their inputs have not "
+                           "changed"),
+                     action="store_true", default=False)
+    group.add_option("", "--cache-dir", dest="cacheDir", metavar="PATH",
+                     help="Directory to store persistent caches in",
+                     action="store", default=None)
+    group.add_option("", "--max-result-cache-size", dest="maxResultCacheSize",
+                     metavar="MB", help="Maximum size of the result cache",
+                     action="store", type=int, default=256)
     parser.add_option_group(group)
 
     group = OptionGroup(parser, "Test Selection")
     group.add_option("", "--max-tests", dest="maxTests", metavar="N",
                      help="Maximum number of tests to run",
                      action="store", type=int, default=None)
+    group.add_option("", "--max-failures", dest="maxFailures", metavar="N",
+                     help="Stop starting tests once N tests have failed",
+                     action="store", type=int, default=None)
+    group.add_option("", "--failed-first", dest="failedFirst",
+                     help=("Run the tests which failed in the previous run "
+                           "first, according to --results-file"),
+                     action="store_true", default=False)
     group.add_option("", "--max-time", dest="maxTime", metavar="N",
                      help="Maximum time to spend testing (in seconds)",
                      action="store", type=float, default=None)
     group.add_option("", "--shuffle", dest="shuffle",
                      help="Run tests in random order",
                      action="store_true", default=False)
+    group.add_option("", "--ignore-test-times", dest="useTestTimes",
+                     help=("Don't record test times, or use previously "
+                           "recorded times to schedule slow tests first"),
+                     action="store_false", default=True)
     group.add_option("", "--filter", dest="filter", metavar="REGEX",
                      help=("Only run tests with paths matching the given "
                            "regular expression"),
                      action="store", default=None)
+    group.add_option("", "--changed", dest="changed", metavar="PATH",
+                     help=("Only run the tests affected by a change to PATH "
+                           "(a file, or a directory), according to the "
+                           "dependency index. '@FILE' reads the paths from "
+                           "FILE, one per line"),
+                     action="append", type=str, default=[])
+    group.add_option("", "--record-dependencies", dest="recordDependencies",
+                     help=("Record the files the tests executed depend on in "
+                           "the dependency index (implied by --changed)"),
+                     action="store_true", default=False)
+    group.add_option("", "--num-shards", dest="numShards", metavar="N",
+                     help=("Split the selected tests into N shards "
+                           "(default: $LIT_NUM_SHARDS)"),
+                     action="store", type=int, default=None)
+    group.add_option("", "--run-shard", dest="runShard", metavar="M",
+                     help=("Run only the tests of shard M, counting from 1 "
+                           "(default: $LIT_RUN_SHARD)"),
+                     action="store", type=int, default=None)
+    group.add_option("", "--shard-times", dest="shardTimes", metavar="PATH",
+                     help=("Balance the shards using the test times in the "
+                           "results file PATH of a previous run"),
+                     action="store", default=None)
+    group.add_option("", "--merge-results", dest="mergeResults",
+                     help=("Don't run any tests, instead summarize the "
+                           "results files given as inputs"),
+                     action="store_true", default=False)
     parser.add_option_group(group)
 
     group = OptionGroup(parser, "Debug and Experimental Options")
@@ -155,12 +468,32 @@ def main(builtinParameters = {}):
     group.add_option("", "--show-tests", dest="showTests",
                       help="Show all discovered tests",
                       action="store_true", default=False)
-    group.add_option("", "--use-processes", dest="useProcesses",
+    group.add_option("", "--no-discovery-cache", dest="useDiscoveryCache",
+                      help=("Don't use or update the persistent cache of "
+                            "directory listings for test discovery"),
+                      action="store_false", default=True)
+    group.add_option("", "--no-script-cache", dest="useScriptCache",
+                      help=("Don't use or update the persistent cache of the "
+                            "RUN lines of large test files, and of the parsed "
+                            "RUN lines of tests"),
+                      action="store_false", default=True)
+    group.add_option("", "--no-config-cache", dest="useConfigCache",
+                      help=("Don't use or update the persistent cache of "
+                            "compiled configuration files"),
+                      action="store_false", default=True)
+    group.add_option("", "--executor", dest="executor", metavar="NAME",
+                      help=("How to run tests in parallel: 'threads', "
+                            "'processes' or 'asyncio' (a single thread running "
+                            "an event loop, Python 3.5+) [default: threads]"),
+                      type="choice", choices=['threads', 'processes',
+                                              'asyncio'],
+                      action="store", default='threads')
+    group.add_option("", "--use-processes", dest="executor",
                       help="Run tests in parallel with processes (not threads)",
-                      action="store_true", default=False)
-    group.add_option("", "--use-threads", dest="useProcesses",
+                      action="store_const", const='processes')
+    group.add_option("", "--use-threads", dest="executor",
                       help="Run tests in parallel with threads (not processes)",
-                      action="store_false", default=False)
+                      action="store_const", const='threads')
     parser.add_option_group(group)
 
     (opts, args) = parser.parse_args()
@@ -168,6 +501,26 @@ def main(builtinParameters = {}):
     if not args:
         parser.error('No inputs specified')
 
+    if opts.mergeResults:
+        merge_results(args, opts, parser)
+
+    if opts.numShards is None and 'LIT_NUM_SHARDS' in os.environ:
+        opts.numShards = parse_env_int(parser, 'LIT_NUM_SHARDS')
+    if opts.runShard is None and 'LIT_RUN_SHARD' in os.environ:
+        opts.runShard = parse_env_int(parser, 'LIT_RUN_SHARD')
+    if (opts.numShards is None) != (opts.runShard is None):
+        parser.error('--num-shards and --run-shard must be used together')
+    if opts.numShards is not None:
+        if opts.numShards < 1:
+            parser.error('--num-shards must be positive')
+        if not 1 <= opts.runShard <= opts.numShards:
+            parser.error('--run-shard must be between 1 and %d' % (
+                    opts.numShards,))
+    shardTimes = None
+    if opts.shardTimes:
+        shardTimes = read_results_file(parser, opts.shardTimes,
+                                       lit.Sharding.read_test_times)
+
     if opts.numThreads is None:
 # Python <2.5 has a race condition causing lit to always fail with numThreads>1
 # http://bugs.python.org/issue1731717
@@ -178,6 +531,25 @@ def main(builtinParameters = {}):
        else:
                opts.numThreads = 1
 
+    if opts.executor == 'asyncio' and sys.version_info < (3, 5):
+        parser.error('--executor=asyncio requires Python 3.5 or later')
+    if opts.executor == 'threads' and hasattr(sys, 'setcheckinterval'):
+        # Bump the GIL check interval, its more important to get any one thread
+        # to a blocking operation (hopefully exec) than to try and unblock other
+        # threads.
+        #
+        # FIXME: This is a hack.
+        sys.setcheckinterval(1000)
+
+    if opts.maxFailures is not None and opts.maxFailures < 1:
+        parser.error('--max-failures must be positive')
+    if opts.failedFirst and not opts.resultsFile:
+        parser.error('--failed-first requires --results-file')
+    if opts.maxIndividualTestTime < 0:
+        parser.error('--timeout must be non-negative')
+    if opts.maxMemory is None:
+        opts.maxMemory = lit.util.detectPhysicalMemory()
+
     inputs = args
 
     # Create the user defined parameters.
@@ -189,6 +561,39 @@ def main(builtinParameters = {}):
             name,val = entry.split('=', 1)
         userParams[name] = val
 
+    # Set up the persistent caches.
+    if opts.cacheDir is None:
+        opts.cacheDir = os.environ.get('LIT_CACHE_DIR')
+    if opts.cacheDir is None:
+        opts.cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'lit')
+    resultCache = None
+    if opts.incremental:
+        resultCache = lit.ResultCache.ResultCache(
+            os.path.join(opts.cacheDir, 'results'),
+            opts.maxResultCacheSize * 1024 * 1024)
+    discoveryCache = None
+    if opts.useDiscoveryCache:
+        # Strings pickled by Python 2 and 3 aren't interchangeable, so keep a
+        # separate index for each.
+        discoveryCache = lit.DiscoveryCache.DiscoveryCache(
+            os.path.join(opts.cacheDir,
+                         'discovery-index-py%d' % sys.version_info[0]))
+    scriptCache = None
+    if opts.useScriptCache:
+        scriptCache = lit.ScriptCache.ScriptCache(
+            os.path.join(opts.cacheDir, 'scripts-py%d' % sys.version_info[0]))
+    dependencyIndex = None
+    if opts.changed or opts.recordDependencies:
+        # Strings pickled by Python 2 and 3 aren't interchangeable, so keep a
+        # separate index for each.
+        dependencyIndex = lit.DependencyIndex.DependencyIndex(
+            os.path.join(opts.cacheDir,
+                         'dependency-index-py%d' % sys.version_info[0]))
+    configCache = None
+    if opts.useConfigCache:
+        configCache = lit.ConfigCache.ConfigCache(
+            os.path.join(opts.cacheDir, 'configs'))
+
     # Create the global config object.
     litConfig = lit.LitConfig.LitConfig(
         progname = os.path.basename(sys.argv[0]),
@@ -201,11 +606,21 @@ def main(builtinParameters = {}):
         debug = opts.debug,
         isWindows = (platform.system()=='Windows'),
         params = userParams,
-        config_prefix = opts.configPrefix)
+        config_prefix = opts.configPrefix,
+        resultCache = resultCache,
+        discoveryCache = discoveryCache,
+        scriptCache = scriptCache,
+        configCache = configCache,
+        trackResourceUsage = opts.resourceUsage,
+        maxIndividualTestTime = opts.maxIndividualTestTime,
+        fileCheckMode = opts.fileCheckMode,
+        useShellServer = opts.useShellServer,
+        recordDependencies = dependencyIndex is not None)
 
     # Perform test discovery.
     run = lit.run.Run(litConfig,
-                      lit.discovery.find_tests_for_inputs(litConfig, inputs))
+                      lit.discovery.find_tests_for_inputs(litConfig, inputs,
+                                                          opts.numThreads))
 
     if opts.showSuites or opts.showTests:
         # Aggregate the tests by suite.
@@ -249,24 +664,64 @@ def main(builtinParameters = {}):
         run.tests = [t for t in run.tests
                      if rex.search(t.getFullName())]
 
-    # Then select the order.
+    # Then select the tests affected by the changed paths, if given.
+    if opts.changed:
+        changed = []
+        for path in opts.changed:
+            if not path.startswith('@') or os.path.exists(path):
+                changed.append(path)
+                continue
+            try:
+                f = open(path[1:])
+            except IOError:
+                e = sys.exc_info()[1]
+                parser.error('unable to read changed paths: %s' % (e,))
+            try:
+                changed.extend(ln.strip() for ln in f if ln.strip())
+            finally:
+                f.close()
+        run.tests = dependencyIndex.selectAffectedTests(run.tests, changed,
+                                                        litConfig)
+
+    # Then select the order. Sharding relies on every invocation starting from
+    # the same order, so shuffle the tests of the shard afterwards.
+    run.tests.sort(key = lambda t: t.getFullName())
+    if opts.numShards is not None:
+        run.tests = lit.Sharding.get_shard(run.tests, opts.numShards,
+                                           opts.runShard, shardTimes)
     if opts.shuffle:
         random.shuffle(run.tests)
-    else:
-        run.tests.sort(key = lambda t: t.getFullName())
+
+    # Run the tests which failed last time first, if requested. Note that the
+    # sort is stable.
+    previousFailures = set()
+    if opts.failedFirst and os.path.exists(opts.resultsFile):
+        previousResults,_ = read_results_file(parser, opts.resultsFile,
+                                              lit.Sharding.read_results)
+        previousFailures = set(name for name,result in previousResults
+                               if result.code.isFailure)
+        run.tests.sort(key = lambda t: t.getFullName() not in previousFailures)
 
     # Finally limit the number of tests, if desired.
     if opts.maxTests is not None:
         run.tests = run.tests[:opts.maxTests]
 
+    numSelectedTests = len(run.tests)
+
+    # Let test formats group the tests which are cheaper to execute together.
+    run.batch_tests()
+
     # Don't create more threads than tests.
     opts.numThreads = min(len(run.tests), opts.numThreads)
 
     extra = ''
-    if len(run.tests) != numTotalTests:
+    if numSelectedTests != numTotalTests:
         extra = ' of %d' % numTotalTests
-    header = '-- Testing: %d%s tests, %d threads --'%(len(run.tests), extra,
-                                                      opts.numThreads)
+    shard = ''
+    if opts.numShards is not None:
+        shard = ', shard %d of %d' % (opts.runShard, opts.numShards)
+    header = '-- Testing: %d%s tests%s, %d threads --'%(
+        numSelectedTests, extra, shard, opts.numThreads)
 
     progressBar = None
     if not opts.quiet:
@@ -280,58 +735,69 @@ def main(builtinParameters = {}):
         else:
             print(header)
 
+    # When running in parallel, start the tests which historically take the
+    # longest first, so that they don't end up running alone at the tail of
+    # the run. The order makes no difference to the total time of a serial run,
+    # so keep the (predictable) sorted order there.
+    useTestTimes = opts.useTestTimes and opts.numThreads > 1
+    order = None
+    if useTestTimes and not opts.shuffle:
+        order = lit.TestTimes.get_dispatch_order(run.tests)
+        if previousFailures:
+            order.sort(key = lambda i: (run.tests[i].getFullName() not in
+                                        previousFailures))
+
+    resultWriters = []
+    try:
+        if opts.jsonlOutput:
+            resultWriters.append(
+                lit.ResultWriters.JSONLinesWriter(opts.jsonlOutput))
+        if opts.xunitOutput:
+            resultWriters.append(
+                lit.ResultWriters.XunitWriter(opts.xunitOutput))
+    except (IOError, OSError):
+        e = sys.exc_info()[1]
+        parser.error('unable to open results output: %s' % (e,))
+
     startTime = time.time()
-    display = TestingProgressDisplay(opts, len(run.tests), progressBar)
+    display = TestingProgressDisplay(opts, len(run.tests), progressBar, run,
+                                     resultWriters)
     try:
         run.execute_tests(display, opts.numThreads, opts.maxTime,
-                          opts.useProcesses)
+                          opts.executor == 'processes', order,
+                          opts.maxMemory, opts.maxFailures,
+                          opts.executor == 'asyncio')
     except KeyboardInterrupt:
         sys.exit(2)
     display.finish()
+    run.unbatch_tests()
 
-    if not opts.quiet:
-        print('Testing Time: %.2fs'%(time.time() - startTime))
+    if useTestTimes and not litConfig.noExecute:
+        lit.TestTimes.record_test_times(run.tests, litConfig)
 
-    # List test results organized by kind.
-    hasFailures = False
-    byCode = {}
-    for test in run.tests:
-        if test.result.code not in byCode:
-            byCode[test.result.code] = []
-        byCode[test.result.code].append(test)
-        if test.result.code.isFailure:
-            hasFailures = True
+    if dependencyIndex is not None:
+        dependencyIndex.update(run.tests)
+        dependencyIndex.save()
 
-    # Print each test in any of the failing groups.
-    for title,code in (('Unexpected Passing Tests', lit.Test.XPASS),
-                       ('Failing Tests', lit.Test.FAIL),
-                       ('Unresolved Tests', lit.Test.UNRESOLVED)):
-        elts = byCode.get(code)
-        if not elts:
-            continue
-        print('*'*20)
-        print('%s (%d):' % (title, len(elts)))
-        for test in elts:
-            print('    %s' % test.getFullName())
-        sys.stdout.write('\n')
+    testingTime = time.time() - startTime
+    if not opts.quiet:
+        print('Testing Time: %.2fs'%(testingTime,))
 
-    if opts.timeTests and run.tests:
-        # Order by time.
-        test_times = [(test.getFullName(), test.result.elapsed)
-                      for test in run.tests]
-        lit.util.printHistogram(test_times, title='Tests')
+    if resultCache is not None:
+        resultCache.evict()
+        if not opts.quiet:
+            numCached = len([t for t in run.tests if t.result.cached])
+            print('Cached Results: %d of %d' % (numCached, len(run.tests)))
 
-    for name,code in (('Expected Passes    ', lit.Test.PASS),
-                      ('Expected Failures  ', lit.Test.XFAIL),
-                      ('Unsupported Tests  ', lit.Test.UNSUPPORTED),
-                      ('Unresolved Tests   ', lit.Test.UNRESOLVED),
-                      ('Unexpected Passes  ', lit.Test.XPASS),
-                      ('Unexpected Failures', lit.Test.FAIL),):
-        if opts.quiet and not code.isFailure:
-            continue
-        N = len(byCode.get(code,[]))
-        if N:
-            print('  %s: %d' % (name,N))
+    if not opts.quiet:
+        spawnsAvoided = sum(t.result.spawnsAvoided for t in run.tests)
+        if spawnsAvoided:
+            print('Process Spawns Avoided: %d' % (spawnsAvoided,))
+
+    results = [(test.getFullName(), test.result) for test in run.tests]
+    if opts.resultsFile:
+        write_results_file(parser, opts.resultsFile, results, testingTime)
+    hasFailures = print_summary(results, opts)
 
     # If we encountered any additional errors, exit abnormally.
     if litConfig.numErrors:
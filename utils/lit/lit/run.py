@@ -18,6 +18,7 @@ except ImportError:
     multiprocessing = None
 
 import lit.Test
+import lit.util
 
 ###
 # Test Execution Implementation
@@ -44,12 +45,16 @@ class LockedValue(object):
     value = property(_get_value, _set_value)
 
 class TestProvider(object):
-    def __init__(self, tests, num_jobs, queue_impl, canceled_flag):
+    def __init__(self, tests, num_jobs, queue_impl, canceled_flag,
+                 order=None):
         self.canceled_flag = canceled_flag
 
-        # Create a shared queue to provide the test indices.
+        # Create a shared queue to provide the test indices, in the requested
+        # dispatch order (if any).
+        if order is None:
+            order = range(len(tests))
         self.queue = queue_impl()
-        for i in range(len(tests)):
+        for i in order:
             self.queue.put(i)
         for i in range(num_jobs):
             self.queue.put(None)
@@ -65,6 +70,146 @@ class TestProvider(object):
         # Otherwise take the next test.
         return self.queue.get()
 
+    def release(self, test_index):
+        pass
+
+class ResourceTestProvider(object):
+    """
+    Provides test indices to worker threads, admitting tests only while the
+    resources they declare fit in the budget of the run.
+
+    Each test costs a (memory, cpus) pair (see Run.get_test_cost). A test which
+    does not fit is deferred, and the next one in the dispatch order is
+    provided instead, so that cheap tests keep running while expensive ones
+    wait for resources to be released. Deferred tests go first once they fit.
+    A test which exceeds the budget by itself is run when nothing else is.
+    """
+
+    def __init__(self, tests, num_jobs, canceled_flag, costs, max_memory,
+                 order=None):
+        self.canceled_flag = canceled_flag
+        self.costs = costs
+        self.max_cpus = num_jobs
+        self.max_memory = max_memory
+        if order is None:
+            order = range(len(tests))
+        self.order = list(order)
+        self.next_index = 0
+        self.deferred = []
+        self.memory = 0
+        self.cpus = 0
+        self.num_running = 0
+        self.cond = threading.Condition()
+
+    def cancel(self):
+        self.cond.acquire()
+        try:
+            self.canceled_flag.value = 1
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def _fits(self, test_index):
+        if not self.num_running:
+            return True
+        memory,cpus = self.costs[test_index]
+        if self.cpus + cpus > self.max_cpus:
+            return False
+        if (self.max_memory is not None and
+              self.memory + memory > self.max_memory):
+            return False
+        return True
+
+    def _take(self):
+        for i,test_index in enumerate(self.deferred):
+            if self._fits(test_index):
+                del self.deferred[i]
+                return test_index
+        while self.next_index < len(self.order):
+            test_index = self.order[self.next_index]
+            self.next_index += 1
+            if self._fits(test_index):
+                return test_index
+            self.deferred.append(test_index)
+        return None
+
+    def get(self):
+        self.cond.acquire()
+        try:
+            while not self.canceled_flag.value:
+                test_index = self._take()
+                if test_index is not None:
+                    memory,cpus = self.costs[test_index]
+                    self.memory += memory
+                    self.cpus += cpus
+                    self.num_running += 1
+                    return test_index
+                if not self.deferred:
+                    return None
+                # Wait for a running test to release its resources.
+                self.cond.wait()
+            return None
+        finally:
+            self.cond.release()
+
+    def release(self, test_index):
+        self.cond.acquire()
+        try:
+            memory,cpus = self.costs[test_index]
+            self.memory -= memory
+            self.cpus -= cpus
+            self.num_running -= 1
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+class ChunkedTestProvider(object):
+    """
+    Provides chunks of test indices to long-lived worker processes.
+
+    Rather than pushing every index through a queue, the workers share a single
+    cursor into the dispatch order and claim a contiguous range of it at a
+    time. The size of each chunk is chosen by the worker, but is clamped so
+    that no worker claims more than its share of the remaining tests, which
+    keeps the tail of the run balanced.
+    """
+
+    def __init__(self, tests, num_jobs, canceled_flag, order=None):
+        self.canceled_flag = canceled_flag
+        self.num_jobs = num_jobs
+        if order is None:
+            order = range(len(tests))
+        self.order = list(order)
+        self.next_index = multiprocessing.Value('i', 0)
+
+    def cancel(self):
+        self.canceled_flag.value = 1
+
+    def is_canceled(self):
+        return bool(self.canceled_flag.value)
+
+    def get_chunk(self, size):
+        """
+        get_chunk(size) -> [test index]
+
+        Claim up to size tests to execute, returning an empty list once all
+        tests have been handed out (or the run has been canceled).
+        """
+        if self.is_canceled():
+            return []
+
+        lock = self.next_index.get_lock()
+        lock.acquire()
+        try:
+            start = self.next_index.value
+            remaining = len(self.order) - start
+            size = max(1, min(size, remaining // self.num_jobs))
+            self.next_index.value = start + min(size, remaining)
+        finally:
+            lock.release()
+
+        return self.order[start:start + size]
+
 class Tester(object):
     def __init__(self, run_instance, provider, consumer):
         self.run_instance = run_instance
@@ -77,6 +222,7 @@ class Tester(object):
             if item is None:
                 break
             self.run_test(item)
+            self.provider.release(item)
         self.consumer.task_finished()
 
     def run_test(self, test_index):
@@ -90,6 +236,47 @@ class Tester(object):
             os.kill(0,9)
         self.consumer.update(test_index, test)
 
+class ChunkedTester(Tester):
+    """
+    Tester for long-lived worker processes, which executes tests in chunks and
+    reports the results of each chunk in a single batch.
+
+    The chunk size adapts to the observed test times, so that cheap tests are
+    claimed (and their results sent back) many at a time while expensive tests
+    are still distributed individually.
+    """
+
+    # The amount of work (in seconds) to aim for in each chunk.
+    kChunkTargetTime = 0.2
+    # The maximum number of tests in a single chunk.
+    kMaxChunkSize = 64
+
+    def run(self):
+        num_run = 0
+        total_time = 0.0
+        chunk_size = 1
+        while True:
+            chunk = self.provider.get_chunk(chunk_size)
+            if not chunk:
+                break
+
+            start_time = time.time()
+            for test_index in chunk:
+                if self.provider.is_canceled():
+                    break
+                self.run_test(test_index)
+                num_run += 1
+            total_time += time.time() - start_time
+            self.consumer.flush()
+
+            # Size the next chunk from the average time of the tests so far.
+            if total_time > 0:
+                chunk_size = int(self.kChunkTargetTime * num_run / total_time)
+            else:
+                chunk_size = self.kMaxChunkSize
+            chunk_size = max(1, min(chunk_size, self.kMaxChunkSize))
+        self.consumer.task_finished()
+
 class ThreadResultsConsumer(object):
     def __init__(self, display):
         self.display = display
@@ -114,15 +301,25 @@ class MultiprocessResultsConsumer(object):
         self.display = display
         self.num_jobs = num_jobs
         self.queue = multiprocessing.Queue()
+        self.pending = []
 
     def update(self, test_index, test):
+        # This method is called in the child processes, and buffers the results
+        # until the current chunk of tests is complete.
+        self.pending.append((test_index, test.result))
+
+    def flush(self):
         # This method is called in the child processes, and communicates the
-        # results to the actual display implementation via an output queue.
-        self.queue.put((test_index, test.result))
+        # buffered results to the actual display implementation via an output
+        # queue.
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = []
 
     def task_finished(self):
         # This method is called in the child processes, and communicates that
         # individual tasks are complete.
+        self.flush()
         self.queue.put(None)
 
     def handle_results(self):
@@ -137,15 +334,59 @@ class MultiprocessResultsConsumer(object):
                 completed += 1
                 continue
 
-            # Update the test result in the parent process.
-            index,result = item
-            test = self.run.tests[index]
-            test.result = result
+            # Update the test results in the parent process.
+            for index,result in item:
+                test = self.run.tests[index]
+                test.result = result
 
-            self.display.update(test)
+                self.display.update(test)
+
+class FailureLimitDisplay(object):
+    """
+    Forwards the results of the tests to a display, canceling the test provider
+    once max_failures tests have failed. The tests of a batch are counted
+    individually.
+    """
 
-def run_one_tester(run, provider, display):
-    tester = Tester(run, provider, display)
+    def __init__(self, run, display, provider, max_failures):
+        self.run = run
+        self.display = display
+        self.provider = provider
+        self.max_failures = max_failures
+        self.num_failures = 0
+        self.reached = False
+
+    def update(self, test):
+        self.display.update(test)
+        if self.reached:
+            return
+        # Only the tests of a batch are looked at individually, see
+        # Run.get_unbatched_tests().
+        for t in self.run.get_unbatched_tests(test):
+            if t.result.code.isFailure:
+                self.num_failures += 1
+        if self.num_failures >= self.max_failures:
+            self.reached = True
+            self.provider.cancel()
+
+def add_resource_usage_metrics(result, usage):
+    """
+    add_resource_usage_metrics(result, usage)
+
+    Attach the given lit.util.ResourceUsage to the result as metrics, unless
+    the test format already reported metrics of the same names.
+    """
+    for name,value in (
+            ('cpu_user_time', lit.Test.RealMetricValue(usage.userTime)),
+            ('cpu_system_time', lit.Test.RealMetricValue(usage.systemTime)),
+            ('max_rss_kb', lit.Test.IntMetricValue(usage.maxRSS)),
+            ('num_processes', lit.Test.IntMetricValue(usage.numProcesses)),
+            ('output_bytes', lit.Test.IntMetricValue(usage.outputBytes))):
+        if name not in result.metrics:
+            result.addMetric(name, value)
+
+def run_one_tester(run, provider, display, tester_impl=Tester):
+    tester = tester_impl(run, provider, display)
     tester.run()
 
 ###
@@ -158,37 +399,135 @@ class Run(object):
     def __init__(self, lit_config, tests):
         self.lit_config = lit_config
         self.tests = tests
+        # The test formats which batch_tests() let batch the tests.
+        self.batching_formats = []
+
+    def _get_batching_formats(self):
+        formats = []
+        for test in self.tests:
+            test_format = test.config.test_format
+            if (hasattr(test_format, 'batchTests') and
+                    test_format not in formats):
+                formats.append(test_format)
+        return formats
+
+    def batch_tests(self):
+        """
+        batch_tests()
+
+        Let the test formats which can execute groups of tests together (by
+        providing batchTests() and unbatchTests() methods) replace the tests
+        of the run with batches. Once the batches have been executed,
+        unbatch_tests() must be called to restore the tests and give them
+        their results.
+        """
+        self.batching_formats = self._get_batching_formats()
+        for test_format in self.batching_formats:
+            self.tests = test_format.batchTests(self.tests, self.lit_config)
+
+    def unbatch_tests(self):
+        """
+        unbatch_tests()
+
+        Replace the batches created by batch_tests() with the tests they
+        contain.
+        """
+        for test_format in self.batching_formats:
+            self.tests = test_format.unbatchTests(self.tests)
+
+    def get_unbatched_tests(self, test):
+        """
+        get_unbatched_tests(test) -> [test]
+
+        Return the tests contained in the given (executed) test, if it is a
+        batch created by batch_tests(), giving them their results. Otherwise
+        return just the test itself.
+        """
+        # This is called for every completed test, so only look at the format
+        # of the test rather than at all the tests of the run.
+        test_format = test.config.test_format
+        if test_format not in self.batching_formats:
+            return [test]
+        return test_format.unbatchTests([test])
 
     def execute_test(self, test):
-        result = None
+        usage = None
+        if self.lit_config.trackResourceUsage:
+            usage = lit.util.ResourceUsage()
+            lit.util.setResourceUsage(usage)
         start_time = time.time()
         try:
-            result = test.config.test_format.execute(test, self.lit_config)
-
-            # Support deprecated result from execute() which returned the result
-            # code and additional output as a tuple.
-            if isinstance(result, tuple):
-                code, output = result
-                result = lit.Test.Result(code, output)
-            elif not isinstance(result, lit.Test.Result):
-                raise ValueError("unexpected result from test execution")
+            result = self.check_result(
+                test.config.test_format.execute(test, self.lit_config))
         except KeyboardInterrupt:
             raise
         except:
-            if self.lit_config.debug:
-                raise
-            output = 'Exception during script execution:\n'
-            output += traceback.format_exc()
-            output += '\n'
-            result = lit.Test.Result(lit.Test.UNRESOLVED, output)
+            result = self.get_exception_result()
+        finally:
+            if usage is not None:
+                lit.util.setResourceUsage(None)
+        self.set_test_result(test, result, start_time, usage)
+
+    def check_result(self, result):
+        """
+        check_result(result) -> result
+
+        Check the value returned by the execute() method of a test format,
+        converting the deprecated (code, output) tuple to a result.
+        """
+        if isinstance(result, tuple):
+            code, output = result
+            result = lit.Test.Result(code, output)
+        elif not isinstance(result, lit.Test.Result):
+            raise ValueError("unexpected result from test execution")
+        return result
+
+    def get_exception_result(self):
+        """
+        get_exception_result() -> result
+
+        Return the result of a test whose execution raised the exception being
+        handled, or re-raise it if debugging.
+        """
+        if self.lit_config.debug:
+            raise
+        output = 'Exception during script execution:\n'
+        output += traceback.format_exc()
+        output += '\n'
+        return lit.Test.Result(lit.Test.UNRESOLVED, output)
+
+    def set_test_result(self, test, result, start_time, usage):
+        """
+        set_test_result(test, result, start_time, usage)
+
+        Give the test its result, timed from start_time, along with the
+        resources its processes used (if usage is not None).
+        """
         result.elapsed = time.time() - start_time
+        if usage is not None and not result.cached:
+            add_resource_usage_metrics(result, usage)
 
         test.setResult(result)
 
+    def get_test_cost(self, test, jobs):
+        """
+        get_test_cost(test, jobs) -> (memory, cpus)
+
+        Return the resources the test declares it uses (through the
+        test_resources of its config): the memory in megabytes, and the number
+        of CPUs (at least one, and at most jobs).
+        """
+        resources = test.config.test_resources
+        memory = int(resources.get('memory', 0))
+        cpus = int(resources.get('cpus', 1))
+        return memory,max(1, min(cpus, jobs))
+
     def execute_tests(self, display, jobs, max_time=None,
-                      use_processes=False):
+                      use_processes=False, order=None, max_memory=None,
+                      max_failures=None, use_asyncio=False):
         """
-        execute_tests(display, jobs, [max_time])
+        execute_tests(display, jobs, [max_time], [use_processes], [order],
+                      [max_memory], [max_failures], [use_asyncio])
 
         Execute each of the tests in the run, using up to jobs number of
         parallel tasks, and inform the display of each individual result. The
@@ -198,6 +537,22 @@ class Run(object):
         If max_time is non-None, it should be a time in seconds after which to
         stop executing tests.
 
+        If use_asyncio is true, the tests are executed by a single thread
+        running an asyncio event loop (see lit.AsyncRunner), which keeps up to
+        jobs tests in flight. This requires Python 3.5 or later.
+
+        If order is non-None, it should be a permutation of the test indices
+        giving the order in which tests are dispatched to the workers (see
+        lit.TestTimes.get_dispatch_order).
+
+        If max_failures is non-None, no more tests are started once that many
+        tests have failed, and the tests which were not started are given a
+        SKIPPED result.
+
+        If any of the tests declare the resources they use, tests are only
+        started while the memory (in megabytes, if max_memory is non-None) and
+        CPUs (jobs) they declare fit in the budget.
+
         The display object will have its update method called with each test as
         it is completed. The calls are guaranteed to be locked with respect to
         one another, but are *not* guaranteed to be called on the same thread as
@@ -205,24 +560,55 @@ class Run(object):
 
         Upon completion, each test in the run will have its result
         computed. Tests which were not actually executed (for any reason) will
-        be given an UNRESOLVED result.
+        be given an UNRESOLVED result (or SKIPPED, see max_failures).
         """
 
-        # Choose the appropriate parallel execution implementation.
-        if jobs == 1 or not use_processes or multiprocessing is None:
+        # Choose the appropriate parallel execution implementation, and create
+        # the test provider. Worker processes are long-lived and claim tests in
+        # chunks, to amortize the cost of communicating with the parent.
+        costs = [self.get_test_cost(test, jobs) for test in self.tests]
+        useBudget = jobs > 1 and any(cost != (0, 1) for cost in costs)
+        useThreads = jobs == 1 or not use_processes or multiprocessing is None
+        if use_asyncio:
+            # The budget is enforced by blocking the threads which ask for a
+            # test, which the event loop can't do.
+            if useBudget:
+                self.lit_config.warning('the resources declared by tests are '
+                                        'ignored with --executor=asyncio')
+            useBudget = False
+            useThreads = True
+        elif useBudget and not useThreads:
+            self.lit_config.warning('the resources declared by tests are '
+                                    'ignored with --use-processes')
+        if useThreads:
             task_impl = threading.Thread
-            queue_impl = queue.Queue
-            canceled_flag = LockedValue(0)
-            consumer = ThreadResultsConsumer(display)
+            tester_impl = Tester
+            if useBudget:
+                provider = ResourceTestProvider(self.tests, jobs,
+                                                LockedValue(0), costs,
+                                                max_memory, order)
+            else:
+                provider = TestProvider(self.tests, jobs, queue.Queue,
+                                        LockedValue(0), order)
         else:
             task_impl = multiprocessing.Process
-            queue_impl = multiprocessing.Queue
-            canceled_flag =  multiprocessing.Value('i', 0)
+            tester_impl = ChunkedTester
+            provider = ChunkedTestProvider(self.tests, jobs,
+                                           multiprocessing.Value('i', 0),
+                                           order)
+
+        # Stop handing out tests once enough of them have failed, if requested.
+        failure_limit = None
+        if max_failures is not None:
+            display = failure_limit = FailureLimitDisplay(self, display,
+                                                          provider,
+                                                          max_failures)
+
+        if useThreads:
+            consumer = ThreadResultsConsumer(display)
+        else:
             consumer = MultiprocessResultsConsumer(self, display, jobs)
 
-        # Create the test provider.
-        provider = TestProvider(self.tests, jobs, queue_impl, canceled_flag)
-
         # Install a console-control signal handler on Windows.
         if win32api is not None:
             def console_ctrl_handler(type):
@@ -238,25 +624,36 @@ class Run(object):
             timeout_timer.start()
 
         # If not using multiple tasks, just run the tests directly.
-        if jobs == 1:
+        if use_asyncio:
+            # Only importable by Python 3.5 and later.
+            from lit import AsyncRunner
+            AsyncRunner.execute_tests(self, provider, consumer, jobs)
+        elif jobs == 1:
             run_one_tester(self, provider, consumer)
         else:
             # Otherwise, execute the tests in parallel
-            self._execute_tests_in_parallel(task_impl, provider, consumer, jobs)
+            self._execute_tests_in_parallel(task_impl, tester_impl, provider,
+                                            consumer, jobs)
 
         # Cancel the timeout handler.
         if max_time is not None:
             timeout_timer.cancel()
 
-        # Update results for any tests which weren't run.
+        # Update results for any tests which weren't run. Those skipped because
+        # of the failure limit didn't run by design, rather than for lack of
+        # time.
+        code = lit.Test.UNRESOLVED
+        if failure_limit is not None and failure_limit.reached:
+            code = lit.Test.SKIPPED
         for test in self.tests:
             if test.result is None:
-                test.setResult(lit.Test.Result(lit.Test.UNRESOLVED, '', 0.0))
+                test.setResult(lit.Test.Result(code, '', 0.0))
 
-    def _execute_tests_in_parallel(self, task_impl, provider, consumer, jobs):
+    def _execute_tests_in_parallel(self, task_impl, tester_impl, provider,
+                                   consumer, jobs):
         # Start all of the tasks.
         tasks = [task_impl(target=run_one_tester,
-                           args=(self, provider, consumer))
+                           args=(self, provider, consumer, tester_impl))
                  for i in range(jobs)]
         for t in tasks:
             t.start()
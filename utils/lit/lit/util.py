@@ -6,6 +6,7 @@ import platform
 import signal
 import subprocess
 import sys
+import threading
 
 def detectCPUs():
     """
@@ -27,6 +28,20 @@ def detectCPUs():
             return ncpus
     return 1 # Default
 
+def detectPhysicalMemory():
+    """
+    detectPhysicalMemory() - Return the amount of physical memory on the
+    system, in megabytes, or None if it can't be determined.
+    """
+    try:
+        pages = os.sysconf('SC_PHYS_PAGES')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+    if pages <= 0 or page_size <= 0:
+        return None
+    return pages * page_size // (1024 * 1024)
+
 def mkdir_p(path):
     """mkdir_p(path) - Make the "path" directory, if it does not exist; this
     will also make directories for any missing parent directories."""
@@ -45,6 +60,13 @@ def mkdir_p(path):
         if e.errno != errno.EEXIST:
             raise
 
+def to_text(s):
+    """to_text(s) - Return the given test output as text. In Python 2 output
+    is a byte string, which is decoded as UTF-8 (replacing invalid bytes)."""
+    if isinstance(s, bytes):
+        return s.decode('utf-8', 'replace')
+    return s
+
 def capture(args, env=None):
     """capture(command) - Run the given command (or argv list) in a shell and
     return the standard output."""
@@ -53,6 +75,13 @@ def capture(args, env=None):
     out,_ = p.communicate()
     return out
 
+# The results of the PATH searches done by which(), keyed by (command, paths).
+# Tests execute the same few tools over and over, so these are shared by the
+# whole run. Each process has its own cache, and the individual dictionary
+# operations are atomic, so no locking is needed. As the paths string is part
+# of the key, a configuration which changes PATH gets fresh results.
+_whichCache = {}
+
 def which(command, paths = None):
     """which(command, [paths]) - Look up the given command in the paths string
     (or the PATH environment variable, if unspecified)."""
@@ -60,6 +89,20 @@ def which(command, paths = None):
     if paths is None:
         paths = os.environ.get('PATH','')
 
+    # Commands given as a path (which may be relative to the current
+    # directory) are not cached.
+    if os.path.dirname(command):
+        return _which(command, paths)
+
+    key = (command, paths)
+    try:
+        return _whichCache[key]
+    except KeyError:
+        pass
+    _whichCache[key] = result = _which(command, paths)
+    return result
+
+def _which(command, paths):
     # Check for absolute match first.
     if os.path.isfile(command):
         return command
@@ -140,17 +183,240 @@ def printHistogram(items, title = 'Items'):
             pDigits, pfDigits, i*barH, pDigits, pfDigits, (i+1)*barH,
             '*'*w, ' '*(barW-w), cDigits, len(row), cDigits, len(items)))
 
+class ResourceUsage(object):
+    """
+    ResourceUsage - The resources used by the processes spawned to execute a
+    test.
+
+    CPU times are in seconds, and the maximum resident set size is in
+    kilobytes. Only the output lit itself captures is counted.
+    """
+
+    def __init__(self):
+        self.userTime = 0.0
+        self.systemTime = 0.0
+        self.maxRSS = 0
+        self.numProcesses = 0
+        self.outputBytes = 0
+
+    def addProcess(self, rusage):
+        self.userTime += rusage.ru_utime
+        self.systemTime += rusage.ru_stime
+        maxRSS = rusage.ru_maxrss
+        # Darwin reports the maximum resident set size in bytes.
+        if sys.platform == 'darwin':
+            maxRSS //= 1024
+        self.maxRSS = max(self.maxRSS, maxRSS)
+        self.numProcesses += 1
+
+    def addOutput(self, *outputs):
+        for output in outputs:
+            self.outputBytes += len(output)
+
+# The ResourceUsage of the test each thread is executing, if it is tracked.
+_resourceUsageState = threading.local()
+
+def getResourceUsage():
+    """getResourceUsage() - Return the ResourceUsage the processes spawned by
+    the current thread are accounted to, or None."""
+    return getattr(_resourceUsageState, 'usage', None)
+
+def setResourceUsage(usage):
+    """setResourceUsage(usage) - Account the processes spawned by the current
+    thread to the given ResourceUsage (or to nothing, if None)."""
+    _resourceUsageState.usage = usage
+
+if hasattr(os, 'wait4'):
+    class Popen(subprocess.Popen):
+        """
+        Popen - A subprocess.Popen which accounts the resources used by the
+        process (and its descendants) to the ResourceUsage of the spawning
+        thread, if any, by reaping it with os.wait4().
+
+        This overrides the (private) method subprocess uses to reap the process
+        in Python 3, and wait() in Python 2.
+        """
+
+        def __init__(self, *args, **kwargs):
+            self.resourceUsage = getResourceUsage()
+            subprocess.Popen.__init__(self, *args, **kwargs)
+
+        def _wait4(self, wait_flags):
+            while True:
+                try:
+                    pid,sts,rusage = os.wait4(self.pid, wait_flags)
+                except OSError:
+                    e = sys.exc_info()[1]
+                    if e.errno == errno.EINTR:
+                        continue
+                    if e.errno != errno.ECHILD:
+                        raise
+                    # The process was reaped elsewhere (for example, because
+                    # SIGCHLD is ignored), the exit status is lost.
+                    return self.pid,0
+                if pid == self.pid:
+                    self.resourceUsage.addProcess(rusage)
+                return pid,sts
+
+        if hasattr(subprocess.Popen, '_try_wait'):
+            def _try_wait(self, wait_flags):
+                if self.resourceUsage is None:
+                    return subprocess.Popen._try_wait(self, wait_flags)
+                return self._wait4(wait_flags)
+        else:
+            def wait(self):
+                if self.resourceUsage is None:
+                    return subprocess.Popen.wait(self)
+                while self.returncode is None:
+                    pid,sts = self._wait4(0)
+                    if pid == self.pid:
+                        self._handle_exitstatus(sts)
+                return self.returncode
+else:
+    Popen = subprocess.Popen
+
+def pollProcess(proc):
+    """pollProcess(proc) -> exit code or None
+
+    Return the exit code of the given process if it has exited, without
+    waiting for it. A process started by lit.util.Popen is reaped the way its
+    wait() method would, so that its resources are accounted."""
+    if (proc.returncode is None and
+            getattr(proc, 'resourceUsage', None) is not None):
+        pid,sts = proc._wait4(os.WNOHANG)
+        if pid == proc.pid:
+            proc._handle_exitstatus(sts)
+        return proc.returncode
+    return proc.poll()
+
+# The arguments to subprocess.Popen to start a process in a new process group,
+# so that it can be killed along with all of its descendants.
+if platform.system() == 'Windows':
+    kNewProcessGroupArgs = {
+        'creationflags' : subprocess.CREATE_NEW_PROCESS_GROUP }
+elif sys.version_info >= (3, 2):
+    kNewProcessGroupArgs = { 'start_new_session' : True }
+else:
+    kNewProcessGroupArgs = { 'preexec_fn' : os.setsid }
+
+def killProcessAndChildren(pid):
+    """killProcessAndChildren(pid) - Kill the process with the given pid, which
+    was started with kNewProcessGroupArgs, and all of its descendants."""
+    if platform.system() == 'Windows':
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)],
+                            stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+    else:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            # The processes have already exited.
+            pass
+
+class TimeoutHelper(object):
+    """
+    TimeoutHelper - Enforces a time limit (in seconds) on the processes spawned
+    for a test. Once the time limit expires, the processes (which must have
+    been started with kNewProcessGroupArgs) are killed, along with all of
+    their descendants, as is any process added afterwards.
+
+    A time limit of 0 means there is none.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._procs = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._timeoutReached = False
+
+    def active(self):
+        return self.timeout > 0
+
+    def start(self):
+        if self.active():
+            self._timer = threading.Timer(self.timeout, self.expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def timeoutReached(self):
+        return self._timeoutReached
+
+    def addProcess(self, proc):
+        if not self.active():
+            return
+        self._lock.acquire()
+        try:
+            if self._timeoutReached:
+                killProcessAndChildren(proc.pid)
+            else:
+                self._procs.append(proc)
+        finally:
+            self._lock.release()
+
+    def expire(self):
+        """expire() - Kill the processes, as when the time limit expires. This
+        is called by the timer started by start(), or by whoever keeps track
+        of the time limit instead."""
+        self._lock.acquire()
+        try:
+            self._timeoutReached = True
+            for proc in self._procs:
+                killProcessAndChildren(proc.pid)
+            self._procs = []
+        finally:
+            self._lock.release()
+
+class ExecuteCommandTimeoutException(Exception):
+    """ExecuteCommandTimeoutException - Raised by executeCommand() when the
+    command exceeds its time limit, with whatever the command output before
+    it was killed."""
+
+    def __init__(self, msg, out, err, exitCode):
+        Exception.__init__(self, msg)
+        self.msg = msg
+        self.out = out
+        self.err = err
+        self.exitCode = exitCode
+
 # Close extra file handles on UNIX (on Windows this cannot be done while
 # also redirecting input).
 kUseCloseFDs = not (platform.system() == 'Windows')
-def executeCommand(command, cwd=None, env=None):
-    p = subprocess.Popen(command, cwd=cwd,
-                         stdin=subprocess.PIPE,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         env=env, close_fds=kUseCloseFDs)
-    out,err = p.communicate()
-    exitCode = p.wait()
+def executeCommand(command, cwd=None, env=None, timeout=0):
+    """
+    executeCommand(command, [cwd], [env], [timeout]) -> (out, err, exitCode)
+
+    Execute the given command (an argv list), and return its output and exit
+    code. If timeout is non-zero and the command takes longer than timeout
+    seconds, it is killed along with its descendants and
+    ExecuteCommandTimeoutException is raised.
+    """
+    timeoutHelper = TimeoutHelper(timeout)
+    kwargs = {}
+    if timeoutHelper.active():
+        kwargs = kNewProcessGroupArgs
+    p = Popen(command, cwd=cwd,
+              stdin=subprocess.PIPE,
+              stdout=subprocess.PIPE,
+              stderr=subprocess.PIPE,
+              env=env, close_fds=kUseCloseFDs, **kwargs)
+    timeoutHelper.addProcess(p)
+    timeoutHelper.start()
+    try:
+        out,err = p.communicate()
+        exitCode = p.wait()
+    finally:
+        timeoutHelper.cancel()
+    usage = getResourceUsage()
+    if usage is not None:
+        usage.addOutput(out, err)
 
     # Detect Ctrl-C in subprocess.
     if exitCode == -signal.SIGINT:
@@ -166,4 +432,8 @@ def executeCommand(command, cwd=None, env=None):
     except:
         err = str(err)
 
+    if timeoutHelper.timeoutReached():
+        raise ExecuteCommandTimeoutException(
+            'Reached timeout of %s seconds' % (timeout,), out, err, exitCode)
+
     return out, err, exitCode
@@ -0,0 +1 @@
+print('tool')
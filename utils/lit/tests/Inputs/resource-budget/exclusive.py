@@ -0,0 +1,14 @@
+# Fail if another test holding the same lock is running at the same time.
+
+import os
+import sys
+import time
+
+path = os.path.join(sys.argv[1], sys.argv[2])
+try:
+    os.mkdir(path)
+except OSError:
+    print('another test is using %s' % sys.argv[2])
+    sys.exit(1)
+time.sleep(0.2)
+os.rmdir(path)
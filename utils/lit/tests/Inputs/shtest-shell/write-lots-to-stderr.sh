@@ -0,0 +1,9 @@
+#!/bin/sh
+
+# Write more to stderr than fits in a pipe buffer.
+i=0
+while [ $i -lt 2000 ]; do
+  echo "a line of padding on stderr, which is repeated many times over" 1>&2
+  i=$((i + 1))
+done
+echo "a line on stdout"
@@ -0,0 +1,11 @@
+# Spawn a child which never exits (and holds on to the output of the test),
+# then never exit either.
+
+import subprocess
+import sys
+import time
+
+subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3600)'])
+print('started')
+sys.stdout.flush()
+time.sleep(3600)
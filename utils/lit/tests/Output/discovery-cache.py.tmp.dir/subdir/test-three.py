@@ -0,0 +1 @@
+# RUN: true
@@ -0,0 +1,56 @@
+# Check that --changed only runs the tests affected by the changed files,
+# according to the dependencies recorded for the tests.
+#
+# Without a recorded index, every test is affected.
+#
+# RUN: rm -rf %t.cache
+# RUN: %{lit} -j 1 -v --cache-dir %t.cache \
+# RUN:   --changed %{inputs}/affected-tests/data/a.in %{inputs}/affected-tests \
+# RUN:   | FileCheck --check-prefix=CHECK-ALL %s
+#
+# CHECK-ALL: -- Testing: 4 tests
+#
+# RUN: %{lit} -j 1 -v --cache-dir %t.cache \
+# RUN:   --changed %{inputs}/affected-tests/data/a.in %{inputs}/affected-tests \
+# RUN:   | FileCheck --check-prefix=CHECK-A %s
+#
+# CHECK-A: -- Testing: 2 of 4 tests
+# CHECK-A: PASS: affected-tests :: a.txt
+# CHECK-A: PASS: affected-tests :: both.txt
+#
+# The changed paths can be read from a file, and include test sources.
+#
+# RUN: %{python} %s %t.list %{inputs}/affected-tests/data/tool.py \
+# RUN:   %{inputs}/affected-tests/b.txt
+# RUN: %{lit} -j 1 -v --cache-dir %t.cache --changed @%t.list \
+# RUN:   %{inputs}/affected-tests | FileCheck --check-prefix=CHECK-LIST %s
+#
+# CHECK-LIST: -- Testing: 2 of 4 tests
+# CHECK-LIST: PASS: affected-tests :: b.txt
+# CHECK-LIST: PASS: affected-tests :: tool.txt
+#
+# A changed directory affects the tests depending on the files in it, and a
+# changed configuration file affects every test.
+#
+# RUN: %{lit} -j 1 -v --cache-dir %t.cache \
+# RUN:   --changed %{inputs}/affected-tests/data %{inputs}/affected-tests \
+# RUN:   | FileCheck --check-prefix=CHECK-ALL %s
+# RUN: %{lit} -j 1 -v --cache-dir %t.cache \
+# RUN:   --changed %{inputs}/affected-tests/lit.cfg %{inputs}/affected-tests \
+# RUN:   | FileCheck --check-prefix=CHECK-ALL %s
+#
+# RUN: %{lit} -j 1 -v --cache-dir %t.cache \
+# RUN:   --changed %{inputs}/affected-tests/unrelated %{inputs}/affected-tests \
+# RUN:   | FileCheck --check-prefix=CHECK-NONE %s
+#
+# CHECK-NONE: -- Testing: 0 of 4 tests
+#
+# END.
+
+import sys
+
+# Write the given paths to a file, one per line.
+f = open(sys.argv[1], 'w')
+for path in sys.argv[2:]:
+    f.write(path + '\n')
+f.close()
@@ -0,0 +1,30 @@
+# Check that tests executed on an asyncio event loop all report their results,
+# for both the internal and the external shell.
+#
+# REQUIRES: asyncio
+#
+# RUN: not %{lit} -j 4 --executor=asyncio --ignore-test-times \
+# RUN:   %{inputs}/shtest-format > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# Time limits are enforced by the event loop.
+#
+# RUN: not %{lit} -j 2 -v --executor=asyncio --timeout 1 --ignore-test-times \
+# RUN:   %{inputs}/timeout > %t.out
+# RUN: FileCheck --check-prefix=CHECK-TIMEOUT < %t.out %s
+#
+# END.
+
+# CHECK: -- Testing: 14 tests, 4 threads --
+# CHECK: Expected Passes    : 4
+# CHECK: Expected Failures  : 3
+# CHECK: Unsupported Tests  : 2
+# CHECK: Unresolved Tests   : 1
+# CHECK: Unexpected Passes  : 1
+# CHECK: Unexpected Failures: 3
+
+# CHECK-TIMEOUT: TIMEOUT: timeout :: hang.txt
+# CHECK-TIMEOUT: Reached timeout of 1 seconds
+# CHECK-TIMEOUT: Timed Out Tests (1):
+# CHECK-TIMEOUT-NEXT: timeout :: hang.txt
+# CHECK-TIMEOUT: Expected Passes    : 1
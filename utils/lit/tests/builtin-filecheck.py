@@ -0,0 +1,33 @@
+# Check that FileCheck is executed in-process by the internal shell, with the
+# same results and diagnostics as the tool.
+#
+# RUN: not %{lit} -j 1 -v %{inputs}/builtin-filecheck > %t.out
+# RUN: FileCheck < %t.out %s
+# RUN: not %{lit} -j 1 -v --filecheck=tool %{inputs}/builtin-filecheck \
+# RUN:   > %t.out
+# RUN: FileCheck --check-prefix=CHECK-TOOL < %t.out %s
+#
+# In the conformance mode, both are executed, and the tests only pass if they
+# agree.
+#
+# RUN: not %{lit} -j 1 -v --filecheck=conformance \
+# RUN:   %{inputs}/builtin-filecheck > %t.out
+# RUN: FileCheck --check-prefix=CHECK-TOOL < %t.out %s
+#
+# CHECK-TOOL: FAIL: builtin-filecheck :: fail.txt
+# CHECK-TOOL: fail.txt:3:8: error: expected string not found in input
+# CHECK-TOOL: PASS: builtin-filecheck :: not.txt
+# CHECK-TOOL: PASS: builtin-filecheck :: pass.txt
+#
+# CHECK: FAIL: builtin-filecheck :: fail.txt
+# CHECK: fail.txt:3:8: error: expected string not found in input
+# CHECK-NEXT: CHECK: goodbye
+# CHECK-NEXT: {{^       \^}}
+# CHECK: <stdin>:1:1: note: scanning from here
+# CHECK-NEXT: hello
+# CHECK-NEXT: {{^\^}}
+# CHECK: PASS: builtin-filecheck :: not.txt
+# CHECK: PASS: builtin-filecheck :: pass.txt
+# CHECK: Process Spawns Avoided: 12
+# CHECK: Expected Passes    : 2
+# CHECK: Unexpected Failures: 1
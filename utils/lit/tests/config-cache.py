@@ -0,0 +1,35 @@
+# Check that the compiled configuration files are cached, and that changes
+# made by local configuration files don't leak into the configs of other
+# directories.
+#
+# RUN: rm -rf %t.dir %t.cache && cp -r %{inputs}/config-cache %t.dir
+# RUN: %{lit} -v --cache-dir %t.cache %t.dir | FileCheck %s
+# RUN: %{python} %s %t.cache/configs | FileCheck --check-prefix=ENTRIES-4 %s
+# RUN: %{lit} -v --cache-dir %t.cache %t.dir | FileCheck %s
+# RUN: %{python} %s %t.cache/configs | FileCheck --check-prefix=ENTRIES-4 %s
+#
+# CHECK: PASS: config-cache :: local/test.txt
+# CHECK: PASS: config-cache :: sibling/test.test
+# CHECK: PASS: config-cache :: test.txt
+#
+# ENTRIES-4: 4 entries
+#
+# A changed configuration file is compiled again.
+#
+# RUN: %{python} -c "print('config.unsupported = True')" \
+# RUN:   >> %t.dir/local/lit.local.cfg
+# RUN: %{lit} -v --cache-dir %t.cache %t.dir \
+# RUN:   | FileCheck --check-prefix=CHECK-CHANGED %s
+# RUN: %{python} %s %t.cache/configs | FileCheck --check-prefix=ENTRIES-5 %s
+#
+# CHECK-CHANGED: UNSUPPORTED: config-cache :: local/test.txt
+# CHECK-CHANGED: PASS: config-cache :: sibling/test.test
+#
+# ENTRIES-5: 5 entries
+#
+# END.
+
+import os
+import sys
+
+print('%d entries' % (sum(len(files) for _,_,files in os.walk(sys.argv[1])),))
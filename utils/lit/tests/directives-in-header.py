@@ -0,0 +1,7 @@
+# Check that only the first block of commands of a test is used, if the suite
+# sets directives_in_header.
+#
+# RUN: not %{lit} -j 1 -v %{inputs}/directives-in-header | FileCheck %s
+#
+# CHECK: PASS: directives-in-header :: header.txt
+# CHECK: FAIL: directives-in-header :: leading-comment.txt
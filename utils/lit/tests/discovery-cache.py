@@ -0,0 +1,52 @@
+# Check that the persistent discovery cache reuses the listing of a directory
+# whose modification time has not changed, and is refreshed when it has.
+#
+# RUN: rm -rf %t.dir %t.cache && cp -r %{inputs}/discovery %t.dir
+# RUN: %{python} %s %t.dir
+# RUN: %{lit} --cache-dir %t.cache --show-tests %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-INITIAL < %t.out %s
+#
+# CHECK-INITIAL: -- Available Tests --
+# CHECK-INITIAL-NEXT: sub-suite :: test-one
+# CHECK-INITIAL-NEXT: sub-suite :: test-two
+# CHECK-INITIAL-NEXT: top-level-suite :: subdir/test-three
+# CHECK-INITIAL-NEXT: top-level-suite :: test-one
+# CHECK-INITIAL-NEXT: top-level-suite :: test-two
+#
+# Adding a test updates the modification time of the directory, so the new test
+# is found.
+#
+# RUN: echo "RUN: true" > %t.dir/test-three.txt
+# RUN: %{lit} --cache-dir %t.cache --show-tests %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-ADDED < %t.out %s
+#
+# CHECK-ADDED: top-level-suite :: test-one
+# CHECK-ADDED-NEXT: top-level-suite :: test-three
+# CHECK-ADDED-NEXT: top-level-suite :: test-two
+#
+# If the modification time is unchanged, the cached listing is used (which is
+# only observable by resetting it behind lit's back).
+#
+# RUN: %{python} %s %t.dir
+# RUN: %{lit} --cache-dir %t.cache --show-tests %t.dir > %t.out
+# RUN: echo "RUN: true" > %t.dir/test-four.txt
+# RUN: %{python} %s %t.dir
+# RUN: %{lit} --cache-dir %t.cache --show-tests %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-CACHED < %t.out %s
+# RUN: %{lit} --no-discovery-cache --show-tests %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-UNCACHED < %t.out %s
+#
+# CHECK-CACHED: top-level-suite :: test-one
+# CHECK-CACHED-NEXT: top-level-suite :: test-three
+# CHECK-CACHED-NEXT: top-level-suite :: test-two
+#
+# CHECK-UNCACHED: top-level-suite :: test-four
+# CHECK-UNCACHED-NEXT: top-level-suite :: test-one
+
+import os
+import sys
+
+# Move the modification times of all the directories into the past, so their
+# listings are not considered too recent to persist.
+for dirpath,dirnames,filenames in os.walk(sys.argv[1]):
+    os.utime(dirpath, (1000000000, 1000000000))
@@ -26,6 +26,15 @@
 # CHECK-BASIC-OUT: top-level-suite :: test-two
 
 
+# Check that discovery searches directories in parallel without changing the
+# set or order of the tests.
+#
+# RUN: %{lit} %{inputs}/discovery \
+# RUN:   -j 4 --show-tests --show-suites \
+# RUN:   -v > %t.out
+# RUN: FileCheck --check-prefix=CHECK-BASIC-OUT < %t.out %s
+
+
 # Check discovery when exact test names are given.
 #
 # RUN: %{lit} \
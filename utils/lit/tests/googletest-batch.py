@@ -0,0 +1,40 @@
+# Check the batched execution of GoogleTest tests.
+#
+# RUN: not %{lit} -j 1 -v %{inputs}/googletest-batch > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# END.
+
+# The first batch crashes, so its tests are run again one by one.
+#
+# CHECK: -- Testing: 5 tests, 1 threads --
+# CHECK: FAIL: googletest-batch :: DummySubDir/OneTest/batch-1-of-2
+# CHECK: FAIL CrashTest.crash:
+# CHECK-NEXT: [ RUN      ] CrashTest.crash
+# CHECK-NEXT: I am the crash test, I crash
+# CHECK: FAIL FirstTest.subTestB:
+# CHECK-NEXT: [ RUN      ] FirstTest.subTestB
+# CHECK-NEXT: I am subTest B, I FAIL
+# CHECK-NEXT: And I have two lines of output
+# CHECK: PASS: googletest-batch :: DummySubDir/OneTest/batch-2-of-2
+# CHECK: Failing Tests (2)
+# CHECK-NEXT: googletest-batch :: DummySubDir/OneTest/CrashTest.crash
+# CHECK-NEXT: googletest-batch :: DummySubDir/OneTest/FirstTest.subTestB
+# CHECK: Expected Passes    : 3
+# CHECK: Unexpected Failures: 2
+
+# A failure is reported from the output of the batch.
+#
+# RUN: not %{lit} -j 1 -v --filter 'subTest' %{inputs}/googletest-batch \
+# RUN:   | FileCheck --check-prefix=CHECK-FILTERED %s
+#
+# CHECK-FILTERED: -- Testing: 4 of 5 tests, 1 threads --
+# CHECK-FILTERED: FAIL: googletest-batch :: DummySubDir/OneTest/batch-1-of-2
+# CHECK-FILTERED: FAIL FirstTest.subTestB:
+# CHECK-FILTERED-NEXT: [ RUN      ] FirstTest.subTestB
+# CHECK-FILTERED-NEXT: I am subTest B, I FAIL
+# CHECK-FILTERED-NEXT: And I have two lines of output
+# CHECK-FILTERED-NEXT: [  FAILED  ] FirstTest.subTestB (0 ms)
+# CHECK-FILTERED: PASS: googletest-batch :: DummySubDir/OneTest/batch-2-of-2
+# CHECK-FILTERED: Failing Tests (1)
+# CHECK-FILTERED: Expected Passes    : 3
@@ -0,0 +1,47 @@
+# Check that --incremental reuses the results of unchanged tests which passed or
+# failed as expected, and reruns everything else.
+#
+# RUN: rm -rf %t.dir %t.cache && cp -r %{inputs}/incremental %t.dir
+#
+# RUN: not %{lit} -j 1 --incremental --cache-dir %t.cache %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-FIRST < %t.out %s
+#
+# CHECK-FIRST: Cached Results: 0 of 4
+#
+# RUN: not %{lit} -j 1 --incremental --cache-dir %t.cache %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-SECOND < %t.out %s
+#
+# CHECK-SECOND: Cached Results: 3 of 4
+# CHECK-SECOND: Expected Passes    : 2
+# CHECK-SECOND: Expected Failures  : 1
+# CHECK-SECOND: Unexpected Failures: 1
+#
+# RUN: echo "# Changed." >> %t.dir/pass.txt
+# RUN: not %{lit} -j 1 --incremental --cache-dir %t.cache %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-CHANGED < %t.out %s
+#
+# CHECK-CHANGED: Cached Results: 2 of 4
+#
+# Inputs named by options are part of the key too.
+#
+# RUN: echo "changed input" > %t.dir/option-input.in
+# RUN: not %{lit} -j 1 --incremental --cache-dir %t.cache %t.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-INPUT < %t.out %s
+#
+# CHECK-INPUT: Cached Results: 2 of 4
+#
+# A result is only reused while the test is still expected to fail (or not),
+# which can change without the test changing.
+#
+# RUN: rm -rf %t.xfail.dir %t.xfail.cache
+# RUN: cp -r %{inputs}/incremental-xfail %t.xfail.dir
+# RUN: %{lit} -j 1 --incremental --cache-dir %t.xfail.cache --param foo=1 \
+# RUN:   %t.xfail.dir > %t.out
+# RUN: FileCheck --check-prefix=CHECK-EXPECTED < %t.out %s
+# RUN: not %{lit} -j 1 --incremental --cache-dir %t.xfail.cache %t.xfail.dir \
+# RUN:   > %t.out
+# RUN: FileCheck --check-prefix=CHECK-NOT-EXPECTED < %t.out %s
+#
+# CHECK-EXPECTED: Expected Failures  : 1
+# CHECK-NOT-EXPECTED: Cached Results: 0 of 1
+# CHECK-NOT-EXPECTED: Unexpected Failures: 1
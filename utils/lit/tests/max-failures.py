@@ -0,0 +1,26 @@
+# Check that no more tests are started once --max-failures tests have failed,
+# and that the remaining tests are reported as skipped.
+#
+# RUN: not %{lit} -j 1 --max-failures 2 %{inputs}/max-failures > %t.out
+# RUN: FileCheck --check-prefix=CHECK-LIMIT < %t.out %s
+#
+# CHECK-LIMIT: PASS: max-failures :: a.txt (1 of 6)
+# CHECK-LIMIT-NEXT: FAIL: max-failures :: b.txt (2 of 6)
+# CHECK-LIMIT-NEXT: FAIL: max-failures :: c.txt (3 of 6)
+# CHECK-LIMIT-NEXT: Testing Time
+# CHECK-LIMIT: Expected Passes    : 1
+# CHECK-LIMIT-NEXT: Skipped Tests      : 3
+# CHECK-LIMIT-NEXT: Unexpected Failures: 2
+
+# Check that the tests which failed in the previous run are run first.
+#
+# RUN: rm -f %t.json
+# RUN: not %{lit} -j 1 --results-file %t.json %{inputs}/max-failures
+# RUN: not %{lit} -j 1 --failed-first --results-file %t.json \
+# RUN:   %{inputs}/max-failures > %t.out
+# RUN: FileCheck --check-prefix=CHECK-FIRST < %t.out %s
+#
+# CHECK-FIRST: FAIL: max-failures :: b.txt (1 of 6)
+# CHECK-FIRST-NEXT: FAIL: max-failures :: c.txt (2 of 6)
+# CHECK-FIRST-NEXT: FAIL: max-failures :: d.txt (3 of 6)
+# CHECK-FIRST-NEXT: PASS: max-failures :: a.txt (4 of 6)
@@ -0,0 +1,37 @@
+# Check that the output of results can be spilled to disk and dropped, and
+# that failures are reported the same whatever is done with the output of the
+# tests which pass.
+#
+# RUN: %{python} %s
+# RUN: not %{lit} -j 1 -v --output-retention=spill %{inputs}/max-failures \
+# RUN:   | FileCheck %s
+# RUN: not %{lit} -j 1 -v --output-retention=drop %{inputs}/max-failures \
+# RUN:   | FileCheck %s
+#
+# CHECK: FAIL: max-failures :: b.txt
+# CHECK: Exit Code: 1
+# CHECK: Failing Tests (3):
+#
+# END.
+
+import pickle
+
+import lit.Test
+
+result = lit.Test.Result(lit.Test.PASS, 'output\n' * 100, 1.0)
+result.addMetric('value', lit.Test.IntMetricValue(1))
+spool = lit.Test.OutputSpool()
+result.spillOutput(spool)
+assert isinstance(result._output, lit.Test.SpilledOutput)
+assert result.output == 'output\n' * 100
+
+# Pickling a result (to send it back from a worker process) takes the output
+# out of the spool.
+copy = pickle.loads(pickle.dumps(result, 2))
+assert copy.output == result.output
+assert not isinstance(copy._output, lit.Test.SpilledOutput)
+assert copy.code is lit.Test.PASS and copy.elapsed == 1.0
+assert copy.metrics['value'].value == 1
+
+result.dropOutput()
+assert result.output == ''
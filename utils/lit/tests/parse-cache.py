@@ -0,0 +1,47 @@
+# Check that the parsed RUN lines of a test are cached, and only parsed again
+# when the lines change.
+#
+# RUN: rm -rf %t.cache
+# RUN: %{python} %s %t.cache
+#
+# END.
+
+import sys
+
+import lit.ScriptCache
+import lit.ShUtil
+
+parsed = []
+def parse(lines, win32Escapes, pipefail):
+    parsed.append(list(lines))
+    return [lit.ShUtil.ShParser(ln, win32Escapes, pipefail).parse()
+            for ln in lines]
+
+cache = lit.ScriptCache.ScriptCache(sys.argv[1])
+lines = ['echo %s | FileCheck %s' % ('x' * 200, 'y' * 200)]
+first = cache.getParsedScript('/a/test.txt', lines, False, False, parse)
+second = cache.getParsedScript('/a/test.txt', lines, False, False, parse)
+assert second == first, (first, second)
+assert len(parsed) == 1, parsed
+
+# The entries of each test are separate, and revalidated with the lines.
+cache.getParsedScript('/a/other.txt', lines, False, False, parse)
+assert len(parsed) == 2, parsed
+changed = ['true && ' + lines[0]]
+third = cache.getParsedScript('/a/test.txt', changed, False, False, parse)
+assert len(parsed) == 3, parsed
+assert third != first
+
+# Short scripts aren't worth caching, and parse errors aren't cached.
+cache.getParsedScript('/a/test.txt', ['true'], False, False, parse)
+cache.getParsedScript('/a/test.txt', ['true'], False, False, parse)
+assert len(parsed) == 5, parsed
+for i in range(2):
+    try:
+        cache.getParsedScript('/a/bad.txt', ['|' + lines[0]], False, False,
+                              parse)
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected a parse error'
+assert len(parsed) == 7, parsed
@@ -0,0 +1,52 @@
+# Check that tests declaring the resources they use are only run while those
+# fit in the budget, and never at the same time as another test holding the
+# same lock.
+#
+# RUN: rm -rf %t.locks && mkdir %t.locks
+# RUN: %{lit} -j 4 --ignore-test-times --max-memory 1000 \
+# RUN:   --param lockdir=%t.locks %{inputs}/resource-budget > %t.out
+# RUN: FileCheck --check-prefix=CHECK-BUDGET < %t.out %s
+#
+# CHECK-BUDGET: -- Testing: 8 tests, 4 threads --
+# CHECK-BUDGET: Expected Passes    : 8
+
+# Check that tests which don't fit are deferred, while cheaper tests are
+# started in their place.
+#
+# RUN: %{python} %s > %t.out
+# RUN: FileCheck --check-prefix=CHECK-ORDER < %t.out %s
+#
+# CHECK-ORDER: get: 0
+# CHECK-ORDER-NEXT: get: 2
+# CHECK-ORDER-NEXT: get: 3
+# CHECK-ORDER-NEXT: release: 0
+# CHECK-ORDER-NEXT: get: 1
+# CHECK-ORDER-NEXT: release: 1
+# CHECK-ORDER-NEXT: release: 2
+# CHECK-ORDER-NEXT: release: 3
+# CHECK-ORDER-NEXT: get: None
+#
+# END.
+
+import lit.run
+
+costs = [(600, 1), (600, 1), (0, 1), (0, 1)]
+provider = lit.run.ResourceTestProvider(costs, 4, lit.run.LockedValue(0),
+                                        costs, 1000)
+
+def get():
+    print('get: %s' % (provider.get(),))
+
+def release(test_index):
+    provider.release(test_index)
+    print('release: %d' % (test_index,))
+
+get()
+get()
+get()
+release(0)
+get()
+release(1)
+release(2)
+release(3)
+get()
@@ -0,0 +1,28 @@
+# Check the tracking of the resources used by the processes of each test.
+#
+# RUN: %{lit} -j 1 --resource-usage %{inputs}/resource-usage > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# END.
+
+# CHECK: PASS: resource-usage :: allocate.txt
+# CHECK-NEXT: *** TEST 'resource-usage :: allocate.txt' RESULTS ***
+# CHECK-NEXT: cpu_system_time: {{[0-9.]+}}
+# CHECK-NEXT: cpu_user_time: {{[0-9.]+}}
+# CHECK-NEXT: max_rss_kb: {{[1-9][0-9][0-9][0-9][0-9]+}}
+# CHECK-NEXT: num_processes: 1
+# CHECK-NEXT: output_bytes: 6
+# CHECK-NEXT: ***
+# CHECK: PASS: resource-usage :: builtins.txt
+# CHECK-NEXT: *** TEST 'resource-usage :: builtins.txt' RESULTS ***
+# CHECK: num_processes: 0
+
+# Only tests which spawned processes are ranked.
+#
+# CHECK: Most CPU Intensive Tests:
+# CHECK-NEXT: ---
+# CHECK-NEXT: {{[0-9.]+}}s: resource-usage :: allocate.txt
+# CHECK: Largest Memory Users (Maximum Resident Set Size):
+# CHECK-NEXT: ---
+# CHECK-NEXT: {{[0-9]+}}K: resource-usage :: allocate.txt
+# CHECK: Expected Passes    : 2
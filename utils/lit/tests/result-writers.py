@@ -0,0 +1,36 @@
+# Check the machine readable reports of the test results.
+#
+# RUN: not %{lit} -j 1 --jsonl-output %t.jsonl --xunit-xml-output %t.xml \
+# RUN:   %{inputs}/shtest-format %{inputs}/test-data \
+# RUN:   %{inputs}/googletest-batch > %t.out
+# RUN: FileCheck --check-prefix=CHECK-JSONL < %t.jsonl %s
+# RUN: FileCheck --check-prefix=CHECK-XUNIT < %t.xml %s
+#
+# END.
+
+# The tests of a batch are reported individually.
+#
+# CHECK-JSONL: {"code": "FAIL", {{.*}} "name": "googletest-batch :: DummySubDir/OneTest/CrashTest.crash", "output": "[ RUN      ] CrashTest.crash\nI am the crash test, I crash\n"}
+# CHECK-JSONL: {"code": "PASS", {{.*}} "name": "googletest-batch :: DummySubDir/OneTest/FirstTest.subTestA",
+# CHECK-JSONL: {"code": "UNRESOLVED", {{.*}} "is_failure": true, {{.*}} "name": "shtest-format :: no-test-line.txt", "output": "Test has no run line!"}
+# CHECK-JSONL: {"code": "XFAIL", {{.*}} "is_failure": false, {{.*}} "name": "shtest-format :: xfail.txt",
+# CHECK-JSONL: {"code": "PASS", "elapsed": {{[0-9.e-]+}}, "is_failure": false, "metrics": {"value0": 1, "value1": 2.3456}, "name": "test-data :: metrics.ini",
+
+# CHECK-XUNIT: <?xml version="1.0" encoding="UTF-8"?>
+# CHECK-XUNIT-NEXT: <testsuites>
+# CHECK-XUNIT-NEXT: <testsuite name="googletest-batch" tests="5" failures="2" skipped="0">
+# CHECK-XUNIT-NEXT: <testcase classname="googletest-batch.DummySubDir.OneTest" name="CrashTest.crash" time="{{[0-9.]+}}">
+# CHECK-XUNIT-NEXT:   <failure message="FAIL"><!{{\[CDATA\[\[}} RUN      ] CrashTest.crash
+# CHECK-XUNIT-NEXT: I am the crash test, I crash
+# CHECK-XUNIT-NEXT: ]]></failure>
+# CHECK-XUNIT-NEXT: </testcase>
+# CHECK-XUNIT: </testsuite>
+# CHECK-XUNIT-NEXT: <testsuite name="shtest-format" tests="14" failures="5" skipped="5">
+# CHECK-XUNIT: <testcase classname="shtest-format.external_shell" name="pass.txt" time="{{[0-9.]+}}"/>
+# CHECK-XUNIT: <testcase classname="shtest-format" name="requires-missing.txt" time="{{[0-9.]+}}">
+# CHECK-XUNIT-NEXT:   <skipped message="UNSUPPORTED"/>
+# CHECK-XUNIT: </testsuite>
+# CHECK-XUNIT-NEXT: <testsuite name="test-data" tests="1" failures="0" skipped="0">
+# CHECK-XUNIT-NEXT: <testcase classname="test-data" name="metrics.ini" time="{{[0-9.]+}}"/>
+# CHECK-XUNIT-NEXT: </testsuite>
+# CHECK-XUNIT-NEXT: </testsuites>
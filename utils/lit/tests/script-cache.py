@@ -0,0 +1,36 @@
+# Check that the RUN lines of large test files are cached, and only scanned
+# again when the modification time or size of the file changes.
+#
+# RUN: rm -rf %t.dir %t.cache && mkdir %t.dir
+# RUN: cp %{inputs}/script-cache/lit.cfg %t.dir
+# RUN: %{python} %s %t.dir/large.txt "true "
+# RUN: %{lit} -v --cache-dir %t.cache %t.dir | FileCheck %s
+#
+# The RUN line is replaced behind lit's back, so the cached line is used.
+#
+# RUN: %{python} %s %t.dir/large.txt false
+# RUN: %{lit} -v --cache-dir %t.cache %t.dir | FileCheck %s
+#
+# CHECK: PASS: script-cache :: large.txt
+#
+# RUN: not %{lit} -v --no-script-cache %t.dir \
+# RUN:   | FileCheck --check-prefix=CHECK-UNCACHED %s
+# RUN: %{python} %s %t.dir/large.txt "false "
+# RUN: not %{lit} -v --cache-dir %t.cache %t.dir \
+# RUN:   | FileCheck --check-prefix=CHECK-UNCACHED %s
+#
+# CHECK-UNCACHED: FAIL: script-cache :: large.txt
+#
+# END.
+
+import os
+import sys
+
+# Write a test file large enough to be cached, which runs the given command,
+# with a modification time in the past so it isn't considered too recent to
+# cache.
+f = open(sys.argv[1], 'w')
+f.write('RUN: %s\n' % (sys.argv[2],))
+f.write('# Some padding.\n' * 8192)
+f.close()
+os.utime(sys.argv[1], (1000000000, 1000000000))
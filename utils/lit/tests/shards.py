@@ -0,0 +1,61 @@
+# Check that the tests are split into shards.
+#
+# RUN: not %{lit} -j 1 --num-shards 2 --run-shard 1 \
+# RUN:   --results-file %t.1.json %{inputs}/shards > %t.out
+# RUN: FileCheck --check-prefix=CHECK-SHARD1 < %t.out %s
+# RUN: env LIT_NUM_SHARDS=2 LIT_RUN_SHARD=2 \
+# RUN:   %{lit} -j 1 --results-file %t.2.json %{inputs}/shards > %t.out
+# RUN: FileCheck --check-prefix=CHECK-SHARD2 < %t.out %s
+#
+# CHECK-SHARD1: -- Testing: 3 of 5 tests, shard 1 of 2, 1 threads --
+# CHECK-SHARD1: PASS: shards :: a.txt
+# CHECK-SHARD1: PASS: shards :: c.txt
+# CHECK-SHARD1: FAIL: shards :: e.txt
+# CHECK-SHARD1: Expected Passes    : 2
+# CHECK-SHARD1: Unexpected Failures: 1
+#
+# CHECK-SHARD2: -- Testing: 2 of 5 tests, shard 2 of 2, 1 threads --
+# CHECK-SHARD2: PASS: shards :: b.txt
+# CHECK-SHARD2: PASS: shards :: d.txt
+# CHECK-SHARD2: Expected Passes    : 2
+
+# Check that the results files of the shards are merged into one summary.
+#
+# RUN: not %{lit} -v --merge-results %t.1.json %t.2.json > %t.out
+# RUN: FileCheck --check-prefix=CHECK-MERGED < %t.out %s
+#
+# CHECK-MERGED: -- Merged: 5 tests from 2 results files --
+# CHECK-MERGED: ******************** TEST 'shards :: e.txt' FAILED
+# CHECK-MERGED: Failing Tests (1):
+# CHECK-MERGED-NEXT: shards :: e.txt
+# CHECK-MERGED: Expected Passes    : 4
+# CHECK-MERGED: Unexpected Failures: 1
+
+# Check that the shards are balanced by the times in a results file, estimating
+# unknown tests with the average time.
+#
+# RUN: %{lit} -j 1 --num-shards 2 --run-shard 1 \
+# RUN:   --shard-times %{inputs}/shards/times.json %{inputs}/shards > %t.out
+# RUN: FileCheck --check-prefix=CHECK-BALANCED1 < %t.out %s
+# RUN: not %{lit} -j 1 --num-shards 2 --run-shard 2 \
+# RUN:   --shard-times %{inputs}/shards/times.json %{inputs}/shards > %t.out
+# RUN: FileCheck --check-prefix=CHECK-BALANCED2 < %t.out %s
+#
+# CHECK-BALANCED1: -- Testing: 1 of 5 tests, shard 1 of 2, 1 threads --
+# CHECK-BALANCED1: PASS: shards :: a.txt
+#
+# CHECK-BALANCED2: -- Testing: 4 of 5 tests, shard 2 of 2, 1 threads --
+# CHECK-BALANCED2: PASS: shards :: b.txt
+# CHECK-BALANCED2: PASS: shards :: c.txt
+# CHECK-BALANCED2: PASS: shards :: d.txt
+# CHECK-BALANCED2: FAIL: shards :: e.txt
+
+# Check the validation of the options.
+#
+# RUN: not %{lit} --num-shards 2 --run-shard 3 %{inputs}/shards 2> %t.err
+# RUN: FileCheck --check-prefix=CHECK-RANGE < %t.err %s
+# RUN: not %{lit} --num-shards 2 %{inputs}/shards 2> %t.err
+# RUN: FileCheck --check-prefix=CHECK-PAIR < %t.err %s
+#
+# CHECK-RANGE: error: --run-shard must be between 1 and 2
+# CHECK-PAIR: error: --num-shards and --run-shard must be used together
@@ -0,0 +1,36 @@
+# Check that the scripts of tests using the external shell are executed by a
+# persistent shell, without any state leaking from one test to the next.
+#
+# RUN: not %{lit} -j 1 -v %{inputs}/shell-server > %t.out
+# RUN: FileCheck < %t.out %s
+# RUN: FileCheck --check-prefix=SERVER < %t.out %s
+# RUN: not %{lit} -j 1 -v --no-shell-server %{inputs}/shell-server > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# CHECK: FAIL: shell-server :: 1-change-state.txt
+# CHECK: Exit Code: 3
+# CHECK: Command Output (stdout):
+# CHECK-NEXT: --
+# CHECK-NEXT: pid
+# CHECK: PASS: shell-server :: 2-check-state.txt
+# CHECK: PASS: shell-server :: 3-stdin.txt
+# CHECK: FAIL: shell-server :: 4-output.txt
+# CHECK: Exit Code: 1
+# CHECK: Command Output (stdout):
+# CHECK-NEXT: --
+# CHECK-NEXT: pid
+# CHECK-NEXT: no newline
+# CHECK-NEXT: --
+# CHECK: Command Output (stderr):
+# CHECK-NEXT: --
+# CHECK-NEXT: error
+# CHECK-NEXT: --
+# CHECK: Expected Passes    : 2
+# CHECK: Unexpected Failures: 2
+#
+# Both scripts were executed by the same shell.
+#
+# SERVER: FAIL: shell-server :: 1-change-state.txt
+# SERVER: pid [[PID:[0-9]+]]
+# SERVER: FAIL: shell-server :: 4-output.txt
+# SERVER: pid [[PID]]
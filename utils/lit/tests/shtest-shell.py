@@ -7,6 +7,8 @@
 
 # CHECK: -- Testing:
 
+# CHECK: PASS: shtest-shell :: builtins.txt
+
 # CHECK: FAIL: shtest-shell :: error-0.txt
 # CHECK: *** TEST 'shtest-shell :: error-0.txt' FAILED ***
 # CHECK: Command 0: "not-a-real-command"
@@ -27,7 +29,17 @@
 # CHECK: Unsupported redirect:
 # CHECK: ***
 
+# CHECK: FAIL: shtest-shell :: error-3.txt
+# CHECK: *** TEST 'shtest-shell :: error-3.txt' FAILED ***
+# CHECK: Command 0: "{{.*}}/not-a-real-command"
+# CHECK: Command 0 Result: 127
+# CHECK: Command 0 Stderr:
+# CHECK: '{{.*}}/not-a-real-command': command not found
+# CHECK: ***
+
+# CHECK: PASS: shtest-shell :: pipeline-stderr.txt
 # CHECK: PASS: shtest-shell :: redirects.txt
 # CHECK: PASS: shtest-shell :: sequencing-0.txt
 # CHECK: XFAIL: shtest-shell :: sequencing-1.txt
-# CHECK: Failing Tests (3)
+# CHECK: Process Spawns Avoided:
+# CHECK: Failing Tests (4)
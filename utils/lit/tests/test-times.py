@@ -0,0 +1,49 @@
+# Check that previously recorded test times are used to dispatch the slowest
+# tests first, estimating unknown tests with the suite average.
+#
+# RUN: %{python} %s %{inputs}/test-times > %t.out
+# RUN: FileCheck --check-prefix=CHECK-ORDER < %t.out %s
+#
+# CHECK-ORDER: test-times :: c.txt
+# CHECK-ORDER-NEXT: test-times :: a.txt
+# CHECK-ORDER-NEXT: test-times :: b.txt
+
+# Check that the times of a run are merged into the database.
+#
+# RUN: rm -rf %t.dir && cp -r %{inputs}/test-times %t.dir
+# RUN: %{lit} -j 2 %t.dir
+# RUN: FileCheck --check-prefix=CHECK-RECORD < %t.dir/.lit_test_times.txt %s
+#
+# CHECK-RECORD: {{[0-9.]+}} test-times :: a.txt
+# CHECK-RECORD-NEXT: {{[0-9.]+}} test-times :: b.txt
+# CHECK-RECORD-NEXT: {{[0-9.]+}} test-times :: c.txt
+# CHECK-RECORD-NEXT: 2.000000 test-times :: d.txt
+
+# Check that batches of GoogleTest tests are estimated with the times of their
+# tests.
+#
+# RUN: rm -rf %t.gtest && cp -r %{inputs}/googletest-batch %t.gtest
+# RUN: echo "1.000000 googletest-batch :: DummySubDir/OneTest/FirstTest.subTestA" > %t.gtest/.lit_test_times.txt
+# RUN: echo "10.000000 googletest-batch :: DummySubDir/OneTest/ParameterizedTest/1.subTest" >> %t.gtest/.lit_test_times.txt
+# RUN: %{python} %s %t.gtest --batch > %t.gtest.out
+# RUN: FileCheck --check-prefix=CHECK-BATCH < %t.gtest.out %s
+#
+# CHECK-BATCH: googletest-batch :: DummySubDir/OneTest/batch-2-of-2
+# CHECK-BATCH-NEXT: googletest-batch :: DummySubDir/OneTest/batch-1-of-2
+
+import sys
+
+import lit.discovery
+import lit.TestTimes
+
+input_path = sys.argv[1]
+cases = lit.discovery.load_test_suite([input_path])
+tests = [case._test for case in cases]
+tests.sort(key = lambda t: t.getFullName())
+if sys.argv[2:] == ['--batch']:
+    run = cases._tests[0]._run
+    run.tests = tests
+    run.batch_tests()
+    tests = run.tests
+for index in lit.TestTimes.get_dispatch_order(tests):
+    print(tests[index].getFullName())
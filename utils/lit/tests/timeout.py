@@ -0,0 +1,22 @@
+# Check that tests exceeding their time limit are killed, along with the
+# processes they spawned, and reported as timing out.
+#
+# RUN: not %{lit} -j 1 -v --timeout 1 %{inputs}/timeout > %t.out
+# RUN: FileCheck < %t.out %s
+# RUN: not %{lit} -j 1 -v --timeout 1 --param external=1 %{inputs}/timeout \
+# RUN:   > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# The time limit can also be set by the test suite.
+#
+# RUN: not %{lit} -j 1 -v --param timeout=1 %{inputs}/timeout > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# CHECK: TIMEOUT: timeout :: hang.txt
+# CHECK: Reached timeout of 1 seconds
+# CHECK: started
+# CHECK: PASS: timeout :: quick.txt
+# CHECK: Timed Out Tests (1):
+# CHECK-NEXT: timeout :: hang.txt
+# CHECK: Expected Passes    : 1
+# CHECK: Individual Timeouts: 1
@@ -0,0 +1,15 @@
+# Check that tests executed by the worker process pool all report their results.
+#
+# RUN: not %{lit} -j 2 --use-processes --ignore-test-times \
+# RUN:   %{inputs}/shtest-format > %t.out
+# RUN: FileCheck < %t.out %s
+#
+# END.
+
+# CHECK: -- Testing: 14 tests, 2 threads --
+# CHECK: Expected Passes    : 4
+# CHECK: Expected Failures  : 3
+# CHECK: Unsupported Tests  : 2
+# CHECK: Unresolved Tests   : 1
+# CHECK: Unexpected Passes  : 1
+# CHECK: Unexpected Failures: 3